@@ -0,0 +1,54 @@
+"""Benchmark crossmatching FRB positions against a catalog of sky positions.
+
+Usage:
+    python benchmarks/bench_crossmatch.py [--sources 1000000] [--queries 1000]
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from frbvoe.utilities.crossmatch import Catalog, separation, unit_vectors
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sources", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    # Sources uniform on the sky, with error radii of up to 0.2 degrees.
+    right_ascension = rng.uniform(0.0, 360.0, args.sources)
+    declination = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, args.sources)))
+    errors = rng.uniform(0.0, 0.2, args.sources)
+    queries = rng.integers(0, args.sources, args.queries)
+
+    seconds = timeit.timeit(
+        lambda: Catalog(right_ascension, declination, errors), number=1
+    )
+    print(f"{'build':>12}: {seconds * 1e3:10.1f} ms for {args.sources} sources")
+    catalog = Catalog(right_ascension, declination, errors)
+    vectors = unit_vectors(right_ascension, declination)
+
+    def match():
+        for query in queries:
+            catalog.match(right_ascension[query], declination[query], 0.1)
+
+    def brute_force():
+        for query in queries[:10]:
+            vector = unit_vectors(right_ascension[query], declination[query])
+            separations = separation(vectors, vector)
+            np.nonzero(separations <= np.hypot(0.1, errors))
+
+    for name, run, number in (
+        ("match", match, args.queries),
+        ("brute force", brute_force, 10),
+    ):
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        print(f"{name:>12}: {seconds * 1e6 / number:10.1f} µs/query")
+
+
+if __name__ == "__main__":
+    main()
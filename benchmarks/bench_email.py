@@ -0,0 +1,74 @@
+"""Benchmark composing the VOEvent email for many subscribers.
+
+Compares rendering the email once and copying only its headers per subscriber
+against rendering and encoding a fresh MIMEMultipart per subscriber.
+
+Usage:
+    python benchmarks/bench_email.py [--recipients 1 100 10000]
+"""
+
+import argparse
+import timeit
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from frbvoe.utilities.email import POLICY, Email, render_email
+
+payload = {
+    "kind": "detection",
+    "observatory_name": "CHIME",
+    "date": "2025-01-13 16:55:08.844845",
+    "email": "john.smith@email.com",
+    "sampling_time": 0.001,
+    "bandwidth": 400,
+    "central_frequency": 600,
+    "npol": 2,
+    "bits_per_sample": 2,
+    "tsys": 25.0,
+    "internal_id": "38249195",
+}
+
+
+def per_recipient(recipients):
+    """Renders and encodes one message per recipient."""
+    for recipient in recipients:
+        subject, body = render_email(payload)
+        message = MIMEMultipart()
+        message["From"] = payload["email"]
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.attach(MIMEText(body, "plain"))
+        message.as_bytes(policy=POLICY)
+
+
+def shared(recipients):
+    """Renders the message once and copies its headers per recipient."""
+    email = Email(payload)
+    for recipient in recipients:
+        email.to([recipient])
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, nargs="+", default=[1, 100, 10000])
+    args = parser.parse_args()
+    for count in args.recipients:
+        recipients = [f"subscriber{n}@example.com" for n in range(count)]
+        number = max(1, 10000 // count)
+        for name, compose in (
+            ("shared body", shared),
+            ("per recipient", per_recipient),
+        ):
+            seconds = min(
+                timeit.repeat(lambda: compose(recipients), number=number, repeat=3)
+            )
+            print(
+                f"{count:>6} recipients, {name:>13}: "
+                f"{seconds * 1e3 / number:9.3f} ms/alert, "
+                f"{seconds * 1e6 / number / count:7.2f} µs/recipient"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Benchmark the throughput of the VOEvent server from 1 to N workers.
+
+Load tests the server with every number of workers (see
+`frbvoe.utilities.bench`), with as many concurrent clients per worker, and
+reports the throughput and the scaling efficiency: the speedup over one
+worker divided by the number of workers, 100% being linear. The load
+generator shares the machine, so leave it a CPU.
+
+Usage:
+    python benchmarks/bench_scaling.py [--workers 1 2 4] [--requests 4000]
+        [--clients-per-worker 16] [--mongodb localhost:27017]
+"""
+
+import argparse
+import asyncio
+
+from frbvoe.server import available_cpus
+from frbvoe.utilities.bench import bench
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, max(1, available_cpus() // 2), available_cpus()}),
+    )
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--clients-per-worker", type=int, default=16)
+    parser.add_argument("--mongodb", default=None, metavar="HOST:PORT")
+    args = parser.parse_args()
+    mongodb = None
+    if args.mongodb:
+        host, _, port = args.mongodb.rpartition(":")
+        mongodb = (host or "localhost", int(port))
+    single = None
+    for workers in args.workers:
+        result = asyncio.run(
+            bench(
+                requests=args.requests,
+                concurrency=args.clients_per_worker * workers,
+                workers=workers,
+                mongodb=mongodb,
+            )
+        )
+        throughput = result["requests_per_second"]
+        single = single or throughput / workers
+        print(
+            f"{workers:>3} workers: {throughput:8.0f} requests/s, "
+            f"p99 {result['latency_ms']['p99']:7.2f} ms, "
+            f"efficiency {throughput / (single * workers):6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
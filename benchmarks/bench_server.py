@@ -0,0 +1,24 @@
+"""Benchmark the VOEvent server under load.
+
+Runs the server with its workers against a stand-in Comet receiver and SMTP
+sink, and reports requests per second, latency percentiles and the memory of
+each worker; see `frbvoe.utilities.bench`. `--save` stores the result as a
+baseline, and `--baseline` exits with an error if a run regressed from one,
+e.g. in CI on the same machine.
+
+Usage:
+    python benchmarks/bench_server.py [--requests 2000] [--concurrency 32]
+        [--workers 2] [--mongodb localhost:27017] [--save baseline.json]
+        [--baseline baseline.json]
+"""
+
+from frbvoe.cli.bench import bench
+
+
+def main():
+    """Run the benchmark."""
+    bench()
+
+
+if __name__ == "__main__":
+    main()
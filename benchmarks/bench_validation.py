@@ -0,0 +1,52 @@
+"""Benchmark validating the example VOEvent payloads from raw request bytes.
+
+Compares the fast path of `create_voe` (`VOEvent.model_validate_json` on the
+body, with cached email validation) against decoding the body first and
+building the model from a dict, with and without the email cache.
+
+Usage:
+    python benchmarks/bench_validation.py [--events 10000]
+"""
+
+import argparse
+import json
+import timeit
+
+import orjson
+from pydantic import EmailStr, create_model
+
+from frbvoe.models.voe import VOEvent
+from frbvoe.utilities.bench import example_payloads
+
+# VOEvent validating the author's address on every event, as before.
+UncachedVOEvent = create_model(
+    "UncachedVOEvent", __base__=VOEvent, email=(EmailStr, ...)
+)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    args = parser.parse_args()
+    for payload in example_payloads():
+        body = json.dumps(payload).encode()
+        for name, validate in (
+            ("model_validate_json", lambda: VOEvent.model_validate_json(body)),
+            ("orjson + VOEvent(**)", lambda: VOEvent(**orjson.loads(body))),
+            ("json + VOEvent(**)", lambda: VOEvent(**json.loads(body))),
+            (
+                "uncached email",
+                lambda: UncachedVOEvent.model_validate_json(body),
+            ),
+        ):
+            seconds = min(timeit.repeat(validate, number=args.events, repeat=3))
+            print(
+                f"{payload['kind']:>10} {name:>20}: "
+                f"{seconds * 1e6 / args.events:8.2f} µs/event, "
+                f"{args.events / seconds:10.0f} events/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
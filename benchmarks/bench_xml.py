@@ -0,0 +1,121 @@
+"""Benchmark the VOEvent XML serializer against an lxml-based reference.
+
+The reference needs lxml, which frbvoe does not depend on; without it only
+the serializer is timed.
+
+Usage:
+    python benchmarks/bench_xml.py [--events 10000]
+"""
+
+import argparse
+import timeit
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+from frbvoe.models.voe import VOEvent
+from frbvoe.utilities.xml import EVENT_PARAMS, NAMESPACE, OBSERVATORY_PARAMS
+
+payload = {
+    "kind": "detection",
+    "observatory_name": "CHIME",
+    "date": "2025-01-13 16:55:08.844845",
+    "email": "john.smith@email.com",
+    "semi_major": 0.026,
+    "semi_minor": 0.013,
+    "sampling_time": 0.001,
+    "bandwidth": 400,
+    "central_frequency": 600,
+    "npol": 2,
+    "bits_per_sample": 2,
+    "gain": 1.76,
+    "tsys": 25.0,
+    "internal_id": "38249195",
+    "dm": 298.53,
+    "dm_error": 0.01,
+    "width": 4.8,
+    "snr": 13.8,
+    "flux": 4.9,
+    "right_ascension": 55.2938,
+    "declination": 14.2049,
+    "pos_error_deg_95": 0.1,
+    "importance": 0.9979,
+    "website": "https://www.observatory.com",
+}
+
+
+def lxml_reference(voevent: VOEvent) -> bytes:
+    """Builds the same document as VOEvent.to_xml with an lxml DOM."""
+    values = voevent.model_dump()
+    iso_date = values["date"].replace(" ", "T")
+    root = etree.Element(
+        f"{{{NAMESPACE}}}VOEvent",
+        nsmap={"voe": NAMESPACE},
+        version="2.0",
+        role="observation",
+        ivorn=f"ivo://frbvoe/CHIME#detection-{values['internal_id']}",
+    )
+    who = etree.SubElement(root, "Who")
+    etree.SubElement(who, "AuthorIVORN").text = "ivo://frbvoe/CHIME"
+    etree.SubElement(who, "Date").text = iso_date
+    author = etree.SubElement(who, "Author")
+    etree.SubElement(author, "shortName").text = values["observatory_name"]
+    etree.SubElement(author, "contactEmail").text = values["email"]
+    what = etree.SubElement(root, "What")
+    etree.SubElement(what, "Param", name="kind", value=values["kind"])
+    for group, params in (
+        ("observatory parameters", OBSERVATORY_PARAMS),
+        ("event parameters", EVENT_PARAMS),
+    ):
+        element = etree.SubElement(what, "Group", name=group)
+        for name, unit, ucd in params:
+            if values[name] is not None:
+                param = etree.SubElement(
+                    element, "Param", name=name, value=str(values[name]), ucd=ucd
+                )
+                if unit:
+                    param.set("unit", unit)
+    coords = etree.SubElement(
+        etree.SubElement(
+            etree.SubElement(etree.SubElement(root, "WhereWhen"), "ObsDataLocation"),
+            "ObservationLocation",
+        ),
+        "AstroCoords",
+        coord_system_id="UTC-FK5-GEO",
+    )
+    instant = etree.SubElement(etree.SubElement(coords, "Time"), "TimeInstant")
+    etree.SubElement(instant, "ISOTime").text = iso_date
+    position = etree.SubElement(coords, "Position2D", unit="deg")
+    value = etree.SubElement(position, "Value2")
+    etree.SubElement(value, "C1").text = str(values["right_ascension"])
+    etree.SubElement(value, "C2").text = str(values["declination"])
+    etree.SubElement(position, "Error2Radius").text = str(values["pos_error_deg_95"])
+    how = etree.SubElement(root, "How")
+    etree.SubElement(how, "Reference", uri=values["website"])
+    etree.SubElement(root, "Why", importance=str(values["importance"]))
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    args = parser.parse_args()
+    voevent = VOEvent(**payload)
+    serializers = [("to_xml (templates)", voevent.to_xml)]
+    if etree is None:
+        print("lxml is not installed; skipping the lxml reference.")
+    else:
+        serializers.append(("lxml reference", lambda: lxml_reference(voevent)))
+    for name, serialize in serializers:
+        seconds = min(timeit.repeat(serialize, number=args.events, repeat=3))
+        print(
+            f"{name:>20}: {seconds * 1e6 / args.events:8.2f} µs/event, "
+            f"{args.events / seconds:10.0f} events/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
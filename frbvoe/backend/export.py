@@ -0,0 +1,70 @@
+"""Export Server Blueprint."""
+
+import picologging as logging
+from pymongo.errors import PyMongoError
+from sanic import Blueprint
+from sanic.log import logger
+from sanic.request import Request
+from sanic.response import json as json_response
+from sanic_ext import openapi
+
+from frbvoe.utilities.export import BATCH_SIZE, Encoder, stream
+
+logging.basicConfig()
+log = logging.getLogger()
+
+export = Blueprint("export", url_prefix="/")
+
+# Collections exported over HTTP. The subscribers hold emails, so they are
+# only exported by the CLI, with the credentials of the database.
+PUBLIC = ("voe", "tns")
+
+
+# Get at /export/<collection>
+@export.get("export/<collection:str>")
+@openapi.response(200, description="Exports a collection.")
+# Stream the documents of voe or tns as NDJSON, CSV or columns
+async def export_collection(request: Request, collection: str):
+    """Export a collection, streamed in constant memory.
+
+    Query parameters (all optional): `format`, one of `ndjson` (default),
+    `csv` and `columns`, and `batch_size`, the documents read per round trip
+    and sent per chunk (1000 by default).
+
+    Args:
+        request (Request): The request object.
+        collection (str): The collection, `voe` or `tns`.
+
+    Returns:
+        HTTPResponse: The streamed export, or an error message.
+    """
+    if collection not in PUBLIC:
+        return json_response(
+            {"message": f"{collection} is not exported, only {', '.join(PUBLIC)}."},
+            status=404,
+        )
+    try:
+        encoder = Encoder(collection, request.args.get("format", "ndjson"))
+        batch_size = int(request.args.get("batch_size", BATCH_SIZE))
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive.")
+    except ValueError as export_error:
+        return json_response({"message": str(export_error)}, status=400)
+
+    response = await request.respond(
+        content_type=encoder.content_type,
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="{collection}.{encoder.extension}"'
+            )
+        },
+    )
+    try:
+        async for chunk in stream(
+            request.app.ctx.mongo["frbvoe"][collection], encoder, batch_size=batch_size
+        ):
+            await response.send(chunk)
+    except PyMongoError as mongo_error:
+        # The status is already sent; the truncated body ends the stream.
+        logger.error(f"{mongo_error} on /export/{collection}")
+    await response.eof()
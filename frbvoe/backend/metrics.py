@@ -0,0 +1,29 @@
+"""Metrics Server Blueprint."""
+
+from sanic import Blueprint
+from sanic.request import Request
+from sanic.response import text
+from sanic_ext import openapi
+
+from frbvoe.utilities.metrics import get_metrics
+
+metrics = Blueprint("metrics", url_prefix="/")
+
+
+# Get at /metrics
+@metrics.get("metrics")
+@openapi.response(200, description="Prometheus metrics of every worker.")
+# Latency histograms, outcome counters and gauges, summed across workers
+async def render_metrics(request: Request):
+    """Render the metrics in the Prometheus text format.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        HTTPResponse: The metrics.
+    """
+    return text(
+        get_metrics(request.app).render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -1,6 +1,8 @@
 """Subscriber Server Blueprint."""
 
 import picologging as logging
+from bson import ObjectId
+from bson.errors import InvalidId
 from pymongo.errors import PyMongoError
 from sanic import Blueprint
 from sanic.log import logger
@@ -86,12 +88,16 @@ async def delete_subscriber(request: Request):
     """
     if "id" not in request.args.keys():
         return json_response({"message": "Your request needs an ID."}, status=400)
-    id = request.args["id"]
+    try:
+        # The ID returned on creation, looked up through the _id index.
+        id = ObjectId(request.args.get("id"))
+    except InvalidId:
+        return json_response({"message": "Invalid ID."}, status=400)
     mongo = request.app.ctx.mongo
     try:
-        delete_result = await mongo["frbvoe"]["subscriber"].delete_one({"id": id})
+        delete_result = await mongo["frbvoe"]["subscriber"].delete_one({"_id": id})
     except (Exception, PyMongoError) as mongo_error:
         logger.error(f"{mongo_error} on /subscriber")
-        return json_response({"message": mongo_error}, status=500)
+        return json_response({"message": str(mongo_error)}, status=500)
 
-    return json_response({"message": delete_result.delete_count}, status=202)
+    return json_response({"message": delete_result.deleted_count}, status=202)
@@ -1,13 +1,19 @@
 """VOEvent Server Blueprint."""
 
+import asyncio
+import time
+from typing import Any, List, Optional
+
 import picologging as logging
+from pymongo import UpdateOne
 from pymongo.errors import PyMongoError
-from sanic import Blueprint
+from sanic import Blueprint, Sanic
 from sanic.request import Request
 from sanic.response import json as json_response
 from sanic_ext import openapi
 
 from frbvoe.models.tns import TNS
+from frbvoe.utilities.metrics import get_metrics
 
 logging.basicConfig()
 log = logging.getLogger()
@@ -15,15 +21,37 @@ log = logging.getLogger()
 tns = Blueprint("tns", url_prefix="/")
 
 
+async def save_names(app: Sanic, ids: List[Any], names: List[Optional[str]]):
+    """Saves the TNS names of the reports of a bulk report, once named.
+
+    Args:
+        app (Sanic): The application.
+        ids (List[Any]): The IDs of the saved reports.
+        names (List[Optional[str]]): Their TNS names, None for those rejected.
+    """
+    updates = [
+        UpdateOne({"_id": id}, {"$set": {"tns_name": name}})
+        for id, name in zip(ids, names)
+        if id is not None and name is not None
+    ]
+    if updates:
+        await app.ctx.mongo["frbvoe"]["tns"].bulk_write(updates, ordered=False)
+
+
 # Post at /submit_tns
 @tns.post("submit_tns")
 @openapi.response(201, description="Submits an FRB to the TNS.")
-# Validate the TNS report, submit to the TNS, and save the TNS name to the MongoDB
+# Validate the TNS report, save it to MongoDB, then submit it to the TNS; its TNS
+# name is saved once the TNS names it
 async def submit_tns(
     request: Request, proprierary_period: int = 10, sandbox: bool = True
 ):
     """Submits a TNS (Transient Name Server) report.
 
+    The report is sent in the next bulk report of the worker. If the TNS has
+    not named the FRB within `SANIC_TNS_BUDGET` seconds, its status is
+    "Pending" and the TNS name is saved once the TNS names it.
+
     Args:
         request (Request): The request object.
         proprierary_period (int, optional): The proprietary period for the TNS report.
@@ -33,8 +61,10 @@ async def submit_tns(
 
     Returns:
         dict: A dictionary containing the validation status,
-        TNS status, database status, and the inserted ID.
+        TNS status, database status, the inserted ID and the TNS name.
     """
+    metrics = get_metrics(request.app)
+    started = time.perf_counter()
     # Validate the VOEvent
     try:
         log.info("Validating the TNS Report")
@@ -43,43 +73,103 @@ async def submit_tns(
         status_code = 200
     except Exception as validation_error:
         log.exception(f"Error while validating the VOEvent: {validation_error}")
-        validation_status = "Failure"
-        status_code = 400
+        metrics.count(None, "validation", "Failure")
+        metrics.observe("request", time.perf_counter() - started)
+        return json_response(
+            {
+                "validation": "Failure",
+                "tns": "Skipped",
+                "database": "Skipped",
+                "id": None,
+                "tns_name": None,
+            },
+            status=400,
+        )
+
+    # Save the report to MongoDB
+    # DB Name: frbvoe, Collection: tns, Document: TNS Name Dict
+    insert_result = None
+    try:
+        log.info("Saving the TNS report to MongoDB")
+        mongo = request.app.ctx.mongo
+        insert_result = await metrics.time(
+            "database", mongo["frbvoe"]["tns"].insert_one(tns_report.document())
+        )
+        database_status = "Success"
+    except (Exception, PyMongoError) as mongo_error:
+        log.exception(f" While saving the TNS report to MongoDB: {mongo_error}")
+        database_status = "Failure"
+        status_code = 500
 
     # Submit to the TNS
+    tns_name = None
     try:
         log.info("Submitting the VOEvent to TNS")
-        tns_report.submit(proprierary_period, sandbox)
+        named = tns_report.submit(
+            request.app.ctx.tns,
+            insert_result.inserted_id if insert_result is not None else None,
+        )
+        # SANIC_TNS_BUDGET
+        budget = float(request.app.config.get("TNS_BUDGET", 10.0))
+        tns_name = await metrics.time(
+            "tns", asyncio.wait_for(asyncio.shield(named), budget)
+        )
         tns_status = "Success"
+    except asyncio.TimeoutError:
+        log.info("The TNS has not named the FRB yet")
+        tns_status = "Pending"
     except Exception as tns_error:
         log.exception(f" While sending the VOEvent to the TNS: {tns_error}")
         tns_status = "Failure"
         status_code = 500
 
-    # Save VOEvent to MongoDB
-    # DB Name: frbvoe, Collection: tns, Document: TNS Name Dict
-    try:
-        log.info("Saving the TNS name to MongoDB")
-        mongo = request.app.ctx.mongo
-        insert_result = await mongo["frbvoe"]["tns"].insert_one(tns_report.model_dump())
-        database_status = "Success"
-    except (Exception, PyMongoError) as mongo_error:
-        log.exception(f" While saving the TNS name to MongoDB: {mongo_error}")
-        database_status = "Failure"
-        status_code = 500
-
-    print(
-        f"""Validation: {validation_status}\n
-        TNS: {tns_status}\n
-        Database : {database_status}"""
+    log.info(
+        f"Validation: {validation_status}, TNS: {tns_status}, "
+        f"Database: {database_status}"
     )
+    kind = tns_report.kind
+    metrics.count(kind, "validation", validation_status)
+    metrics.count(kind, "tns", tns_status)
+    metrics.count(kind, "database", database_status)
+    metrics.observe("request", time.perf_counter() - started)
 
     return json_response(
         {
             "validation": validation_status,
             "tns": tns_status,
             "database": database_status,
-            "id": insert_result.inserted_id,
+            "id": str(insert_result.inserted_id) if insert_result else None,
+            "tns_name": tns_name,
         },
         status=status_code,
     )
+
+
+# Post at /search_tns
+@tns.post("search_tns")
+@openapi.response(200, description="Looks up the TNS name of an FRB.")
+# Look up the TNS name of an FRB by its internal ID, through the worker's cache
+async def search_tns(request: Request):
+    """Looks up the TNS name of the FRB of a TNS report by its internal ID.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        JSON response: The TNS name, null if the TNS does not know it.
+    """
+    try:
+        tns_report = TNS(**request.json)
+    except Exception as validation_error:
+        log.exception(f"Error while validating the TNS report: {validation_error}")
+        return json_response({"message": str(validation_error)}, status=400)
+    if not tns_report.internal_id:
+        return json_response({"message": "Your report needs an internal_id."}, 400)
+    try:
+        tns_name = await get_metrics(request.app).time(
+            "tns", tns_report.search(request.app.ctx.tns_names)
+        )
+    except Exception as tns_error:
+        log.exception(f" While searching the TNS: {tns_error}")
+        return json_response({"message": str(tns_error)}, status=502)
+    return json_response({"internal_id": tns_report.internal_id, "tns_name": tns_name})
@@ -1,25 +1,380 @@
 """VOEvent Server Blueprint."""
 
+import asyncio
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import orjson
 import picologging as logging
-from pymongo.errors import PyMongoError
-from sanic import Blueprint
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import TypeAdapter, ValidationError
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from sanic import Blueprint, Sanic
 from sanic.log import logger
 from sanic.request import Request
 from sanic.response import json as json_response
 from sanic_ext import openapi
 
-from frbvoe.models.voe import VOEvent
+from frbvoe.models.voe import COMET_URL, VOEvent
+from frbvoe.utilities.breaker import guarded
+from frbvoe.utilities.dedupe import FIELD, dedup_key, duplicates, originals
+from frbvoe.utilities.dispatch import dispatch, status
+from frbvoe.utilities.email import RECIPIENTS, UndeliveredEmail
+from frbvoe.utilities.metrics import get_metrics
+from frbvoe.utilities.outbox import PartialBroadcast
+from frbvoe.utilities.search import location, search
+from frbvoe.utilities.tracing import TRACE, Trace, detection_time, span
+from frbvoe.utilities.vtp import publish
 
 logging.basicConfig()
 log = logging.getLogger()
 
 voe = Blueprint("voe", url_prefix="/")
 
+# Validator of a batch of VOEvents, built once.
+VOEVENTS = TypeAdapter(List[VOEvent])
+
+
+def document(voevent: VOEvent) -> Dict[str, Any]:
+    """Returns the archived document of a VOEvent, with its sky location.
+
+    Args:
+        voevent (VOEvent): The VOEvent.
+
+    Returns:
+        Dict[str, Any]: The document.
+    """
+    document = voevent.model_dump()
+    point = location(voevent.right_ascension, voevent.declination)
+    if point is not None:
+        document["location"] = point
+    return document
+
+
+def queued(voevent: VOEvent) -> Dict[str, Any]:
+    """Returns the payload of a VOEvent queued for the broadcasts.
+
+    Unset fields are left out, as their None defaults would not validate when
+    the outbox workers rebuild the VOEvent.
+
+    Args:
+        voevent (VOEvent): The VOEvent.
+
+    Returns:
+        Dict[str, Any]: The JSON-serializable payload.
+    """
+    return voevent.model_dump(
+        mode="json", exclude={"email_password"}, exclude_none=True
+    )
+
+
+async def save_voe(
+    app: Sanic,
+    voevent: VOEvent,
+    trace: Optional[Dict[str, Any]] = None,
+    key: Optional[str] = None,
+):
+    """Saves a VOEvent to MongoDB.
+
+    Args:
+        app (Sanic): The application.
+        voevent (VOEvent): The VOEvent to be saved.
+        trace (Optional[Dict[str, Any]]): Its trace, see `Trace.document`.
+        key (Optional[str]): Its deduplication key, see `dedup_key`.
+
+    Returns:
+        InsertOneResult: The result of the insertion.
+
+    Raises:
+        DuplicateKeyError: If a VOEvent with the same key was archived.
+    """
+    mongo = app.ctx.mongo
+    archived = document(voevent)
+    if trace is not None:
+        archived["trace"] = trace
+    if key is not None:
+        archived[FIELD] = key
+    result = await mongo["frbvoe"]["voe"].insert_one(archived)
+    repeaters = getattr(app.ctx, "repeaters", None)
+    if repeaters is not None:
+        repeaters.saved(archived)
+    return result
+
+
+async def archive(
+    app: Sanic,
+    voevent: VOEvent,
+    trace: Optional[Dict[str, Any]] = None,
+    key: Optional[str] = None,
+) -> Tuple[str, bool]:
+    """Saves a VOEvent to MongoDB, unless it was archived already.
+
+    Args:
+        app (Sanic): The application.
+        voevent (VOEvent): The VOEvent to be saved.
+        trace (Optional[Dict[str, Any]]): Its trace, see `Trace.document`.
+        key (Optional[str]): Its deduplication key, see `dedup_key`.
+
+    Returns:
+        Tuple[str, bool]: The ID of the VOEvent, that of the original if it
+        was archived already, and whether it was.
+    """
+    try:
+        result = await save_voe(app, voevent, trace, key)
+    except DuplicateKeyError:
+        # Archived by another worker, or before a restart.
+        found = await originals(app.ctx.mongo["frbvoe"]["voe"], [key])
+        if key not in found:
+            raise
+        return found[key], True
+    return str(result.inserted_id), False
+
+
+async def save_voes(
+    app: Sanic, voevents: List[VOEvent], keys: Optional[List[str]] = None
+) -> Tuple[List[Optional[str]], Set[int]]:
+    """Saves a batch of VOEvents to MongoDB with one unordered bulk insert.
+
+    Args:
+        app (Sanic): The application.
+        voevents (List[VOEvent]): The VOEvents to be saved.
+        keys (Optional[List[str]]): The deduplication key of each VOEvent.
+
+    Returns:
+        Tuple[List[Optional[str]], Set[int]]: The inserted ID of each VOEvent,
+        that of the original if it was archived already, or None if its
+        insertion failed; and the positions of the VOEvents archived already.
+    """
+    documents = [document(voevent) for voevent in voevents]
+    for archived, key in zip(documents, keys or ()):
+        archived[FIELD] = key
+    failed: Set[int] = set()
+    duplicated: Set[int] = set()
+    if documents:
+        try:
+            await app.ctx.mongo["frbvoe"]["voe"].insert_many(documents, ordered=False)
+        except BulkWriteError as bulk_error:
+            failed = {error["index"] for error in bulk_error.details["writeErrors"]}
+            duplicated = set(duplicates(bulk_error.details))
+    repeaters = getattr(app.ctx, "repeaters", None)
+    if repeaters is not None:
+        for index, archived in enumerate(documents):
+            if index not in failed:
+                repeaters.saved(archived)
+    # insert_many sets the _id of every document before sending the batch.
+    ids = [
+        None if index in failed else str(document["_id"])
+        for index, document in enumerate(documents)
+    ]
+    if duplicated:
+        found = await originals(
+            app.ctx.mongo["frbvoe"]["voe"],
+            [documents[index][FIELD] for index in duplicated],
+        )
+        for index in duplicated:
+            ids[index] = found.get(documents[index][FIELD])
+        duplicated = {index for index in duplicated if ids[index] is not None}
+    return ids, duplicated
+
+
+def validate_batch(
+    body: bytes, ndjson: bool = False
+) -> Tuple[List[VOEvent], Dict[int, str]]:
+    """Validates a batch of VOEvents straight from the request body.
+
+    Args:
+        body (bytes): A JSON array of VOEvents, or one VOEvent per line.
+        ndjson (bool): Whether the body is newline-delimited JSON.
+            Defaults to False.
+
+    Returns:
+        Tuple[List[VOEvent], Dict[int, str]]: The valid VOEvents, and the
+        validation error of every invalid item keyed by its position.
+
+    Raises:
+        ValueError: If the body is not a JSON array (or NDJSON stream).
+    """
+    if ndjson:
+        body = (
+            b"[" + b",".join(line for line in body.splitlines() if line.strip()) + b"]"
+        )
+    try:
+        return VOEVENTS.validate_json(body), {}
+    except ValidationError as validation_error:
+        errors: Dict[int, str] = {}
+        for error in validation_error.errors():
+            if not error["loc"] or not isinstance(error["loc"][0], int):
+                raise ValueError(error["msg"])
+            errors.setdefault(error["loc"][0], f"{error['loc'][1:]}: {error['msg']}")
+    items = orjson.loads(body)
+    valid = [item for index, item in enumerate(items) if index not in errors]
+    return VOEVENTS.validate_python(valid), errors
+
+
+def associate(app: Sanic, voevent: VOEvent) -> Tuple[VOEvent, Optional[Dict]]:
+    """Associates a detection with the past event it most likely repeats.
+
+    The VOEvent gets the TNS name of the past event, if it has none, and with
+    `SANIC_REPEATER_PROMOTE` set it is sent as a `subsequent` VOEvent.
+
+    Args:
+        app (Sanic): The application.
+        voevent (VOEvent): The VOEvent.
+
+    Returns:
+        Tuple[VOEvent, Optional[Dict]]: The VOEvent, updated if associated,
+        and the past event, see `RepeaterIndex.associate`.
+    """
+    repeaters = getattr(app.ctx, "repeaters", None)
+    if repeaters is None or voevent.kind != "detection":
+        return voevent, None
+    association = repeaters.associate(dict(voevent))
+    if association is None:
+        return voevent, None
+    update: Dict[str, Any] = {}
+    if association["tns_name"] and not voevent.tns_name:
+        update["tns_name"] = association["tns_name"]
+    # SANIC_REPEATER_PROMOTE
+    if app.config.get("REPEATER_PROMOTE", False):
+        update["kind"] = "subsequent"
+    log.info(f"Associated the VOEvent with {association}")
+    return voevent.model_copy(update=update), association
+
+
+def comet_url(app: Sanic) -> str:
+    """Returns the URL of the Comet receiver.
+
+    Args:
+        app (Sanic): The application.
+
+    Returns:
+        str: The URL.
+    """
+    # SANIC_COMET_URL
+    return str(app.config.get("COMET_URL", COMET_URL))
+
+
+async def send_to_comet(app: Sanic, voevent: VOEvent) -> bool:
+    """Sends a VOEvent to Comet, within its rate limit and through its breaker.
+
+    With the built-in VTP broker, the VOEvent is handed to it instead.
+
+    Args:
+        app (Sanic): The application.
+        voevent (VOEvent): The VOEvent.
+
+    Returns:
+        bool: True, once Comet, or the broker, accepted the VOEvent.
+
+    Raises:
+        RuntimeError: If Comet, or the broker, did not accept the VOEvent.
+    """
+    voevents = getattr(app.ctx, "vtp", None)
+    if voevents is not None:
+        if not publish(voevents, voevent.to_xml()):
+            raise RuntimeError("The VTP broker did not accept the VOEvent.")
+        return True
+
+    async def post() -> bool:
+        # A refusal is a failure of the sink, for its breaker too.
+        if not await voevent.send_comet(app.ctx.http, comet_url(app)):
+            raise RuntimeError("Comet did not accept the VOEvent.")
+        return True
+
+    limiter = getattr(app.ctx, "limiter", None)
+    if limiter is not None:
+        await limiter.acquire("comet")
+    return await guarded(app, "comet", post())
+
+
+def subscriber_emails(app: Sanic) -> Tuple[str, ...]:
+    """Returns the addresses of the email subscribers from the worker's cache.
+
+    Args:
+        app (Sanic): The application.
+
+    Returns:
+        Tuple[str, ...]: The addresses, empty if the cache is unavailable.
+    """
+    subscribers = getattr(app.ctx, "subscribers", None)
+    return subscribers.emails if subscribers is not None else ()
+
+
+def traced(app: Sanic, payload: Dict[str, Any], ended: Dict[str, Any]) -> None:
+    """Records the span of a queued broadcast, if its VOEvent was traced.
+
+    Args:
+        app (Sanic): The application.
+        payload (Dict[str, Any]): The VOEvent payload, with its trace context.
+        ended (Dict[str, Any]): The span.
+    """
+    tracer = getattr(app.ctx, "tracer", None)
+    if tracer is not None and payload.get(TRACE):
+        tracer.record(payload[TRACE], [ended])
+
+
+async def broadcast_comet(app: Sanic, payload: Dict[str, Any]):
+    """Sends a queued VOEvent payload to Comet.
+
+    Args:
+        app (Sanic): The application.
+        payload (Dict[str, Any]): The VOEvent payload.
+
+    Raises:
+        RuntimeError: If Comet did not accept the VOEvent.
+    """
+    metrics = get_metrics(app)
+    start = time.time_ns()
+    sent = False
+    try:
+        sent = await metrics.time("comet", send_to_comet(app, VOEvent(**payload)))
+    finally:
+        metrics.count(payload.get("kind"), "comet", "Success" if sent else "Failure")
+        traced(app, payload, span("comet", start, ok=sent))
+
+
+async def broadcast_email(app: Sanic, payload: Dict[str, Any]):
+    """Emails a queued VOEvent payload to the subscribers.
+
+    After a partial failure, only the subscribers left are emailed again.
+
+    Args:
+        app (Sanic): The application.
+        payload (Dict[str, Any]): The VOEvent payload.
+
+    Raises:
+        PartialBroadcast: If some subscribers could not be emailed.
+    """
+    metrics = get_metrics(app)
+    start = time.time_ns()
+    sent = False
+    recipients = payload.get(RECIPIENTS)
+    if recipients is None:
+        recipients = subscriber_emails(app)
+    try:
+        await metrics.time(
+            "email", VOEvent(**payload).send_email(app.ctx.smtp, recipients)
+        )
+        sent = True
+    except UndeliveredEmail as error:
+        raise PartialBroadcast(str(error), {**payload, RECIPIENTS: error.recipients})
+    finally:
+        metrics.count(payload.get("kind"), "email", "Success" if sent else "Failure")
+        traced(app, payload, span("email", start, ok=sent))
+
+
+# Senders used by the outbox workers, keyed by sink name.
+# Each is called with the application and the queued payload.
+broadcasts = {"comet": broadcast_comet, "email": broadcast_email}
+
 
 # Post at /create_voe
 @voe.post("create_voe")
 @openapi.response(201, description="Creates an FRB VOEvent.")
-# Process a new VOEvent (validate, send to Comet, send to Email, save to MongoDB)
+# Process a new VOEvent (validate, associate with past events, then concurrently
+# queue for Comet, queue for Email and save to MongoDB)
 async def create_voe(request: Request):
     """Process a VOEvent.
 
@@ -36,54 +391,185 @@ async def create_voe(request: Request):
         PyMongoError: If there is an error with the PyMongo library.
 
     """
+    metrics = get_metrics(request.app)
+    started = time.perf_counter()
+    # Trace the VOEvent from its receipt to its broadcasts.
+    tracer = getattr(request.app.ctx, "tracer", None)
+    trace = None
+    if tracer is not None:
+        trace = Trace(received=getattr(request.ctx, "received", None))
+        trace.spans.append(span("receive", trace.received))
+
+    def timed(name: str, awaitable):
+        return tracer.timed(trace, name, awaitable) if trace else awaitable
+
     # Validate the VOEvent
     try:
         log.info("Validating the VOEvent")
-        voevent = VOEvent(**request.json)
+        validating = time.time_ns()
+        voevent = VOEvent.model_validate_json(request.body)
         validation_status = "Success"
         status_code = 200
     except Exception as validation_error:
         log.exception(f"Error while validating the VOEvent: {validation_error}")
-        validation_status = "Failure"
-        status_code = 400
+        metrics.observe("validation", time.perf_counter() - started)
+        metrics.count(None, "validation", "Failure")
+        return json_response(
+            {
+                "validation": "Failure",
+                "comet": "Skipped",
+                "email": "Skipped",
+                "database": "Skipped",
+                "id": None,
+                "association": None,
+                "duplicate": False,
+            },
+            status=400,
+        )
 
-    # Send VOEvent to Comet
-    try:
-        log.info("Sending the VOEvent to Comet")
-        voevent.send_comet
-        comet_status = "Success"
-    except Exception as comet_error:
-        log.exception(f" While sending the VOEvent to Comet: {comet_error}")
-        comet_status = "Failure"
-        status_code = 500
-    # Send VOEvent to Email
-    try:
-        log.info("Sending the VOEvent to Email")
-        voevent.send_email
-        email_status = "Success"
-    except Exception as email_error:
-        log.exception(f" While sending the VOEvent to Email: {email_error}")
-        email_status = "Failure"
-        status_code = 500
+    validated = time.perf_counter()
+    metrics.observe("validation", validated - started)
+    if trace:
+        trace.detected = detection_time(voevent.date)
+        trace.spans.append(span("validate", validating))
 
-    # Save VOEvent to MongoDB
+    # A resubmission of a VOEvent the worker saw recently gets the ID of the
+    # original, without being archived or broadcast again.
+    recent = getattr(request.app.ctx, "recent", None)
+    key = None
+    if recent is not None:
+        key = dedup_key(dict(voevent))
+        original = recent.get(key)
+        # Wait for the original if it is still being archived.
+        original_id = await asyncio.shield(original) if original else None
+        if original_id is not None:
+            log.info(f"The VOEvent duplicates {original_id}")
+            metrics.count(voevent.kind, "validation", validation_status)
+            metrics.count(voevent.kind, "database", "Duplicate")
+            metrics.observe("request", time.perf_counter() - started)
+            return json_response(
+                {
+                    "validation": validation_status,
+                    "comet": "Skipped",
+                    "email": "Skipped",
+                    "database": "Duplicate",
+                    "id": original_id,
+                    "association": None,
+                    "duplicate": True,
+                },
+                status=status_code,
+            )
+
+    # Associate a detection with the past event it may repeat, e.g. to name it.
+    with trace.span("associate") if trace else nullcontext():
+        voevent, association = associate(request.app, voevent)
+    metrics.observe("association", time.perf_counter() - validated)
+
+    # Queue the Comet and Email broadcasts (or, without an outbox, send them
+    # directly) and save the VOEvent to MongoDB concurrently.
     # DB Name: frbvoe, Collection: voe, Document: VOEvent Payload Dict
+    log.info("Dispatching the VOEvent to Comet, Email and MongoDB")
+    outbox = getattr(request.app.ctx, "outbox", None)
+    if outbox is not None:
+        with trace.span("serialize") if trace else nullcontext():
+            payload = queued(voevent)
+        if trace:
+            # The outbox workers record the broadcasts under the same trace.
+            payload[TRACE] = trace.context()
+        comet_sink = timed(
+            "outbox.comet", metrics.time("outbox", outbox.put(payload, ["comet"]))
+        )
+        email_sink = timed(
+            "outbox.email", metrics.time("outbox", outbox.put(payload, ["email"]))
+        )
+    else:
+        comet_sink = timed(
+            "comet",
+            metrics.time(
+                "comet",
+                send_to_comet(request.app, voevent),
+            ),
+        )
+        email_sink = timed(
+            "email",
+            metrics.time(
+                "email",
+                voevent.send_email(
+                    request.app.ctx.smtp, subscriber_emails(request.app)
+                ),
+            ),
+        )
+    # The spans so far are archived with the VOEvent, the later ones pushed.
+    archived = trace.document() if trace else None
+    # SANIC_DISPATCH_BUDGET
+    budget = request.app.config.get("DISPATCH_BUDGET", None)
+    if key is not None:
+        # Nothing was awaited since the lookup, so no retry slipped in between.
+        recent.start(key)
     try:
-        log.info("Saving the VOEvent to MongoDB")
-        mongo = request.app.ctx.mongo
-        insert_result = await mongo["frbvoe"]["voe"].insert_one(voevent.model_dump())
-        database_status = "Success"
-    except (Exception, PyMongoError) as mongo_error:
-        log.exception(f" While saving the VOEvent to MongoDB: {mongo_error}")
-        database_status = "Failure"
+        sinks = await dispatch(
+            {
+                "comet": comet_sink,
+                "email": email_sink,
+                "database": timed(
+                    "persist",
+                    metrics.time(
+                        "database",
+                        guarded(
+                            request.app,
+                            "mongo",
+                            archive(request.app, voevent, archived, key),
+                        ),
+                    ),
+                ),
+            },
+            budget=float(budget) if budget is not None else None,
+        )
+    except BaseException:
+        # E.g. cancelled as the client disconnected; a retry must not wait.
+        if key is not None:
+            recent.done(key, None)
+        raise
+    if key is not None:
+        # Retries wait for the ID, even if archiving outlasts the budget.
+        sinks["database"].add_done_callback(
+            lambda task: recent.done(
+                key, task.result()[0] if status(task) == "Success" else None
+            )
+        )
+    comet_status = status(sinks["comet"], queued=outbox is not None)
+    email_status = status(sinks["email"], queued=outbox is not None)
+    database_status = status(sinks["database"])
+    inserted_id, duplicate = None, False
+    if database_status == "Success":
+        inserted_id, duplicate = sinks["database"].result()
+        if duplicate:
+            # Archived by another worker; the outbox already holds broadcasts
+            # with the same idempotency keys, so they are not sent twice.
+            database_status = "Duplicate"
+    for stage, stage_status in (
+        ("validation", validation_status),
+        ("comet", comet_status),
+        ("email", email_status),
+        ("database", database_status),
+    ):
+        metrics.count(voevent.kind, stage, stage_status)
+    if "Failure" in (comet_status, email_status, database_status):
         status_code = 500
 
-    print(
-        f"""Validation: {validation_status}\n
-        Comet: {comet_status}\n
-        Email : {email_status}\n
-        Database : {database_status}"""
+    log.info(
+        f"Validation: {validation_status}, Comet: {comet_status}, "
+        f"Email: {email_status}, Database: {database_status}"
     )
+    metrics.observe("request", time.perf_counter() - started)
+    if trace:
+        context = trace.context()
+        tracer.record(context, archived["spans"], store=False)
+        tracer.record(
+            context,
+            [span("create_voe", trace.received, span_id=trace.root)],
+            store=database_status not in ("Failure", "Duplicate"),
+        )
 
     return json_response(
         {
@@ -91,12 +577,201 @@ async def create_voe(request: Request):
             "comet": comet_status,
             "email": email_status,
             "database": database_status,
-            "id": insert_result.inserted_id,
+            "id": inserted_id,
+            "association": association,
+            "duplicate": duplicate,
         },
         status=status_code,
     )
 
 
+# Post at /create_voe/batch
+@voe.post("create_voe/batch")
+@openapi.response(201, description="Creates a batch of FRB VOEvents.")
+# Process many VOEvents (validate all, then queue for Comet and Email and save to
+# MongoDB in bulk)
+async def create_voe_batch(request: Request):
+    """Process a batch of VOEvents, e.g. a backfill after an outage.
+
+    The body is either a JSON array of VOEvents or, with a
+    `Content-Type: application/x-ndjson` header, one VOEvent per line. Pass
+    `?broadcast=false` to only archive the VOEvents.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        JSON response: The status of every VOEvent, in the order received.
+    """
+    ndjson = request.headers.get("content-type", "").startswith(
+        ("application/x-ndjson", "application/jsonl")
+    )
+    try:
+        log.info("Validating the VOEvent batch")
+        voevents, errors = validate_batch(request.body, ndjson)
+    except ValueError as batch_error:
+        log.exception(f"Error while reading the VOEvent batch: {batch_error}")
+        return json_response({"message": str(batch_error)}, status=400)
+
+    # Resubmissions of the VOEvents the worker saw recently, and repeats within
+    # the batch, get the ID of the original without being archived or
+    # broadcast again; the others are caught by the unique index.
+    received = voevents
+    recent = getattr(request.app.ctx, "recent", None)
+    keys: Optional[List[str]] = None
+    originals_of: Dict[int, Any] = {}
+    if recent is not None:
+        keys, first = [], {}
+        for index, key in enumerate(dedup_key(dict(v)) for v in received):
+            original = recent.get(key)
+            if original is not None and original.done() and original.result():
+                originals_of[index] = original.result()
+            elif key in first:
+                # Resolved to the ID of the first once it is archived.
+                originals_of[index] = first[key]
+            else:
+                first[key] = index
+                keys.append(key)
+        voevents = [v for i, v in enumerate(received) if i not in originals_of]
+
+    broadcast = request.args.get("broadcast", "true").lower() != "false"
+    payloads = [queued(voevent) for voevent in voevents]
+    outbox = getattr(request.app.ctx, "outbox", None)
+    metrics = get_metrics(request.app)
+    sinks = {
+        "database": metrics.time(
+            "database",
+            guarded(request.app, "mongo", save_voes(request.app, voevents, keys)),
+        )
+    }
+    if broadcast and outbox is not None:
+        sinks["comet"] = metrics.time("outbox", outbox.put_many(payloads, ["comet"]))
+        sinks["email"] = metrics.time("outbox", outbox.put_many(payloads, ["email"]))
+    elif broadcast:
+        sinks["comet"] = metrics.time(
+            "comet",
+            asyncio.gather(
+                *(send_to_comet(request.app, voevent) for voevent in voevents)
+            ),
+        )
+        sinks["email"] = metrics.time(
+            "email",
+            asyncio.gather(
+                *(
+                    voevent.send_email(
+                        request.app.ctx.smtp, subscriber_emails(request.app)
+                    )
+                    for voevent in voevents
+                )
+            ),
+        )
+    log.info(f"Dispatching {len(voevents)} VOEvents to {', '.join(sinks)}")
+    # SANIC_DISPATCH_BUDGET
+    budget = request.app.config.get("DISPATCH_BUDGET", None)
+    tasks = await dispatch(sinks, budget=float(budget) if budget is not None else None)
+    statuses = {
+        sink: status(task, queued=sink != "database" and outbox is not None)
+        for sink, task in tasks.items()
+    }
+    database_status = statuses["database"]
+    saved: List[Optional[str]] = [None] * len(voevents)
+    duplicated: Set[int] = set()
+    if database_status == "Success":
+        saved, duplicated = tasks["database"].result()
+    if keys is not None:
+        for key, inserted_id in zip(keys, saved):
+            if inserted_id is not None:
+                recent.start(key)
+                recent.done(key, inserted_id)
+
+    # The ID of every valid VOEvent, in the order received.
+    fresh = iter(enumerate(saved))
+    ids: List[Optional[str]] = []
+    repeated: Set[int] = set()
+    for index in range(len(received)):
+        if index not in originals_of:
+            position, inserted_id = next(fresh)
+            if position in duplicated:
+                repeated.add(index)
+        else:
+            repeated.add(index)
+            original = originals_of[index]
+            # The position of a repeat within the batch, or an archived ID.
+            inserted_id = ids[original] if isinstance(original, int) else original
+        ids.append(inserted_id)
+
+    results = []
+    valid = iter(enumerate(zip(received, ids)))
+    for index in range(len(received) + len(errors)):
+        if index in errors:
+            metrics.count(None, "validation", "Failure")
+            results.append({"validation": "Failure", "error": errors[index]})
+            continue
+        position, (voevent, inserted_id) = next(valid)
+        duplicate = position in repeated
+        result = {
+            "validation": "Success",
+            "comet": statuses.get("comet", "Skipped"),
+            "email": statuses.get("email", "Skipped"),
+            "database": (
+                database_status
+                if database_status != "Success"
+                else (
+                    "Failure"
+                    if not inserted_id
+                    else "Duplicate" if duplicate else "Success"
+                )
+            ),
+            "id": inserted_id,
+            "duplicate": duplicate,
+        }
+        if position in originals_of and inserted_id:
+            # Neither archived nor broadcast.
+            result.update(comet="Skipped", email="Skipped", database="Duplicate")
+        for stage in ("validation", "comet", "email", "database"):
+            metrics.count(voevent.kind, stage, result[stage])
+        results.append(result)
+    failed = (
+        bool(errors)
+        or "Failure" in statuses.values()
+        or (database_status == "Success" and None in saved)
+    )
+    return json_response(
+        {"received": len(results), "failed": failed, "results": results},
+        status=207 if failed else 200,
+    )
+
+
+# Get at /voe/search
+@voe.get("voe/search")
+@openapi.response(200, description="Searches the FRB VOEvent archive.")
+# Cone search, time window and DM range over the archived VOEvents
+async def search_voe(request: Request):
+    """Search the archived VOEvents.
+
+    Query parameters (all optional): `ra`, `dec` and `radius` in degrees for a
+    cone search, `start` and `end` dates (in the format of `date`), `dm_min`
+    and `dm_max` in pc/cm^3, `kind`, `limit` (at most 1000, 100 by default) and
+    the `cursor` returned with the previous page.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        JSON response: The VOEvents found, newest first, and the cursor of the
+        next page.
+    """
+    args = {name: request.args.get(name) for name in request.args}
+    try:
+        found = await search(request.app.ctx.mongo["frbvoe"]["voe"], args)
+    except ValueError as search_error:
+        return json_response({"message": str(search_error)}, status=400)
+    except PyMongoError as mongo_error:
+        logger.error(f"{mongo_error} on /voe/search")
+        return json_response({"message": str(mongo_error)}, status=500)
+    return json_response(found)
+
+
 # Post at /delete_voe
 @voe.post("delete_voe")
 @openapi.response(201, description="Deletes an FRB VOEvent.")
@@ -116,12 +791,16 @@ async def delete_voe(request: Request):
     """
     if "id" not in request.args.keys():
         return json_response({"message": "Your request needs an ID."}, status=400)
-    id = request.args["id"]
+    try:
+        # The ID returned on creation, looked up through the _id index.
+        id = ObjectId(request.args.get("id"))
+    except InvalidId:
+        return json_response({"message": "Invalid ID."}, status=400)
     mongo = request.app.ctx.mongo
     try:
-        delete_result = await mongo["frbvoe"]["voe"].delete_one({"id": id})
+        delete_result = await mongo["frbvoe"]["voe"].delete_one({"_id": id})
     except (Exception, PyMongoError) as mongo_error:
         logger.error(f"{mongo_error} on /voe")
-        return json_response({"message": mongo_error}, status=500)
+        return json_response({"message": str(mongo_error)}, status=500)
 
-    return json_response({"message": delete_result.delete_count}, status=202)
+    return json_response({"message": delete_result.deleted_count}, status=202)
@@ -0,0 +1,102 @@
+"""Bench CLI."""
+
+import asyncio
+
+import click
+
+from frbvoe.utilities.bench import TOLERANCE, baseline
+from frbvoe.utilities.bench import bench as run
+from frbvoe.utilities.bench import compare, save, summary
+
+
+@click.command("bench", help="Load test the VOEvent server.")
+@click.option(
+    "--requests",
+    default=2000,
+    type=click.IntRange(min=1),
+    help="Requests measured.",
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    default=32,
+    type=click.IntRange(min=1),
+    help="Concurrent clients.",
+    show_default=True,
+)
+@click.option(
+    "--workers",
+    default=2,
+    type=click.IntRange(min=1),
+    help="Server workers.",
+    show_default=True,
+)
+@click.option(
+    "--warmup",
+    default=100,
+    type=click.IntRange(min=0),
+    help="Requests sent before measuring.",
+    show_default=True,
+)
+@click.option(
+    "--mongodb",
+    default=None,
+    metavar="HOST:PORT",
+    help="A scratch MongoDB the VOEvents are archived in. Defaults to none.",
+)
+@click.option(
+    "--save",
+    "save_path",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Save the result as a baseline.",
+)
+@click.option(
+    "--baseline",
+    "baseline_path",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Fail if the result regressed from this baseline.",
+)
+@click.option(
+    "--tolerance",
+    default=TOLERANCE,
+    type=click.FloatRange(min=0),
+    help="Relative slack of the comparison.",
+    show_default=True,
+)
+def bench(
+    requests,
+    concurrency,
+    workers,
+    warmup,
+    mongodb,
+    save_path,
+    baseline_path,
+    tolerance,
+):
+    """Load test the VOEvent server."""
+    address = None
+    if mongodb:
+        host, _, port = mongodb.rpartition(":")
+        address = (host or "localhost", int(port))
+    result = asyncio.run(
+        run(
+            requests=requests,
+            concurrency=concurrency,
+            workers=workers,
+            warmup=warmup,
+            mongodb=address,
+        )
+    )
+    click.echo(summary(result))
+    if save_path:
+        save(result, save_path)
+        click.echo(f"Saved the baseline {save_path}.")
+    if baseline_path:
+        regressions = compare(result, baseline(baseline_path), tolerance)
+        for regression in regressions:
+            click.echo(f"Regression: {regression}", err=True)
+        if regressions:
+            raise SystemExit(1)
+        click.echo(f"No regression from {baseline_path}.")
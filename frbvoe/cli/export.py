@@ -0,0 +1,50 @@
+"""Export CLI."""
+
+import click
+from pymongo import MongoClient
+
+from frbvoe.utilities.export import BATCH_SIZE, FIELDS, FORMATS, Encoder
+from frbvoe.utilities.export import export as export_collection
+
+
+@click.command("export", help="Export a collection as NDJSON, CSV or columns.")
+@click.argument("collection", type=click.Choice(sorted(FIELDS)))
+@click.option(
+    "--format",
+    "format_",
+    default="ndjson",
+    type=click.Choice(sorted(FORMATS)),
+    help="Export format.",
+    show_default=True,
+)
+@click.option(
+    "--output",
+    default="-",
+    type=click.File("wb"),
+    help="Output file.",
+    show_default=True,
+)
+@click.option(
+    "--batch-size",
+    default=BATCH_SIZE,
+    type=click.IntRange(min=1),
+    help="Documents read per round trip.",
+    show_default=True,
+)
+@click.option("--hostname", default="localhost", help="MongoDB hostname.")
+@click.option("--port", default=27017, help="MongoDB port.")
+@click.option("--username", default="", help="MongoDB username.")
+@click.option("--password", default="", help="MongoDB password.")
+def export(collection, format_, output, batch_size, hostname, port, username, password):
+    """Export a collection."""
+    client = MongoClient(host=hostname, port=port, username=username, password=password)
+    try:
+        exported = export_collection(
+            client["frbvoe"][collection],
+            Encoder(collection, format_),
+            output,
+            batch_size=batch_size,
+        )
+    finally:
+        client.close()
+    click.echo(f"Exported {exported} documents from {collection}.", err=True)
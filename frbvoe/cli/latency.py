@@ -0,0 +1,37 @@
+"""Latency CLI."""
+
+import click
+from pymongo import MongoClient
+
+from frbvoe.utilities.tracing import latency_pipeline, latency_report
+
+
+@click.command("latency", help="Report the detection-to-broadcast latency.")
+@click.option("--start", default=None, help="Earliest detection date, inclusive.")
+@click.option("--end", default=None, help="Latest detection date, exclusive.")
+@click.option("--hostname", default="localhost", help="MongoDB hostname.")
+@click.option("--port", default=27017, help="MongoDB port.")
+@click.option("--username", default="", help="MongoDB username.")
+@click.option("--password", default="", help="MongoDB password.")
+def latency(start, end, hostname, port, username, password):
+    """Report the p50/p95/p99 latency from detection to broadcast."""
+    query = {}
+    if start or end:
+        # Dates are stored in the format of VOEvent.date, which sorts as text.
+        query["date"] = {
+            **({"$gte": start} if start else {}),
+            **({"$lt": end} if end else {}),
+        }
+    client = MongoClient(host=hostname, port=port, username=username, password=password)
+    try:
+        rows = client["frbvoe"]["voe"].aggregate(latency_pipeline(query))
+        report = latency_report(list(rows))
+    finally:
+        client.close()
+    click.echo(f"{'sink':<8}{'count':>8}{'p50 (s)':>12}{'p95 (s)':>12}{'p99 (s)':>12}")
+    for sink, summary in report.items():
+        percentiles = "".join(
+            f"{summary[p]:>12.3f}" if p in summary else f"{'-':>12}"
+            for p in ("p50", "p95", "p99")
+        )
+        click.echo(f"{sink:<8}{summary['count']:>8}{percentiles}")
@@ -2,6 +2,10 @@
 
 import click
 
+from frbvoe.cli.bench import bench
+from frbvoe.cli.export import export
+from frbvoe.cli.latency import latency
+from frbvoe.cli.snapshot import snapshot
 from frbvoe.cli.subscriber import subscriber
 from frbvoe.cli.tns import tns
 from frbvoe.cli.voe import voe
@@ -22,3 +26,7 @@ def version():
 cli.add_command(voe)
 cli.add_command(tns)
 cli.add_command(subscriber)
+cli.add_command(export)
+cli.add_command(snapshot)
+cli.add_command(latency)
+cli.add_command(bench)
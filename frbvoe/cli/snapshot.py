@@ -0,0 +1,46 @@
+"""Snapshot CLI."""
+
+import click
+from pymongo import MongoClient
+
+from frbvoe.utilities.export import BATCH_SIZE
+from frbvoe.utilities.snapshot import KEEP
+from frbvoe.utilities.snapshot import snapshot as snapshot_collection
+
+
+@click.command("snapshot", help="Write a columnar snapshot of the VOEvent archive.")
+@click.option(
+    "--path",
+    default="./snapshots",
+    type=click.Path(file_okay=False),
+    help="Directory of the snapshots.",
+    show_default=True,
+)
+@click.option(
+    "--keep",
+    default=KEEP,
+    type=click.IntRange(min=0),
+    help="Older snapshots kept.",
+    show_default=True,
+)
+@click.option(
+    "--batch-size",
+    default=BATCH_SIZE,
+    type=click.IntRange(min=1),
+    help="Documents read per round trip.",
+    show_default=True,
+)
+@click.option("--hostname", default="localhost", help="MongoDB hostname.")
+@click.option("--port", default=27017, help="MongoDB port.")
+@click.option("--username", default="", help="MongoDB username.")
+@click.option("--password", default="", help="MongoDB password.")
+def snapshot(path, keep, batch_size, hostname, port, username, password):
+    """Write a snapshot of the VOEvent archive."""
+    client = MongoClient(host=hostname, port=port, username=username, password=password)
+    try:
+        directory = snapshot_collection(
+            client["frbvoe"]["voe"], path, batch_size=batch_size, keep=keep
+        )
+    finally:
+        client.close()
+    click.echo(f"Wrote the snapshot {directory}.")
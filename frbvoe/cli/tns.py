@@ -1,8 +1,39 @@
 """TNS CLI."""
 
+import asyncio
+
 import click
+import orjson
 
 from frbvoe.backend.tns import TNS
+from frbvoe.utilities.http import HTTPClient
+from frbvoe.utilities.tns import TNSClient
+
+
+async def submit_report(report: TNS, poll_interval: float = 5.0) -> str:
+    """Submits a TNS report and waits for its TNS name, outside the server.
+
+    Args:
+        report (TNS): The TNS report.
+        poll_interval (float): Delay before the first poll of the reply, in
+            seconds. Defaults to 5.
+
+    Returns:
+        str: The TNS name of the FRB.
+
+    Raises:
+        TNSError: If the TNS rejected the report.
+    """
+    http = HTTPClient()
+    client = TNSClient(http, window=0.0, base_backoff=poll_interval)
+    stop = asyncio.Event()
+    running = asyncio.create_task(client.run(stop))
+    try:
+        return await report.submit(client)
+    finally:
+        stop.set()
+        await running
+        await http.close()
 
 
 @click.group(name="tns", help="TNS Tools.")
@@ -12,14 +43,29 @@ def tns():
 
 
 @tns.command("submit", help="Submit an FRB to the TNS.")
+@click.argument("report", type=click.File("rb"))
 @click.option(
-    "--period", default=10, help="Proprietary period of the FRB.", show_default=True
+    "--period",
+    default=10.0,
+    help="Proprietary period of the FRB, in years.",
+    show_default=True,
+)
+@click.option(
+    "--sandbox/--live",
+    default=True,
+    help="Submit to the sandbox TNS or the live TNS.",
+    show_default=True,
 )
 @click.option(
-    "--sandbox",
-    help="Submit to the sandbox TNS (if True) or live TNS (if False).",
+    "--poll-interval",
+    default=5.0,
+    help="Seconds before the first poll of the reply.",
     show_default=True,
 )
-def submit(proprietary_period, sandbox):
-    """Submit an FRB to the TNS."""
-    TNS.submit(proprietary_period, sandbox)
+def submit(report, period, sandbox, poll_interval):
+    """Submit an FRB to the TNS, from the JSON of its TNS report."""
+    tns_report = TNS(
+        **{**orjson.loads(report.read()), "period": period, "sandbox": sandbox}
+    )
+    name = asyncio.run(submit_report(tns_report, poll_interval))
+    click.echo(f"Named {tns_report.internal_id} {name}.")
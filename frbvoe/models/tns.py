@@ -1,13 +1,13 @@
 """format a VOE for a TNS submission."""
 
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import picologging as logging
-import requests
-from pydantic import Field
+from pydantic import Field, SecretStr
 from pydantic_settings import SettingsConfigDict
 
 from frbvoe.models.voe import VOEvent
+from frbvoe.utilities.tns import Account, NameCache, TNSClient
 
 logging.basicConfig()
 log = logging.getLogger()
@@ -47,7 +47,7 @@ class TNS(VOEvent):
         description="""If True, use the TNS sandbox. Defaults to True.""",
         example=True,
     )
-    tns_api_key: str = Field(  # consider changing to SecretStr
+    tns_api_key: SecretStr = Field(
         ...,
         description="API key for the TNS. Required.",
     )
@@ -56,53 +56,52 @@ class TNS(VOEvent):
     )
     tns_bot_name: str = Field(..., description="Name of the TNS bot. Required.")
 
-    @property
-    def search(tns_report: Dict[str, Any]):
-        """Searches the TNS API for a specific event.
+    async def search(self, cache: NameCache) -> Optional[str]:
+        """Looks up the TNS name of the FRB by its internal ID.
 
         Args:
-            tns_report (Dict[str, Any]): The TNS report data to be searched.
+            cache (NameCache): The worker's cache of TNS names.
 
         Returns:
-            The response from the TNS API.
+            Optional[str]: The TNS name, None if the TNS does not know it.
 
         Raises:
-            requests.HTTPError: If the request to the TNS API fails.
+            TNSError: If the TNS did not answer the lookup.
         """
-        url = "http://0.0.0.0:4357/v1/voe/tns/search"
-        internal_name = tns_report["internal_name"]
-        print(f"Searching TNS for object with internal name '{internal_name}'")
-        tns_name = requests.post(url, json={"internal_name": internal_name}).json()[
-            "tns_name"
-        ]
-        return tns_name
-
-    @property
-    def submit(tns_report: Dict[str, Any]):
-        """Submits a VOEvent to the TNS API.
+        log.info(f"Searching TNS for object with internal name '{self.internal_id}'")
+        return await cache.get(self.account(), self.internal_id)
+
+    def account(self) -> Account:
+        """Returns the TNS account the report is sent with."""
+        return (self.sandbox, self.tns_api_key.get_secret_value(), self.tns_bot_name)
+
+    def document(self) -> Dict[str, Any]:
+        """Returns the report saved to MongoDB, without the credentials."""
+        return self.model_dump(exclude={"tns_api_key", "email_password"})
+
+    def report(self) -> Dict[str, Any]:
+        """Returns the FRB report sent to the TNS, without the credentials."""
+        return self.model_dump(
+            mode="json",
+            exclude={"tns_api_key", "tns_bot_name", "sandbox", "email_password"},
+            exclude_none=True,
+        )
+
+    async def submit(self, client: TNSClient, reference: Any = None) -> str:
+        """Submits the report to the TNS and waits for its TNS name.
+
+        The report is sent in the next bulk report of the worker, and named
+        once the TNS processed it, which may take minutes.
 
         Args:
-            tns_report (Dict[str, Any]): The TNS report data to be submitted.
+            client (TNSClient): The worker's TNS client.
+            reference (Any): The reference of the report, see `TNSClient.submit`.
 
         Returns:
-            The response from the TNS API.
+            str: The TNS name of the FRB.
 
         Raises:
-            requests.HTTPError: If the request to the TNS API fails.
+            TNSError: If the TNS rejected the report.
         """
-        # Make the JSON report
-        url = "https://sandbox.wis-tns.org/api/bulk-report-form"
-        headers = {"User-Agent": tns_report["tns_bot_name"]}
-        json_data = {"api_key": tns_report["tns_api_key"], "data": tns_report}
-        log.info("Sending VOE payload to TNS.")
-        resp = requests.post(url=url, headers=headers, json=json_data)
-        status = resp.status_code
-        assert status == 200, f"Bad response status code: {status}"
-        resp_json = resp.json()
-        print(f"Got response from backend: {resp_json}")
-        tns_name = resp_json["tns_name"]
-        assert (
-            tns_name is not None
-        ), "TNS rejected submission, retain report ID if this persists."
-
-        return tns_name
+        log.info("Queueing the report for the TNS.")
+        return await client.submit(self.account(), self.report(), reference)
@@ -1,28 +1,51 @@
 """Virtual Observatory Event (VOEvent) Model."""
 
 # from datetime import datetime
-from typing import Any, Dict, Literal, Optional
+from functools import lru_cache
+from typing import Annotated, Any, Dict, Literal, Optional, Sequence, Union
 
 import picologging as logging
-import requests
 from pydantic import (
+    AfterValidator,
     BaseModel,
-    EmailStr,
     Field,
     SecretStr,
     StrictFloat,
     StrictInt,
     StrictStr,
+    WithJsonSchema,
 )
+from pydantic.networks import validate_email
 
 # from pydantic_settings import BaseSettings, SettingsConfigDict
 from sanic import Request
 
-from frbvoe.utilities.email import send_email
+from frbvoe.utilities import xml
+from frbvoe.utilities.email import deliver_email, send_email
+from frbvoe.utilities.http import HTTPClient
+from frbvoe.utilities.smtp import SMTPPool
 
 logging.basicConfig()
 log = logging.getLogger()
 
+# Receiver of the Comet broker started by docker-compose.
+COMET_URL = "http://comet:8098/"
+
+
+@lru_cache(maxsize=1024)
+def _validate_email(value: str) -> str:
+    """Validates and normalizes an email address, like EmailStr."""
+    return validate_email(value)[1]
+
+
+# EmailStr with the validation of every address cached. VOEvents come from a
+# handful of authors, and validating the address dominates validating a VOEvent.
+CachedEmailStr = Annotated[
+    str,
+    AfterValidator(_validate_email),
+    WithJsonSchema({"type": "string", "format": "email"}),
+]
+
 
 class VOEvent(BaseModel):  # BaseSettings
     """VOEvent Object.
@@ -34,7 +57,7 @@ class VOEvent(BaseModel):  # BaseSettings
         kind (str): Which kind of VOEvent. Required.
         observatory_name (str): Name of the host observatory. Required.
         date (datetime): Detection time of the FRB. Required.
-        email (EmailStr): Email address of the VOEvent author. Required.
+        email (CachedEmailStr): Email address of the VOEvent author. Required.
         semi_major (float): Semi-major axis of the error ellipse of the
         host observatory's beam. Optional.
         semi_minor (float): Semi-minor axis of the error ellipse of the
@@ -89,7 +112,7 @@ class VOEvent(BaseModel):  # BaseSettings
         description="Detection time of the FRB. Required.",
         example="2020-01-13 16:55:08.844845",
     )
-    email: EmailStr = Field(
+    email: CachedEmailStr = Field(
         ...,
         description="Email address of the VOEvent author. Required.",
         example="john.smith@email.com",
@@ -226,32 +249,69 @@ class VOEvent(BaseModel):  # BaseSettings
         log.info("Returning VOEvent payload")
         return self.dict()
 
-    @property
-    def send_comet(comet_report: Dict[str, Any]):
+    def to_xml(self) -> str:
+        """Serializes the VOEvent to a VOEvent 2.0 XML document.
+
+        Returns:
+            str: The VOEvent XML document.
+        """
+        return xml.render(self.model_dump(exclude={"email_password"}))
+
+    @classmethod
+    def from_xml(cls, document: Union[str, bytes]) -> "VOEvent":
+        """Builds a VOEvent from a VOEvent 2.0 XML document.
+
+        Args:
+            document (Union[str, bytes]): The VOEvent XML document.
+
+        Returns:
+            VOEvent: VOEvent object.
+        """
+        return cls(**xml.parse(document, XML_TYPES))
+
+    async def send_comet(
+        comet_report: Dict[str, Any], client: HTTPClient, url: str = COMET_URL
+    ):
         """Sends a report using the given VOEvent and comet URL.
 
         Args:
             voevent (Dict[str, Any]): The VOEvent to send.
-            comet_url (str): The URL of the comet to send the report to.
-            comet_port (SecretInt) : Port of the comet broker. Optional
+            client (HTTPClient): The worker's pooled HTTP client.
+            url (str): URL of the Comet receiver. Defaults to COMET_URL.
+
+        Returns:
+            bool: Whether Comet accepted the VOEvent.
         """
         log.info("Sending VOE payload to Comet as a report.")
-        response = requests.post("http://comet:8098/", json=comet_report)
+        response = await client.post(
+            url,
+            content=comet_report.to_xml(),
+            headers={"Content-Type": "text/xml"},
+        )
         # TODO: check comet endpoint
         return response.status_code == 200
 
-    @property
-    def send_email(email_report: Dict[str, Any]):
+    async def send_email(
+        email_report: Dict[str, Any],
+        smtp: Optional[SMTPPool],
+        receiver_emails: Sequence[str] = (),
+    ):
         """Sends the VOEvent email.
 
         Args:
             voevent (Dict[str, Any]): The VOEvent data.
+            smtp (Optional[SMTPPool]): The worker's SMTP pool, if one is
+                configured.
+            receiver_emails (Sequence[str]): Addresses of the subscribers.
 
         Returns:
             status (str): The status of the email.
         """
-        log.info("Emailing VOE payload to subscribers.")
-        send_email(email_report)
+        log.info(f"Emailing VOE payload to {len(receiver_emails)} subscribers.")
+        if smtp is None:
+            return send_email(email_report.model_dump(), receiver_emails)
+        await deliver_email(email_report.model_dump(), receiver_emails, smtp)
+        return "Success"
 
     @staticmethod
     async def compile(request: Request):
@@ -268,5 +328,12 @@ class VOEvent(BaseModel):  # BaseSettings
             Object containing dependency data to take actions.
         """
         await request.receive_body()
-        voe = request.json
-        return VOEvent(**voe)
+        return VOEvent.model_validate_json(request.body)
+
+
+# Converters of the numeric fields read back from VOEvent XML parameters.
+XML_TYPES = {
+    name: field.annotation
+    for name, field in VOEvent.model_fields.items()
+    if field.annotation in (int, float)
+}
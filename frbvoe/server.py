@@ -1,24 +1,183 @@
 """Buckets Server."""
 
+import asyncio
+import math
+import os
+import time
 from asyncio import AbstractEventLoop
 from functools import partial
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Optional, Tuple
 
+import orjson
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import ConnectionFailure
-from sanic import Sanic
+from pymongo.errors import ConnectionFailure, PyMongoError
+from sanic import Request, Sanic
 from sanic.log import logger
 from sanic.worker.loader import AppLoader
 
+from frbvoe.backend.export import export as export_blueprint
+from frbvoe.backend.metrics import metrics as metrics_blueprint
+from frbvoe.backend.tns import save_names
+from frbvoe.backend.tns import tns as tns_blueprint
+from frbvoe.backend.voe import broadcasts
 from frbvoe.backend.voe import voe as voe_blueprint
 from frbvoe.models.voe import VOEvent
+from frbvoe.utilities.breaker import Breakers
+from frbvoe.utilities.dedupe import RecentVOEvents
+from frbvoe.utilities.dispatch import in_flight
+from frbvoe.utilities.http import HTTPClient
+from frbvoe.utilities.indexes import collection_scans, ensure_indexes
+from frbvoe.utilities.metrics import SLOTS, Metrics, allocate
+from frbvoe.utilities.outbox import FileOutbox, MongoOutbox, drain
+from frbvoe.utilities.ratelimit import RateLimiter
+from frbvoe.utilities.ratelimit import allocate as allocate_buckets
+from frbvoe.utilities.ratelimit import rates
+from frbvoe.utilities.repeaters import RepeaterIndex
+from frbvoe.utilities.search import backfill_locations
+from frbvoe.utilities.smtp import SMTPPool
+from frbvoe.utilities.snapshot import snapshots
+from frbvoe.utilities.subscribers import SubscriberRegistry
+from frbvoe.utilities.tns import NameCache, TNSClient
+from frbvoe.utilities.tracing import Tracer
+from frbvoe.utilities.vtp import PORT as VTP_PORT
+from frbvoe.utilities.vtp import run_broker
 
+# orjson, allowing the integer keys of e.g. the OpenAPI responses.
+dumps = partial(orjson.dumps, option=orjson.OPT_NON_STR_KEYS)
 
-async def mongo(app: Sanic, loop: AbstractEventLoop) -> None:
+
+async def shared_metrics(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Allocate the metrics shared by the workers, in the main process.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    # SANIC_METRICS_SLOTS
+    app.shared_ctx.metrics = allocate(int(app.config.get("METRICS_SLOTS", SLOTS)))
+
+
+async def instrumentation(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Claim the worker's slot of the shared metrics.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    shared = getattr(app.shared_ctx, "metrics", None)
+    app.ctx.metrics = Metrics(*shared) if shared is not None else Metrics()
+
+
+async def shared_rate_limits(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Allocate the token buckets shared by the workers, in the main process.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    app.shared_ctx.buckets = allocate_buckets()
+
+
+async def rate_limits(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Set up the worker's rate limiter of the external services.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    shared = getattr(app.shared_ctx, "buckets", None)
+    app.ctx.limiter = RateLimiter(rates(app.config), *(shared or ()))
+
+
+async def circuit_breakers(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Set up the worker's circuit breakers, reported by the health endpoint.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+
+    def report(breakers: Breakers) -> None:
+        # The worker state is served at /__health__/.
+        app.m.state.update({"breakers": breakers.report()})
+
+    app.ctx.breakers = Breakers(
+        ("comet", "smtp", "tns", "mongo"),
+        on_change=report,
+        # SANIC_BREAKER_FAILURES
+        failures=int(app.config.get("BREAKER_FAILURES", 5)),
+        # SANIC_BREAKER_RESET
+        reset=float(app.config.get("BREAKER_RESET", 30.0)),
+        # SANIC_BREAKER_MIN_TIMEOUT
+        min_timeout=float(app.config.get("BREAKER_MIN_TIMEOUT", 0.25)),
+        # SANIC_BREAKER_MAX_TIMEOUT
+        max_timeout=float(app.config.get("BREAKER_MAX_TIMEOUT", 10.0)),
+        overrides={
+            # An insert timed out may still commit, so it is not timed out;
+            # SANIC_MONGODB_TIMEOUT and SANIC_MONGODB_SOCKET_TIMEOUT bound it.
+            "mongo": {"max_timeout": None},
+            # SANIC_BREAKER_SMTP_MIN_TIMEOUT, above a cold TLS connection
+            "smtp": {
+                "min_timeout": float(app.config.get("BREAKER_SMTP_MIN_TIMEOUT", 5.0))
+            },
+        },
+    )
+    app.ctx.breakers.publish()
+
+
+def cpu_quota() -> Optional[float]:
+    """Returns the CPU quota of the cgroup of the process, None if unlimited."""
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """Returns the number of CPUs the server may use.
+
+    Counts the CPUs the process is pinned to, capped by the CPU quota of its
+    cgroup, e.g. `cpus: "0.5"` in docker-compose.
+
+    Returns:
+        int: The number of CPUs, at least 1.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+async def connect(app: Sanic, loop: AbstractEventLoop, **pool) -> AsyncIOMotorClient:
     """Connect to the database.
 
     Args:
         app (Sanic): The application.
         loop (AbstractEventLoop): The event loop.
+        **pool: Options of the connection pool, e.g. `maxPoolSize`.
+
+    Returns:
+        AsyncIOMotorClient: The client, once the server answered a ping.
+
+    Raises:
+        ConnectionFailure: If the server is unreachable.
     """
     # SANIC_MONGODB_HOSTNAME
     hostname = str(app.config.get("MONGODB_HOSTNAME", "localhost"))
@@ -28,19 +187,508 @@ async def mongo(app: Sanic, loop: AbstractEventLoop) -> None:
     username = app.config.get("MONGODB_USERNAME", "")
     # SANIC_MONGODB_PASSWORD
     password = app.config.get("MONGODB_PASSWORD", "")
+    # SANIC_MONGODB_TIMEOUT
+    timeout = float(app.config.get("MONGODB_TIMEOUT", 30.0))
+    # SANIC_MONGODB_SOCKET_TIMEOUT
+    socket_timeout = float(app.config.get("MONGODB_SOCKET_TIMEOUT", 30.0))
+    logger.debug(f"Connecting to MongoDB at {hostname}:{port}")
+    client = AsyncIOMotorClient(
+        host=hostname,
+        port=port,
+        username=username,
+        password=password,
+        serverSelectionTimeoutMS=int(timeout * 1000),
+        socketTimeoutMS=int(socket_timeout * 1000),
+        io_loop=loop,
+        **pool,
+    )
     try:
-        logger.debug(f"Connecting to MongoDB at {hostname}:{port}")
-        client = AsyncIOMotorClient(
-            host=hostname, port=port, username=username, password=password, io_loop=loop
-        )
         await client.admin.command("ping")
-        logger.debug("MongoDB Connection Established")
+    except ConnectionFailure:
+        client.close()
+        raise
+    return client
+
+
+def pool_sizes(app: Sanic) -> Tuple[int, int]:
+    """Returns the size of the MongoDB connection pool of every worker.
+
+    The maximum is `SANIC_MONGODB_MAX_POOL_SIZE`, or else the
+    `SANIC_MONGODB_MAX_CONNECTIONS` of the server shared by its
+    `SANIC_WORKERS`, or else the default of pymongo.
+
+    Args:
+        app (Sanic): The application.
+
+    Returns:
+        Tuple[int, int]: The minimum and maximum number of connections.
+    """
+    # SANIC_MONGODB_MAX_CONNECTIONS
+    connections = app.config.get("MONGODB_MAX_CONNECTIONS", None)
+    # SANIC_WORKERS
+    workers = max(1, int(app.config.get("WORKERS", 1)))
+    default = max(1, int(connections) // workers) if connections else 100
+    # SANIC_MONGODB_MAX_POOL_SIZE
+    maximum = int(app.config.get("MONGODB_MAX_POOL_SIZE", default))
+    # SANIC_MONGODB_MIN_POOL_SIZE
+    return min(int(app.config.get("MONGODB_MIN_POOL_SIZE", 2)), maximum), maximum
+
+
+async def mongo(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Connect the worker to the database, and warm its connection pool.
+
+    Idle connections are opened up to the minimum size of the pool, see
+    `pool_sizes`, before the worker accepts requests.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    min_pool_size, max_pool_size = pool_sizes(app)
+    try:
+        client = await connect(
+            app, loop, maxPoolSize=max_pool_size, minPoolSize=min_pool_size
+        )
+        # Open the idle connections now rather than on the first requests.
+        await asyncio.gather(
+            *(client.admin.command("ping") for _ in range(min_pool_size))
+        )
+        logger.debug(
+            f"MongoDB Connection Established, pool of {min_pool_size} to "
+            f"{max_pool_size} connections"
+        )
         app.ctx.mongo = client
     except ConnectionFailure as error:
         logger.error(error)
         logger.debug("MongoDB Connection Failed")
 
 
+async def indexes(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Create or verify the database indexes, once before the workers start.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    try:
+        client = await connect(app, loop, maxPoolSize=1)
+    except ConnectionFailure as error:
+        logger.error(f"While creating the MongoDB indexes: {error}")
+        return
+    database = client["frbvoe"]
+    try:
+        await ensure_indexes(database)
+        # SANIC_BACKFILL_LOCATIONS
+        if app.config.get("BACKFILL_LOCATIONS", False):
+            updated = await backfill_locations(database["voe"])
+            logger.info(f"Added the sky location of {updated} VOEvents")
+        # SANIC_AUDIT_QUERIES
+        if app.config.get("AUDIT_QUERIES", True):
+            await collection_scans(database)
+    except PyMongoError as error:
+        logger.error(f"While creating the MongoDB indexes: {error}")
+    finally:
+        client.close()
+
+
+async def http(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Open the worker's pooled HTTP client.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    app.ctx.http = HTTPClient(
+        # SANIC_HTTP_TIMEOUT
+        timeout=float(app.config.get("HTTP_TIMEOUT", 10.0)),
+        # SANIC_HTTP_CONNECT_TIMEOUT
+        connect_timeout=float(app.config.get("HTTP_CONNECT_TIMEOUT", 5.0)),
+        # SANIC_HTTP_MAX_CONNECTIONS
+        max_connections=int(app.config.get("HTTP_MAX_CONNECTIONS", 100)),
+        # SANIC_HTTP_MAX_KEEPALIVE_CONNECTIONS
+        max_keepalive_connections=int(
+            app.config.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+        ),
+        # SANIC_HTTP_KEEPALIVE_EXPIRY
+        keepalive_expiry=float(app.config.get("HTTP_KEEPALIVE_EXPIRY", 30.0)),
+        # SANIC_HTTP2
+        http2=bool(app.config.get("HTTP2", True)),
+    )
+
+
+async def close_http(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Close the worker's pooled HTTP client.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    await app.ctx.http.close()
+
+
+async def tracing(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Create the worker's tracer.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    # SANIC_TRACING
+    if not app.config.get("TRACING", True):
+        return
+    # SANIC_TRACE_PATH
+    directory = app.config.get("TRACE_PATH", "")
+    path = None
+    if directory:
+        # One file per worker, as they append concurrently.
+        worker = os.environ.get("SANIC_WORKER_NAME", "traces")
+        path = Path(directory) / f"{worker}.jsonl"
+        path.parent.mkdir(parents=True, exist_ok=True)
+    app.ctx.tracer = Tracer(
+        collection=(
+            app.ctx.mongo["frbvoe"]["voe"] if hasattr(app.ctx, "mongo") else None
+        ),
+        path=path,
+        # SANIC_TRACE_ENDPOINT
+        endpoint=app.config.get("TRACE_ENDPOINT", "") or None,
+        client=app.ctx.http,
+    )
+
+
+async def received(request: Request) -> None:
+    """Note when a request arrived, the start of its trace.
+
+    Args:
+        request (Request): The request.
+    """
+    request.ctx.received = time.time_ns()
+
+
+async def smtp(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Create the worker's SMTP pool, if an SMTP server is configured.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    app.ctx.smtp = None
+    # SANIC_SMTP_HOSTNAME
+    hostname = app.config.get("SMTP_HOSTNAME", "")
+    if not hostname:
+        logger.warning("No SMTP server configured, VOEvent emails will not be sent")
+        return
+    # SANIC_SMTP_START_TLS
+    start_tls = app.config.get("SMTP_START_TLS", None)
+    app.ctx.smtp = SMTPPool(
+        str(hostname),
+        # SANIC_SMTP_PORT
+        port=int(app.config.get("SMTP_PORT", 587)),
+        # SANIC_SMTP_USERNAME
+        username=app.config.get("SMTP_USERNAME", ""),
+        # SANIC_SMTP_PASSWORD
+        password=app.config.get("SMTP_PASSWORD", ""),
+        start_tls=bool(start_tls) if start_tls is not None else None,
+        # SANIC_SMTP_USE_TLS
+        use_tls=bool(app.config.get("SMTP_USE_TLS", False)),
+        # SANIC_SMTP_POOL_SIZE
+        size=int(app.config.get("SMTP_POOL_SIZE", 4)),
+        # SANIC_SMTP_TIMEOUT
+        timeout=float(app.config.get("SMTP_TIMEOUT", 10.0)),
+        # SANIC_SMTP_BCC_SIZE
+        bcc_size=int(app.config.get("SMTP_BCC_SIZE", 50)),
+        limiter=app.ctx.limiter,
+        breaker=app.ctx.breakers["smtp"],
+    )
+
+
+async def close_smtp(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Close the worker's SMTP pool.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    if app.ctx.smtp is not None:
+        await app.ctx.smtp.close()
+
+
+async def outbox(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Open the outbound broadcast queue.
+
+    The queue lives in MongoDB when it is reachable, and in a local journal
+    file otherwise.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    options = {
+        # SANIC_OUTBOX_BASE_BACKOFF
+        "base_backoff": float(app.config.get("OUTBOX_BASE_BACKOFF", 1.0)),
+        # SANIC_OUTBOX_MAX_BACKOFF
+        "max_backoff": float(app.config.get("OUTBOX_MAX_BACKOFF", 300.0)),
+        # SANIC_OUTBOX_MAX_ATTEMPTS
+        "max_attempts": int(app.config.get("OUTBOX_MAX_ATTEMPTS", 20)),
+        # SANIC_OUTBOX_RETENTION
+        "retention": float(app.config.get("OUTBOX_RETENTION", 7 * 86400.0)),
+    }
+    if hasattr(app.ctx, "mongo"):
+        logger.debug("Using the MongoDB outbox")
+        queue = MongoOutbox(app.ctx.mongo["frbvoe"]["outbox"], **options)
+    else:
+        # SANIC_OUTBOX_PATH
+        path = Path(app.config.get("OUTBOX_PATH", "./outbox"))
+        worker = os.environ.get("SANIC_WORKER_NAME", "outbox")
+        logger.warning(f"MongoDB unavailable, using the file outbox in {path}")
+        queue = FileOutbox(path / f"{worker}.jsonl", **options)
+    await queue.setup()
+    app.ctx.outbox = queue
+
+
+async def subscribers(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Load the worker's subscriber cache.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    if not hasattr(app.ctx, "mongo"):
+        logger.warning("MongoDB unavailable, no subscribers will be notified")
+        return
+    registry = SubscriberRegistry(
+        app.ctx.mongo["frbvoe"]["subscriber"],
+        # SANIC_SUBSCRIBERS_POLL_INTERVAL
+        poll_interval=float(app.config.get("SUBSCRIBERS_POLL_INTERVAL", 30.0)),
+    )
+    try:
+        await registry.load()
+    except PyMongoError as error:
+        logger.error(f"While loading the subscribers: {error}")
+    app.ctx.subscribers = registry
+
+
+async def repeaters(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Load the worker's index of past events for repeater association.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    # SANIC_REPEATERS
+    if not hasattr(app.ctx, "mongo") or not app.config.get("REPEATERS", True):
+        return
+    index = RepeaterIndex(
+        # SANIC_REPEATER_SIGMA
+        sigma=float(app.config.get("REPEATER_SIGMA", 1.0)),
+        # SANIC_REPEATER_DM_TOLERANCE
+        dm_tolerance=float(app.config.get("REPEATER_DM_TOLERANCE", 5.0)),
+        # SANIC_REPEATER_OVERLAP
+        overlap=float(app.config.get("REPEATER_OVERLAP", 60.0)),
+    )
+    try:
+        loaded = await index.refresh(app.ctx.mongo["frbvoe"]["voe"])
+        index.catalog.build()
+        logger.info(f"Indexed {loaded} past VOEvents for repeater association")
+    except PyMongoError as error:
+        logger.error(f"While loading the repeater index: {error}")
+    app.ctx.repeaters = index
+
+
+async def tns(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Create the worker's TNS client, batching its reports, and name cache.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    database = app.ctx.mongo["frbvoe"] if hasattr(app.ctx, "mongo") else None
+    # SANIC_TNS_API_KEYS, as a JSON object of the API keys by bot name
+    api_keys = app.config.get("TNS_API_KEYS", {})
+    if isinstance(api_keys, (str, bytes)):
+        api_keys = orjson.loads(api_keys)
+    app.ctx.tns = TNSClient(
+        app.ctx.http,
+        collection=database["tns_report"] if database is not None else None,
+        named=partial(save_names, app) if database is not None else None,
+        # SANIC_TNS_WINDOW
+        window=float(app.config.get("TNS_WINDOW", 1.0)),
+        # SANIC_TNS_BATCH_SIZE
+        batch_size=int(app.config.get("TNS_BATCH_SIZE", 100)),
+        # SANIC_TNS_POLL_INTERVAL
+        base_backoff=float(app.config.get("TNS_POLL_INTERVAL", 5.0)),
+        # SANIC_TNS_MAX_POLL_INTERVAL
+        max_backoff=float(app.config.get("TNS_MAX_POLL_INTERVAL", 300.0)),
+        limiter=app.ctx.limiter,
+        breaker=app.ctx.breakers["tns"],
+        api_keys=api_keys,
+    )
+    app.ctx.tns_names = NameCache(
+        app.ctx.tns.search,
+        collection=database["tns_cache"] if database is not None else None,
+        # SANIC_TNS_CACHE_SIZE
+        size=int(app.config.get("TNS_CACHE_SIZE", 10_000)),
+        # SANIC_TNS_CACHE_TTL
+        ttl=float(app.config.get("TNS_CACHE_TTL", 7 * 86400.0)),
+        # SANIC_TNS_CACHE_NEGATIVE_TTL
+        negative_ttl=float(app.config.get("TNS_CACHE_NEGATIVE_TTL", 600.0)),
+    )
+    app.ctx.tns.cache = app.ctx.tns_names
+
+
+async def dedupe(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Set up the worker's memory of the VOEvents it saw recently.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    # SANIC_DEDUP
+    if not app.config.get("DEDUP", True):
+        return
+    # SANIC_DEDUP_CACHE_SIZE
+    app.ctx.recent = RecentVOEvents(
+        size=int(app.config.get("DEDUP_CACHE_SIZE", 100_000))
+    )
+
+
+async def shared_vtp(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Create the queue of the built-in VTP broker, in the main process.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    # SANIC_VTP
+    if not app.config.get("VTP", False):
+        return
+    # SANIC_VTP_QUEUE_SIZE
+    app.shared_ctx.vtp = Queue(int(app.config.get("VTP_QUEUE_SIZE", 1000)))
+
+
+async def vtp_broker(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Start the built-in VTP broker in a process of its own.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    voevents = getattr(app.shared_ctx, "vtp", None)
+    if voevents is None:
+        return
+    app.manager.manage(
+        "VTPBroker",
+        run_broker,
+        {
+            "voevents": voevents,
+            # SANIC_VTP_HOSTNAME
+            "host": app.config.get("VTP_HOSTNAME", "0.0.0.0"),
+            # SANIC_VTP_PORT
+            "port": int(app.config.get("VTP_PORT", VTP_PORT)),
+            # SANIC_VTP_IVO, as the local IVO of the Comet broker it replaces.
+            "local_ivo": app.config.get("VTP_IVO", "ivo://frbvoe/test"),
+            # SANIC_VTP_ALIVE_INTERVAL
+            "interval": float(app.config.get("VTP_ALIVE_INTERVAL", 60.0)),
+        },
+    )
+
+
+async def vtp(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Hand the worker's VOEvents to the built-in VTP broker, if it runs.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    app.ctx.vtp = getattr(app.shared_ctx, "vtp", None)
+
+
+async def background_tasks(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Start the outbox workers, the pollers, the snapshots, metrics and traces.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    app.ctx.stop = asyncio.Event()
+    app.add_task(
+        app.ctx.metrics.monitor(
+            app.ctx.stop,
+            # SANIC_METRICS_INTERVAL
+            interval=float(app.config.get("METRICS_INTERVAL", 1.0)),
+            depth=app.ctx.outbox.depth,
+            background=in_flight,
+            pools=lambda: {
+                "http": getattr(app.ctx, "http", None),
+                "smtp": getattr(app.ctx, "smtp", None),
+                "tns_names": getattr(app.ctx, "tns_names", None),
+                "tracer": getattr(app.ctx, "tracer", None),
+            },
+        ),
+        name="metrics",
+    )
+    if hasattr(app.ctx, "subscribers"):
+        app.add_task(app.ctx.subscribers.watch(app.ctx.stop), name="subscribers")
+    if hasattr(app.ctx, "repeaters"):
+        app.add_task(
+            app.ctx.repeaters.watch(
+                app.ctx.mongo["frbvoe"]["voe"],
+                app.ctx.stop,
+                # SANIC_REPEATER_POLL_INTERVAL, without change streams
+                interval=float(app.config.get("REPEATER_POLL_INTERVAL", 5.0)),
+            ),
+            name="repeaters",
+        )
+    # SANIC_SNAPSHOT_PATH
+    snapshot_path = app.config.get("SNAPSHOT_PATH", "")
+    if snapshot_path and hasattr(app.ctx, "mongo"):
+        app.add_task(
+            snapshots(
+                app.ctx.mongo["frbvoe"]["voe"],
+                snapshot_path,
+                app.ctx.stop,
+                # SANIC_SNAPSHOT_INTERVAL
+                interval=float(app.config.get("SNAPSHOT_INTERVAL", 3600.0)),
+                # SANIC_SNAPSHOT_KEEP
+                keep=int(app.config.get("SNAPSHOT_KEEP", 1)),
+            ),
+            name="snapshots",
+        )
+    app.add_task(app.ctx.tns.run(app.ctx.stop), name="tns")
+    if hasattr(app.ctx, "tracer"):
+        app.add_task(
+            app.ctx.tracer.run(
+                app.ctx.stop,
+                # SANIC_TRACE_INTERVAL
+                interval=float(app.config.get("TRACE_INTERVAL", 1.0)),
+            ),
+            name="tracing",
+        )
+    # SANIC_OUTBOX_WORKERS
+    for n in range(int(app.config.get("OUTBOX_WORKERS", 1))):
+        app.add_task(
+            drain(
+                app.ctx.outbox,
+                {sink: partial(send, app) for sink, send in broadcasts.items()},
+                # SANIC_OUTBOX_BATCH_SIZE
+                batch_size=int(app.config.get("OUTBOX_BATCH_SIZE", 10)),
+                # SANIC_OUTBOX_POLL_INTERVAL
+                poll_interval=float(app.config.get("OUTBOX_POLL_INTERVAL", 1.0)),
+                stop=app.ctx.stop,
+            ),
+            name=f"outbox-{n}",
+        )
+
+
+async def stop_background_tasks(app: Sanic, loop: AbstractEventLoop) -> None:
+    """Ask the background tasks to stop after their current iteration.
+
+    Args:
+        app (Sanic): The application.
+        loop (AbstractEventLoop): The event loop.
+    """
+    app.ctx.stop.set()
+
+
 async def inject_dependencies(app: Sanic):
     """Adds dependencies for route handlers to the app.
 
@@ -65,7 +713,7 @@ def create(name: str = "frbvoe", debug: bool = False) -> Sanic:
     Returns:
         Sanic: The buckets server.
     """
-    app = Sanic(name)
+    app = Sanic(name, dumps=dumps, loads=orjson.loads)
     logger.propagate = False
     app.config.CORS_ORIGINS = "*"  # CORS
     app.config.HEALTH = True
@@ -74,8 +722,34 @@ def create(name: str = "frbvoe", debug: bool = False) -> Sanic:
     app.config.FALLBACK_ERROR_FORMAT = "json"
     # ? Blueprints
     app.blueprint(voe_blueprint)
+    app.blueprint(export_blueprint)
+    app.blueprint(metrics_blueprint)
+    app.blueprint(tns_blueprint)
+    # ? Middleware
+    app.register_middleware(received, "request")
     # ? Listeners
+    app.register_listener(shared_metrics, "main_process_start")
+    app.register_listener(instrumentation, "before_server_start")
+    app.register_listener(shared_rate_limits, "main_process_start")
+    app.register_listener(rate_limits, "before_server_start")
+    app.register_listener(circuit_breakers, "before_server_start")
+    app.register_listener(indexes, "main_process_start")
     app.register_listener(mongo, "before_server_start")
+    app.register_listener(http, "before_server_start")
+    app.register_listener(tracing, "before_server_start")
+    app.register_listener(smtp, "before_server_start")
+    app.register_listener(outbox, "before_server_start")
+    app.register_listener(subscribers, "before_server_start")
+    app.register_listener(repeaters, "before_server_start")
+    app.register_listener(dedupe, "before_server_start")
+    app.register_listener(tns, "before_server_start")
+    app.register_listener(shared_vtp, "main_process_start")
+    app.register_listener(vtp_broker, "main_process_ready")
+    app.register_listener(vtp, "before_server_start")
+    app.register_listener(background_tasks, "after_server_start")
+    app.register_listener(stop_background_tasks, "before_server_stop")
+    app.register_listener(close_http, "after_server_stop")
+    app.register_listener(close_smtp, "after_server_stop")
 
     # add an option for client(app).get("/shutdown") to shutdown the server
     @app.route("/shutdown")
@@ -89,11 +763,18 @@ def create(name: str = "frbvoe", debug: bool = False) -> Sanic:
 if __name__ == "__main__":
     loader = AppLoader(factory=partial(create))
     server: Sanic = loader.load()
+    # Production by default: one worker per CPU, without the debug mode or the
+    # reloader. Set SANIC_DEBUG and SANIC_AUTO_RELOAD to develop.
+    # SANIC_WORKERS
+    workers = int(server.config.get("WORKERS", 0)) or available_cpus()
+    # The workers size their MongoDB pools by it.
+    os.environ["SANIC_WORKERS"] = str(workers)
     server.prepare(
         host=server.config.get("HOSTNAME", "0.0.0.0"),  # type: ignore
         port=server.config.get("PORT", 8002),  # type: ignore
+        workers=workers,
         access_log=server.config.get("ACCESS_LOG", False),
-        auto_reload=server.config.get("AUTO_RELOAD", True),
-        debug=server.config.get("DEBUG", True),
+        auto_reload=server.config.get("AUTO_RELOAD", False),
+        debug=server.config.get("DEBUG", False),
     )
     Sanic.serve(primary=server, app_loader=loader)
@@ -0,0 +1,531 @@
+"""Load test of the VOEvent server.
+
+Runs `server.create()` with its own workers in a child process, against a
+stand-in Comet receiver and an SMTP sink served in this process, and posts the
+example VOEvents of `examples/send_voe.py` to `/create_voe` from concurrent
+clients. The VOEvents are archived in the MongoDB given, which should be a
+scratch `mongod`; without one the server runs without a database and every
+request reports a database failure, which still measures the rest.
+
+The result, e.g. requests per second, latency percentiles and the memory of
+each worker (read from `/metrics`), can be saved as a baseline that later runs
+are compared against.
+"""
+
+import ast
+import asyncio
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from functools import partial
+from itertools import cycle
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import httpx
+import numpy as np
+import orjson
+import picologging as logging
+
+logging.basicConfig()
+log = logging.getLogger()
+
+EXAMPLES = Path(__file__).parents[2] / "examples" / "send_voe.py"
+
+# Latency percentiles reported.
+PERCENTILES = (50, 90, 99)
+
+# Seconds between the samples of the gauges of the workers.
+METRICS_INTERVAL = 0.25
+
+# The memory gauges of the workers, in the text of `/metrics`.
+MEMORY = re.compile(
+    r'^frbvoe_(peak_)?resident_memory_bytes\{worker="(\d+)"\} (\S+)$', re.MULTILINE
+)
+
+# Relative slack of a comparison against a baseline.
+TOLERANCE = 0.2
+
+
+def example_payloads(path: Path = EXAMPLES) -> Iterator[Dict[str, Any]]:
+    """Reads the example payloads without running the example script.
+
+    Args:
+        path (Path): The example script. Defaults to `examples/send_voe.py`.
+
+    Yields:
+        Dict[str, Any]: The payloads, in the order of the script.
+    """
+    tree = ast.parse(path.read_text())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and node.targets[0].id.endswith("_payload"):
+            # The examples leave out the observatory, which is required.
+            yield {"observatory_name": "CHIME", **ast.literal_eval(node.value)}
+
+
+def free_port() -> int:
+    """Returns a TCP port free on the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StandIn:
+    """Base class of the stand-in servers, serving one coroutine per connection."""
+
+    def __init__(self):
+        """Initializes the server."""
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: Set[asyncio.Task] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[str, int]:
+        """Starts serving.
+
+        Args:
+            host (str): The interface. Defaults to the loopback.
+            port (int): The port. Defaults to a free one.
+
+        Returns:
+            Tuple[str, int]: The host and port served.
+        """
+        self.server = await asyncio.start_server(self._connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def _connection(self, reader, writer) -> None:
+        """Serves one connection until the client or `stop` closes it."""
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            await self.handle(reader, writer)
+        except (asyncio.CancelledError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def handle(self, reader, writer) -> None:
+        """Serves one connection."""
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        """Stops serving, closing the open connections."""
+        self.server.close()
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections)
+        await self.server.wait_closed()
+
+
+class CometReceiver(StandIn):
+    """Stand-in Comet receiver, answering every POST with a 200.
+
+    Attributes:
+        received (int): The VOEvents received.
+    """
+
+    def __init__(self):
+        """Initializes the receiver."""
+        super().__init__()
+        self.received = 0
+
+    async def handle(self, reader, writer) -> None:
+        """Answers the requests of one keep-alive connection."""
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            self.received += 1
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n"
+                b"Connection: keep-alive\r\n\r\n"
+            )
+            await writer.drain()
+
+
+class SMTPSink(StandIn):
+    """SMTP server accepting and discarding every message, without TLS or auth.
+
+    Attributes:
+        messages (int): The messages accepted.
+    """
+
+    def __init__(self):
+        """Initializes the sink."""
+        super().__init__()
+        self.messages = 0
+
+    async def handle(self, reader, writer) -> None:
+        """Holds one SMTP session."""
+        writer.write(b"220 frbvoe-bench ESMTP\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                writer.write(b"250-frbvoe-bench\r\n250 8BITMIME\r\n")
+            elif command == b"DATA":
+                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                await writer.drain()
+                await reader.readuntil(b"\r\n.\r\n")
+                self.messages += 1
+                writer.write(b"250 OK\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 Bye\r\n")
+                await writer.drain()
+                return
+            else:
+                # MAIL, RCPT, RSET and NOOP.
+                writer.write(b"250 OK\r\n")
+            await writer.drain()
+
+
+def serve(host: str, port: int, workers: int) -> None:
+    """Runs the server, configured by the `SANIC_` environment variables.
+
+    Args:
+        host (str): The interface.
+        port (int): The port.
+        workers (int): The number of workers.
+    """
+    from sanic import Sanic
+    from sanic.worker.loader import AppLoader
+
+    from frbvoe.server import create
+
+    loader = AppLoader(factory=partial(create))
+    app = loader.load()
+    app.prepare(
+        host=host,
+        port=port,
+        workers=workers,
+        access_log=False,
+        auto_reload=False,
+        debug=False,
+    )
+    Sanic.serve(primary=app, app_loader=loader)
+
+
+def worker_memory(metrics: str) -> Dict[str, Dict[str, float]]:
+    """Reads the memory of every worker from the metrics of the server.
+
+    Args:
+        metrics (str): The text of `/metrics`.
+
+    Returns:
+        Dict[str, Dict[str, float]]: The resident (`rss`) and peak resident
+        (`peak`) memory in MB of every worker, by worker slot.
+    """
+    memory: Dict[str, Dict[str, float]] = {}
+    for peak, worker, value in MEMORY.findall(metrics):
+        usage = memory.setdefault(worker, {})
+        usage["peak" if peak else "rss"] = round(float(value) / 2**20, 1)
+    return memory
+
+
+async def _response(reader) -> Tuple[int, bool]:
+    """Reads an HTTP/1.1 response with a Content-Length.
+
+    Args:
+        reader (asyncio.StreamReader): The connection.
+
+    Returns:
+        Tuple[int, bool]: Its status code, and whether the connection stays open.
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.split(b"\r\n")
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower()] = value.strip().lower()
+    await reader.readexactly(int(headers.get(b"content-length", 0)))
+    return int(lines[0].split()[1]), headers.get(b"connection") != b"close"
+
+
+async def load(
+    url: str,
+    payloads: List[Dict[str, Any]],
+    requests: int,
+    concurrency: int,
+) -> Tuple[float, np.ndarray, Counter]:
+    """Posts VOEvents from concurrent clients, each waiting for its response.
+
+    Every client holds one keep-alive connection and writes its requests
+    straight to the socket, so the load generator costs the measurement a lot
+    less than a full HTTP client would.
+
+    Args:
+        url (str): The `/create_voe` URL, over plain HTTP.
+        payloads (List[Dict[str, Any]]): The VOEvents, posted in turn.
+        requests (int): The number of requests.
+        concurrency (int): The number of concurrent clients.
+
+    Returns:
+        Tuple[float, np.ndarray, Counter]: The seconds taken, the latency of
+        every request in seconds, and the count of every status code (or error).
+    """
+    target = httpx.URL(url)
+    host, port = target.host, target.port or 80
+    requests_bytes = [
+        (
+            f"POST {target.raw_path.decode()} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        ).encode()
+        + body
+        for body in (orjson.dumps(payload) for payload in payloads)
+    ]
+    latencies = np.empty(requests)
+    statuses: Counter = Counter()
+    remaining = iter(range(requests))
+
+    async def client() -> None:
+        reader = writer = None
+        for n in remaining:
+            start = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                writer.write(requests_bytes[n % len(requests_bytes)])
+                code, keep_alive = await _response(reader)
+                statuses[code] += 1
+            except (OSError, ValueError, asyncio.IncompleteReadError) as error:
+                statuses[type(error).__name__] += 1
+                keep_alive = False
+            latencies[n] = time.perf_counter() - start
+            if not keep_alive and writer is not None:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, statuses
+
+
+async def _ready(url: str, timeout: float) -> None:
+    """Waits for the server to answer on its health endpoint."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=1.0) as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"The server did not start in {timeout}s.")
+                await asyncio.sleep(0.2)
+
+
+async def bench(
+    requests: int = 2000,
+    concurrency: int = 32,
+    workers: int = 2,
+    warmup: int = 100,
+    mongodb: Optional[Tuple[str, int]] = None,
+    startup_timeout: float = 60.0,
+) -> Dict[str, Any]:
+    """Load tests the server.
+
+    Args:
+        requests (int): The number of requests measured. Defaults to 2000.
+        concurrency (int): The number of concurrent clients. Defaults to 32.
+        workers (int): The number of server workers. Defaults to 2.
+        warmup (int): Requests sent before measuring. Defaults to 100.
+        mongodb (Optional[Tuple[str, int]]): Host and port of a scratch
+            MongoDB. Defaults to None, running without a database.
+        startup_timeout (float): Seconds the server may take to start.
+
+    Returns:
+        Dict[str, Any]: The `requests`, `requests_per_second`, `latency_ms`
+        percentiles, `statuses`, the `memory_mb` of every worker, and the
+        VOEvents the stand-ins `received`.
+    """
+    comet, smtp = CometReceiver(), SMTPSink()
+    # The journal of the file outbox, used without a database.
+    outbox = tempfile.TemporaryDirectory(prefix="frbvoe-bench-")
+    comet_host, comet_port = await comet.start()
+    smtp_host, smtp_port = await smtp.start()
+    port = free_port()
+    environment = {
+        "SANIC_COMET_URL": f"http://{comet_host}:{comet_port}/",
+        "SANIC_SMTP_HOSTNAME": smtp_host,
+        "SANIC_SMTP_PORT": str(smtp_port),
+        "SANIC_SMTP_START_TLS": "false",
+        "SANIC_AUDIT_QUERIES": "false",
+        "SANIC_WORKERS": str(workers),
+        "SANIC_METRICS_INTERVAL": str(METRICS_INTERVAL),
+        "SANIC_OUTBOX_PATH": outbox.name,
+    }
+    if mongodb is None:
+        # Give up on the database at once.
+        environment.update(
+            {"SANIC_MONGODB_HOSTNAME": "127.0.0.1", "SANIC_MONGODB_TIMEOUT": "0.1"}
+        )
+        environment["SANIC_MONGODB_PORT"] = str(free_port())
+    else:
+        environment["SANIC_MONGODB_HOSTNAME"] = mongodb[0]
+        environment["SANIC_MONGODB_PORT"] = str(mongodb[1])
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from frbvoe.utilities.bench import serve; "
+            f"serve('127.0.0.1', {port}, {workers})",
+        ],
+        env={**os.environ, **environment},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        await _ready(f"{base}/metrics", startup_timeout)
+        # Distinct alerts, as identical ones are only broadcast once.
+        examples = cycle(example_payloads())
+        payloads = [
+            {**next(examples), "internal_id": f"bench-{n}"}
+            for n in range(warmup + requests)
+        ]
+        if warmup:
+            await load(f"{base}/create_voe", payloads[:warmup], warmup, concurrency)
+        seconds, latencies, statuses = await load(
+            f"{base}/create_voe", payloads[warmup:], requests, concurrency
+        )
+        # Let every worker sample its gauges after the load.
+        await asyncio.sleep(2 * METRICS_INTERVAL)
+        async with httpx.AsyncClient() as client:
+            memory = worker_memory((await client.get(f"{base}/metrics")).text)
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        await comet.stop()
+        await smtp.stop()
+        outbox.cleanup()
+    points = np.percentile(latencies, PERCENTILES) * 1000
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "workers": workers,
+        "database": mongodb is not None,
+        "requests_per_second": requests / seconds,
+        "latency_ms": {
+            **{f"p{p}": float(point) for p, point in zip(PERCENTILES, points)},
+            "max": float(latencies.max() * 1000),
+        },
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "memory_mb": memory,
+        "received": {"comet": comet.received, "email": smtp.messages},
+    }
+
+
+def compare(
+    result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = TOLERANCE
+) -> List[str]:
+    """Compares a result against a baseline.
+
+    Args:
+        result (Dict[str, Any]): The result, from `bench`.
+        baseline (Dict[str, Any]): The baseline, an earlier result.
+        tolerance (float): The relative slack. Defaults to 0.2.
+
+    Returns:
+        List[str]: The regressions, empty if there is none.
+    """
+    regressions = []
+    for setting in ("concurrency", "workers", "database"):
+        if result.get(setting) != baseline.get(setting):
+            regressions.append(
+                f"the baseline ran with {setting} {baseline.get(setting)}, "
+                f"not {result.get(setting)}"
+            )
+    floor = baseline["requests_per_second"] * (1 - tolerance)
+    if result["requests_per_second"] < floor:
+        regressions.append(
+            f"{result['requests_per_second']:.0f} requests/s, below "
+            f"{baseline['requests_per_second']:.0f} by more than {tolerance:.0%}"
+        )
+    for name, latency in baseline["latency_ms"].items():
+        if name == "max":
+            continue
+        if result["latency_ms"][name] > latency * (1 + tolerance):
+            regressions.append(
+                f"{name} latency of {result['latency_ms'][name]:.2f} ms, above "
+                f"{latency:.2f} ms by more than {tolerance:.0%}"
+            )
+    peak = max((usage["peak"] for usage in result["memory_mb"].values()), default=0)
+    baseline_peak = max(
+        (usage["peak"] for usage in baseline["memory_mb"].values()), default=0
+    )
+    if baseline_peak and peak > baseline_peak * (1 + tolerance):
+        regressions.append(
+            f"{peak:.1f} MB peak worker memory, above {baseline_peak:.1f} MB "
+            f"by more than {tolerance:.0%}"
+        )
+    return regressions
+
+
+def save(result: Dict[str, Any], path: Path) -> None:
+    """Saves a result as a baseline.
+
+    Args:
+        result (Dict[str, Any]): The result, from `bench`.
+        path (Path): The baseline file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+
+
+def baseline(path: Path) -> Dict[str, Any]:
+    """Reads a baseline.
+
+    Args:
+        path (Path): The baseline file.
+
+    Returns:
+        Dict[str, Any]: The baseline.
+    """
+    return orjson.loads(Path(path).read_bytes())
+
+
+def summary(result: Dict[str, Any]) -> str:
+    """Returns a result, as text.
+
+    Args:
+        result (Dict[str, Any]): The result, from `bench`.
+
+    Returns:
+        str: The summary.
+    """
+    latency = ", ".join(f"{name} {ms:.2f}" for name, ms in result["latency_ms"].items())
+    memory = ", ".join(
+        f"{usage['rss']:.1f} (peak {usage['peak']:.1f})"
+        for usage in result["memory_mb"].values()
+    )
+    statuses = ", ".join(f"{code}: {n}" for code, n in result["statuses"].items())
+    return "\n".join(
+        [
+            f"{result['requests']} requests, {result['concurrency']} clients, "
+            f"{result['workers']} workers, "
+            f"{'with' if result['database'] else 'without'} a database",
+            f"Throughput: {result['requests_per_second']:.0f} requests/s",
+            f"Latency (ms): {latency}",
+            f"Statuses: {statuses}",
+            f"Worker memory (MB): {memory or 'unknown'}",
+            f"Received: {result['received']['comet']} by Comet, "
+            f"{result['received']['email']} emails",
+        ]
+    )
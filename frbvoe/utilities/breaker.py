@@ -0,0 +1,268 @@
+"""Circuit breakers and adaptive timeouts around the external sinks.
+
+A dead Comet, SMTP server, TNS or MongoDB would otherwise cost every request
+a full connection timeout. Each sink gets a breaker per worker: after
+`failures` consecutive failures it opens, and calls fail at once without
+touching the sink; after `reset` seconds one call is let through to probe the
+sink (half-open), closing the breaker if it succeeds and reopening it if not.
+
+Calls through a closed breaker time out after a few times the observed 99th
+percentile of the sink's latency, within `[min_timeout, max_timeout]`, so a
+hung sink is detected in about the time a healthy one takes to answer. Calls
+that must not be abandoned halfway, e.g. the inserts into MongoDB which may
+commit after a timeout, get no timeout, and rely on that of their driver.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Mapping,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+import numpy as np
+import picologging as logging
+
+logging.basicConfig()
+log = logging.getLogger()
+
+T = TypeVar("T")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Latency samples needed before the timeout adapts to them, and successful
+# calls between two updates of the timeout.
+SAMPLES = 20
+EVERY = 16
+
+
+class CircuitOpenError(RuntimeError):
+    """A call was rejected since the breaker of its sink is open."""
+
+
+class CircuitBreaker:
+    """The circuit breaker and adaptive timeout of one sink.
+
+    Args:
+        name (str): The sink, e.g. "comet".
+        failures (int): Consecutive failures opening the breaker.
+            Defaults to 5.
+        reset (float): Seconds before an open breaker lets a probe through.
+            Defaults to 30.
+        min_timeout (float): Lower bound of the timeout, in seconds.
+            Defaults to 0.25.
+        max_timeout (Optional[float]): Upper bound of the timeout, in seconds,
+            and the timeout until enough latencies are observed. None for no
+            timeout. Defaults to 10.
+        multiplier (float): Timeout, as a multiple of the 99th percentile of
+            the latency. Defaults to 4.
+        window (int): Number of latencies the percentile is computed over.
+            Defaults to 200.
+        on_change (Optional[Callable[["CircuitBreaker"], None]]): Called when
+            the breaker changes state.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failures: int = 5,
+        reset: float = 30.0,
+        min_timeout: float = 0.25,
+        max_timeout: Optional[float] = 10.0,
+        multiplier: float = 4.0,
+        window: int = 200,
+        on_change: Optional[Callable[["CircuitBreaker"], None]] = None,
+    ):
+        """Initializes the breaker, closed."""
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.multiplier = multiplier
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failed = 0
+        self.opened = 0.0
+        self.probing = False
+        self.succeeded = 0
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self._timeout = max_timeout
+
+    def timeout(self) -> Optional[float]:
+        """Returns the timeout of the next call, in seconds, None if none."""
+        return self._timeout
+
+    def _adapt(self) -> None:
+        """Recomputes the timeout from the observed latencies."""
+        self.succeeded += 1
+        if self.max_timeout is None:
+            return
+        if len(self.latencies) < SAMPLES or self.succeeded % EVERY:
+            return
+        p99 = float(np.percentile(np.fromiter(self.latencies, float), 99))
+        self._timeout = min(
+            self.max_timeout, max(self.min_timeout, self.multiplier * p99)
+        )
+
+    def _set(self, state: str) -> None:
+        """Changes the state of the breaker."""
+        if state == self.state:
+            return
+        log.warning(f"Circuit breaker of {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened = time.monotonic()
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def allow(self) -> bool:
+        """Returns whether a call may go through, and claims the probe.
+
+        Returns:
+            bool: False if the breaker is open, or half-open and probing.
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened >= self.reset:
+            self._set(HALF_OPEN)
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def success(self, latency: float) -> None:
+        """Records a successful call.
+
+        Args:
+            latency (float): Its latency, in seconds.
+        """
+        self.probing = False
+        self.failed = 0
+        self.latencies.append(latency)
+        self._adapt()
+        self._set(CLOSED)
+
+    def failure(self) -> None:
+        """Records a failed call."""
+        self.probing = False
+        self.failed += 1
+        if self.state == HALF_OPEN or self.failed >= self.failures:
+            self._set(OPEN)
+
+    async def call(self, awaitable: Awaitable[T]) -> T:
+        """Awaits a call to the sink through the breaker, with its timeout.
+
+        Args:
+            awaitable (Awaitable[T]): The call.
+
+        Returns:
+            T: Its result.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+            asyncio.TimeoutError: If the call timed out.
+        """
+        if not self.allow():
+            if asyncio.iscoroutine(awaitable):
+                # Never started, so never awaited.
+                awaitable.close()
+            raise CircuitOpenError(f"The circuit breaker of {self.name} is open.")
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout=self.timeout())
+        except asyncio.CancelledError:
+            self.probing = False
+            raise
+        except Exception:
+            self.failure()
+            raise
+        self.success(time.perf_counter() - start)
+        return result
+
+    def report(self) -> Dict[str, Any]:
+        """Returns the state of the breaker, e.g. for the health endpoint."""
+        return {
+            "state": self.state,
+            "failures": self.failed,
+            "timeout": round(self._timeout, 6) if self._timeout else None,
+        }
+
+
+class Breakers:
+    """The circuit breakers of a worker, created on first use.
+
+    Args:
+        sinks (Sequence[str]): The sinks whose breakers are created at once.
+        on_change (Optional[Callable[["Breakers"], None]]): Called when any
+            breaker changes state.
+        overrides (Optional[Mapping[str, Dict[str, Any]]]): Options of the
+            breakers of some sinks, over `options`, e.g. their timeouts.
+        **options (Any): Passed on to every `CircuitBreaker`.
+    """
+
+    def __init__(
+        self,
+        sinks: Sequence[str] = (),
+        on_change: Optional[Callable[["Breakers"], None]] = None,
+        overrides: Optional[Mapping[str, Dict[str, Any]]] = None,
+        **options: Any,
+    ):
+        """Initializes the breakers."""
+        self.on_change = on_change
+        self.overrides = dict(overrides or {})
+        self.options = options
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        for sink in sinks:
+            self[sink]
+
+    def __getitem__(self, name: str) -> CircuitBreaker:
+        """Returns the breaker of a sink."""
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(
+                name,
+                on_change=self.publish,
+                **{**self.options, **self.overrides.get(name, {})},
+            )
+        return self.breakers[name]
+
+    def publish(self, breaker: Optional[CircuitBreaker] = None) -> None:
+        """Reports the state of the breakers, e.g. when one changed.
+
+        Args:
+            breaker (Optional[CircuitBreaker]): The breaker that changed.
+        """
+        if self.on_change is not None:
+            try:
+                self.on_change(self)
+            except Exception as error:
+                log.error(f"While reporting the circuit breakers: {error}")
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the state of every breaker, keyed by sink."""
+        return {name: breaker.report() for name, breaker in self.breakers.items()}
+
+
+async def guarded(app: Any, sink: str, awaitable: Awaitable[T]) -> T:
+    """Awaits a call to a sink through its breaker, if breakers are set up.
+
+    Args:
+        app (Sanic): The application.
+        sink (str): The sink, e.g. "comet".
+        awaitable (Awaitable[T]): The call.
+
+    Returns:
+        T: Its result.
+    """
+    breakers = getattr(app.ctx, "breakers", None)
+    if breakers is None:
+        return await awaitable
+    return await breakers[sink].call(awaitable)
@@ -0,0 +1,395 @@
+"""Vectorized crossmatching of FRB positions against catalogs of sky positions.
+
+Positions are held as unit vectors on the sphere in one contiguous float64
+array. A spatial hash buckets the vectors into cubic cells of a fixed angular
+size, sorted by cell, so the sources near a position are a handful of
+contiguous slices found with a binary search. Angular separations are then
+computed for those candidates only, with numpy.
+
+The sources are indexed separately by the size of their error radius, so a
+match reaches as far as the largest error of each class of sources rather
+than of the whole catalog: one coarse localization widens only the searches
+of the few sources as coarse as it.
+"""
+
+from math import ceil, cos, floor, radians, sin
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+ArrayLike = Union[Sequence[float], np.ndarray]
+
+# Cone searches needing more cells than this compare against every source.
+MAX_CELLS = 512
+
+# Upper bounds, in degrees, of the error radii of the classes the sources are
+# indexed in; the last class (above 128 degrees) holds the rest.
+ERROR_CLASSES = tuple(2.0**exponent for exponent in range(-7, 8))
+
+
+def unit_vectors(right_ascension: ArrayLike, declination: ArrayLike) -> np.ndarray:
+    """Converts sky positions to unit vectors.
+
+    Args:
+        right_ascension (ArrayLike): Right ascensions in degrees.
+        declination (ArrayLike): Declinations in degrees.
+
+    Returns:
+        np.ndarray: The (N, 3) unit vectors.
+    """
+    ra = np.radians(np.asarray(right_ascension, dtype=np.float64))
+    dec = np.radians(np.asarray(declination, dtype=np.float64))
+    cos_dec = np.cos(dec)
+    return np.ascontiguousarray(
+        np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+    )
+
+
+def unit_vector(right_ascension: float, declination: float) -> np.ndarray:
+    """Converts one sky position to a unit vector.
+
+    Args:
+        right_ascension (float): Right ascension in degrees.
+        declination (float): Declination in degrees.
+
+    Returns:
+        np.ndarray: The (3,) unit vector.
+    """
+    ra, dec = radians(right_ascension), radians(declination)
+    return np.array([cos(dec) * cos(ra), cos(dec) * sin(ra), sin(dec)])
+
+
+def chord(angle: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    """Returns the chord length between unit vectors an angle (degrees) apart."""
+    return 2.0 * np.sin(np.radians(angle) / 2.0)
+
+
+def separation(vectors: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """Returns the angular separations of unit vectors from one unit vector.
+
+    Computed from the chord length, which stays accurate at small separations.
+
+    Args:
+        vectors (np.ndarray): The (N, 3) unit vectors.
+        vector (np.ndarray): The (3,) unit vector.
+
+    Returns:
+        np.ndarray: The separations in degrees.
+    """
+    distance = np.sqrt(np.square(vectors - vector).sum(axis=-1))
+    return np.degrees(2.0 * np.arcsin(np.minimum(distance / 2.0, 1.0)))
+
+
+def error_radius(
+    pos_error_deg_95: Optional[ArrayLike] = None,
+    semi_major: Optional[ArrayLike] = None,
+) -> np.ndarray:
+    """Returns the radius of the error region of localizations, in degrees.
+
+    VOEvents carry no position angle, so an error ellipse is bounded by the
+    circle of its semi-major axis.
+
+    Args:
+        pos_error_deg_95 (Optional[ArrayLike]): 95% localization errors.
+        semi_major (Optional[ArrayLike]): Semi-major axes of the error ellipses.
+
+    Returns:
+        np.ndarray: The larger of the two, 0 where both are missing.
+    """
+    errors = [
+        np.nan_to_num(np.asarray(error, dtype=np.float64))
+        for error in (pos_error_deg_95, semi_major)
+        if error is not None
+    ]
+    return np.maximum.reduce(errors) if errors else np.zeros(())
+
+
+class Catalog:
+    """Sky positions, with their error radii, indexed for cone searches.
+
+    Sources added after the index was built are kept in a small buffer that is
+    searched exhaustively, and merged into the index once it grows past
+    `rebuild` sources, or `build` is called. Merging sorts the new sources only.
+
+    Args:
+        right_ascension (ArrayLike): Right ascensions in degrees.
+        declination (ArrayLike): Declinations in degrees.
+        errors (Optional[ArrayLike]): Error radii in degrees. Defaults to 0.
+        ids (Optional[Sequence[Any]]): Identifiers of the sources. Defaults to
+            their positions in the catalog, which are not stored.
+        cell (float): Angular size of the index cells in degrees. Searches
+            within about this radius visit at most 27 cells. Defaults to 1.
+        rebuild (int): Size of the buffer of new sources. Defaults to 4096.
+
+    Attributes:
+        vectors (np.ndarray): The (N, 3) unit vectors, sorted by error class
+            and cell.
+        errors (np.ndarray): The error radii, in the same order.
+        max_errors (np.ndarray): The largest error radius of each error class,
+            in degrees.
+        ids (List[Any]): The identifiers, in the order the sources were added;
+            empty if none were given.
+    """
+
+    def __init__(
+        self,
+        right_ascension: ArrayLike = (),
+        declination: ArrayLike = (),
+        errors: Optional[ArrayLike] = None,
+        ids: Optional[Sequence[Any]] = None,
+        cell: float = 1.0,
+        rebuild: int = 4096,
+    ):
+        """Initializes the catalog."""
+        self.size = chord(cell)
+        self.cells = int(ceil(2.0 / self.size)) + 1
+        self.rebuild = rebuild
+        self.count = 0
+        self.ids: List[Any] = []
+        self.vectors = np.empty((0, 3))
+        self.errors = np.empty(0)
+        self.order = np.empty(0, dtype=np.int64)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.pending: List[Tuple[np.ndarray, np.ndarray]] = []
+        self.max_errors = np.zeros(len(ERROR_CLASSES) + 1)
+        self.indexed = np.zeros(len(ERROR_CLASSES) + 1, dtype=np.int64)
+        self.add(right_ascension, declination, errors, ids)
+        self.build()
+
+    def __len__(self) -> int:
+        """Returns the number of sources."""
+        return self.count
+
+    @property
+    def max_error(self) -> float:
+        """Returns the largest error radius, in degrees."""
+        return float(self.max_errors.max())
+
+    def _keys(self, vectors: np.ndarray, classes: np.ndarray) -> np.ndarray:
+        """Returns the error class and cell of each unit vector, as one key."""
+        index = np.floor((vectors + 1.0) / self.size).astype(np.int64)
+        cell = (index[..., 0] * self.cells + index[..., 1]) * self.cells + index[..., 2]
+        return classes * self.cells**3 + cell
+
+    def add(
+        self,
+        right_ascension: ArrayLike,
+        declination: ArrayLike,
+        errors: Optional[ArrayLike] = None,
+        ids: Optional[Sequence[Any]] = None,
+    ) -> None:
+        """Adds sources to the catalog.
+
+        Args:
+            right_ascension (ArrayLike): Right ascensions in degrees.
+            declination (ArrayLike): Declinations in degrees.
+            errors (Optional[ArrayLike]): Error radii in degrees. Defaults to 0.
+            ids (Optional[Sequence[Any]]): Identifiers of the sources. Defaults
+                to their positions in the catalog, which are not stored.
+        """
+        vectors = unit_vectors(right_ascension, declination).reshape(-1, 3)
+        if not len(vectors):
+            return
+        errors = np.broadcast_to(
+            np.nan_to_num(np.asarray(0.0 if errors is None else errors, np.float64)),
+            len(vectors),
+        )
+        start, self.count = self.count, self.count + len(vectors)
+        if ids is not None or self.ids:
+            # Positions stand in for the identifiers of the sources without.
+            self.ids.extend(range(len(self.ids), start))
+            self.ids.extend(ids if ids is not None else range(start, self.count))
+        self.pending.append((vectors, errors.copy()))
+        np.maximum.at(self.max_errors, self._classes(errors), errors)
+        if sum(len(vectors) for vectors, _ in self.pending) >= self.rebuild:
+            self.build()
+
+    @staticmethod
+    def _classes(errors: np.ndarray) -> np.ndarray:
+        """Returns the error class of each error radius."""
+        return np.searchsorted(ERROR_CLASSES, errors, side="left")
+
+    def build(self) -> None:
+        """Merges the new sources into the index.
+
+        The new sources are sorted, then inserted into the sorted index in one
+        pass, so merging costs a copy of the index rather than sorting it.
+        """
+        if not self.pending:
+            return
+        indexed = len(self.order)
+        vectors = np.concatenate([v for v, _ in self.pending])
+        errors = np.concatenate([e for _, e in self.pending])
+        classes = self._classes(errors)
+        keys = self._keys(vectors, classes)
+        sort = np.argsort(keys, kind="stable")
+        # New sources go after the indexed ones of their cell, as added.
+        at = self.keys.searchsorted(keys[sort], side="right")
+        self.keys = np.insert(self.keys, at, keys[sort])
+        self.vectors = np.insert(self.vectors, at, vectors[sort], axis=0)
+        self.errors = np.insert(self.errors, at, errors[sort])
+        self.order = np.insert(self.order, at, indexed + sort)
+        self.indexed += np.bincount(classes, minlength=len(self.indexed))
+        self.pending = []
+
+    def _candidates(self, vector: np.ndarray, radius: float, bucket: int) -> np.ndarray:
+        """Returns the positions, in the index, of the sources near a vector.
+
+        Args:
+            vector (np.ndarray): The (3,) unit vector.
+            radius (float): Search radius in degrees.
+            bucket (int): The error class of the sources searched.
+
+        Returns:
+            np.ndarray: The positions, in the index.
+        """
+        offset = bucket * self.cells**3
+        reach = chord(min(radius, 180.0))
+        ranges = [
+            range(
+                max(0, floor((component + 1.0 - reach) / self.size)),
+                min(self.cells - 1, floor((component + 1.0 + reach) / self.size)) + 1,
+            )
+            for component in vector.tolist()
+        ]
+        if len(ranges[0]) * len(ranges[1]) * len(ranges[2]) > MAX_CELLS:
+            start, end = self.keys.searchsorted([offset, offset + self.cells**3])
+            return np.arange(start, end)
+        # Consecutive z cells of one (x, y) column are one contiguous slice.
+        columns = offset + np.array(
+            [(x * self.cells + y) * self.cells for x in ranges[0] for y in ranges[1]],
+            dtype=np.int64,
+        )
+        starts = self.keys.searchsorted(columns + ranges[2][0], side="left")
+        ends = self.keys.searchsorted(columns + ranges[2][-1], side="right")
+        lengths = ends - starts
+        # Concatenates the slices: each run of indices restarts at its start.
+        runs = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return runs + np.arange(len(runs))
+
+    def cone(
+        self, right_ascension: float, declination: float, radius: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Finds the sources within a radius of a position.
+
+        Args:
+            right_ascension (float): Right ascension in degrees.
+            declination (float): Declination in degrees.
+            radius (float): Search radius in degrees.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The catalog indices of the sources
+            (positions in `ids`), nearest first, and their separations.
+        """
+        radii = np.full(len(self.max_errors), float(radius))
+        return self._search(unit_vector(right_ascension, declination), radii, None)
+
+    def match(
+        self,
+        right_ascension: float,
+        declination: float,
+        error: float = 0.0,
+        sigma: float = 1.0,
+        max_error: Optional[float] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Finds the sources whose error region overlaps that of a position.
+
+        A source matches when its separation is within `sigma` times the error
+        radii of the position and the source added in quadrature. The sources
+        of each error class are searched as far as the largest error among them.
+
+        Args:
+            right_ascension (float): Right ascension in degrees.
+            declination (float): Declination in degrees.
+            error (float): Error radius of the position in degrees.
+            sigma (float): Scale of the combined error radius. Defaults to 1.
+            max_error (Optional[float]): Largest error radius of the sources
+                considered, in degrees. Defaults to the largest of each class.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The catalog indices of the matches,
+            nearest first, and their separations.
+        """
+        max_errors = self.max_errors
+        if max_error is not None:
+            max_errors = np.minimum(max_errors, max_error)
+        radii = sigma * np.hypot(error, max_errors)
+        return self._search(
+            unit_vector(right_ascension, declination), radii, (error, sigma)
+        )
+
+    def _search(
+        self,
+        vector: np.ndarray,
+        radii: np.ndarray,
+        error: Optional[Tuple[float, float]],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Finds the indexed and buffered sources near a unit vector.
+
+        Args:
+            vector (np.ndarray): The (3,) unit vector.
+            radii (np.ndarray): Search radius of each error class, in degrees.
+            error (Optional[Tuple[float, float]]): The error radius and sigma of
+                a match, None for a cone search within the radii.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The catalog indices, nearest first,
+            and their separations.
+        """
+        candidates = np.concatenate(
+            [
+                self._candidates(vector, float(radii[bucket]), int(bucket))
+                for bucket in np.flatnonzero(self.indexed)
+            ]
+            or [np.empty(0, dtype=np.int64)]
+        )
+        indices = self.order[candidates]
+        vectors = self.vectors[candidates]
+        errors = self.errors[candidates]
+        if self.pending:
+            offset = len(self.order)
+            indices = np.concatenate(
+                [indices, np.arange(offset, self.count, dtype=np.int64)]
+            )
+            vectors = np.concatenate([vectors, *(v for v, _ in self.pending)])
+            errors = np.concatenate([errors, *(e for _, e in self.pending)])
+        separations = separation(vectors, vector)
+        if error is None:
+            within = separations <= radii[0]
+        else:
+            within = separations <= error[1] * np.hypot(error[0], errors)
+        indices, separations = indices[within], separations[within]
+        nearest = np.argsort(separations, kind="stable")
+        return indices[nearest], separations[nearest]
+
+
+def crossmatch(
+    catalog: Catalog,
+    right_ascension: ArrayLike,
+    declination: ArrayLike,
+    errors: Optional[ArrayLike] = None,
+    sigma: float = 1.0,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Matches many positions against a catalog.
+
+    Args:
+        catalog (Catalog): The catalog.
+        right_ascension (ArrayLike): Right ascensions in degrees.
+        declination (ArrayLike): Declinations in degrees.
+        errors (Optional[ArrayLike]): Error radii in degrees. Defaults to 0.
+        sigma (float): Scale of the combined error radius. Defaults to 1.
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: The matches of every position, as
+        returned by `Catalog.match`.
+    """
+    right_ascension = np.atleast_1d(np.asarray(right_ascension, dtype=np.float64))
+    declination = np.atleast_1d(np.asarray(declination, dtype=np.float64))
+    errors = np.broadcast_to(
+        np.asarray(0.0 if errors is None else errors, np.float64),
+        right_ascension.shape,
+    )
+    return [
+        catalog.match(ra, dec, error, sigma)
+        for ra, dec, error in zip(right_ascension, declination, errors)
+    ]
@@ -0,0 +1,147 @@
+"""Deduplication of the VOEvents resubmitted by the observatories.
+
+Observatories retry their POSTs on timeouts, so the same VOEvent may arrive
+several times. Every VOEvent gets a deduplication key, archived with it under
+a unique index, and each worker remembers the keys it saw recently with the ID
+they were archived under. A retry that reaches the same worker is answered
+from memory without touching the database or the sinks; one that reaches
+another worker is rejected by the index, and its broadcasts are no-ops since
+they share the idempotency keys of the original ones in the outbox.
+"""
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+
+# Field of the archived VOEvents holding their deduplication key.
+FIELD = "dedup_key"
+
+# Fields identifying a VOEvent that has an internal ID.
+IDENTITY = ("observatory_name", "internal_id", "kind", "date")
+
+# Kinds of VOEvents identified by them. The follow-ups of an event share its
+# date, and a new update or refined position must still be broadcast.
+IDENTIFIED = ("detection", "retraction")
+
+# Code of the duplicate key errors of MongoDB.
+DUPLICATE_KEY = 11000
+
+
+def dedup_key(voevent: Dict[str, Any]) -> str:
+    """Returns the deduplication key of a VOEvent.
+
+    Detections and retractions with an internal ID are identified by their
+    observatory, internal ID, kind and date; the other VOEvents, including
+    the updates and subsequent VOEvents of an event, by their whole content.
+
+    Args:
+        voevent (Dict[str, Any]): The VOEvent, as received.
+
+    Returns:
+        str: The key, identical for resubmissions of the VOEvent.
+    """
+    if voevent.get("internal_id") and voevent.get("kind") in IDENTIFIED:
+        identity: Any = [voevent.get(field) for field in IDENTITY]
+    else:
+        identity = {
+            field: value
+            for field, value in voevent.items()
+            if field != "email_password" and value is not None
+        }
+    encoded = orjson.dumps(identity, option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+class RecentVOEvents:
+    """The keys of the VOEvents a worker saw recently, least recent first.
+
+    Each key maps to a future of the ID the VOEvent was archived under, so a
+    retry arriving while the original is still being archived waits for it.
+
+    Args:
+        size (int): The number of keys remembered. Defaults to 100000.
+    """
+
+    def __init__(self, size: int = 100_000):
+        """Initializes the cache."""
+        self.size = size
+        self.ids: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[asyncio.Future]:
+        """Returns the future ID of a recent VOEvent, None if unseen.
+
+        Args:
+            key (str): The deduplication key.
+
+        Returns:
+            Optional[asyncio.Future]: The future of its ID.
+        """
+        future = self.ids.get(key)
+        if future is not None:
+            self.ids.move_to_end(key)
+        return future
+
+    def start(self, key: str) -> asyncio.Future:
+        """Remembers a VOEvent being archived.
+
+        Args:
+            key (str): The deduplication key.
+
+        Returns:
+            asyncio.Future: The future of its ID, set by `done`.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.ids[key] = future
+        self.ids.move_to_end(key)
+        while len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+        return future
+
+    def done(self, key: str, inserted_id: Optional[str]) -> None:
+        """Records the ID a VOEvent was archived under.
+
+        Args:
+            key (str): The deduplication key.
+            inserted_id (Optional[str]): The ID, None if archiving it failed,
+                in which case the VOEvent is forgotten so a retry goes through.
+        """
+        future = self.ids.get(key)
+        if inserted_id is None:
+            self.ids.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(inserted_id)
+
+
+async def originals(collection, keys: Iterable[str]) -> Dict[str, str]:
+    """Looks up the IDs of archived VOEvents by their deduplication keys.
+
+    Args:
+        collection (AsyncIOMotorCollection): The VOEvent collection.
+        keys (Iterable[str]): The deduplication keys.
+
+    Returns:
+        Dict[str, str]: The ID of every key found.
+    """
+    return {
+        document[FIELD]: str(document["_id"])
+        async for document in collection.find({FIELD: {"$in": list(keys)}}, {FIELD: 1})
+    }
+
+
+def duplicates(details: Dict[str, Any]) -> List[int]:
+    """Returns the positions of the documents a bulk insert found duplicated.
+
+    Args:
+        details (Dict[str, Any]): The details of a BulkWriteError.
+
+    Returns:
+        List[int]: The positions in the batch.
+    """
+    return [
+        error["index"]
+        for error in details.get("writeErrors", [])
+        if error.get("code") == DUPLICATE_KEY
+    ]
@@ -0,0 +1,78 @@
+"""Concurrent dispatch of a VOEvent to its sinks (Comet, email, database)."""
+
+import asyncio
+from typing import Any, Awaitable, Dict, Optional, Set
+
+import picologging as logging
+
+logging.basicConfig()
+log = logging.getLogger()
+
+# Sinks still running once the latency budget expired. A strong reference is
+# kept here so that the event loop does not garbage collect them mid-flight.
+_background: Set[asyncio.Future] = set()
+
+
+def in_flight() -> int:
+    """Returns the number of sinks still running in the background."""
+    return len(_background)
+
+
+def _finish(name: str, task: asyncio.Future) -> None:
+    """Log the outcome of a sink once it completes.
+
+    Args:
+        name (str): Name of the sink.
+        task (asyncio.Future): The completed sink task.
+    """
+    _background.discard(task)
+    if task.cancelled():
+        log.warning(f"Sink {name} was cancelled.")
+    elif task.exception() is not None:
+        log.error(f"While dispatching the VOEvent to {name}: {task.exception()}")
+
+
+async def dispatch(
+    sinks: Dict[str, Awaitable[Any]], budget: Optional[float] = None
+) -> Dict[str, asyncio.Future]:
+    """Runs every sink concurrently and waits at most `budget` seconds.
+
+    Sinks that have not finished when the budget expires keep running in the
+    background, so a slow broker never holds up the HTTP response.
+
+    Args:
+        sinks (Dict[str, Awaitable[Any]]): Awaitables keyed by sink name.
+        budget (Optional[float]): Latency budget in seconds.
+            Defaults to None (wait for every sink).
+
+    Returns:
+        Dict[str, asyncio.Future]: The sink tasks, keyed by sink name.
+    """
+    tasks = {name: asyncio.ensure_future(sink) for name, sink in sinks.items()}
+    for name, task in tasks.items():
+        task.add_done_callback(lambda done, name=name: _finish(name, done))
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=budget)
+    for task in tasks.values():
+        if not task.done():
+            _background.add(task)
+    return tasks
+
+
+def status(task: asyncio.Future, queued: bool = False) -> str:
+    """Returns the status string reported by the endpoints for a sink.
+
+    Args:
+        task (asyncio.Future): The sink task.
+        queued (bool): Whether the sink only enqueued the VOEvent in the outbox.
+            Defaults to False.
+
+    Returns:
+        str: "Success" (or "Queued"), "Failure" or "Pending" (still running in
+        the background).
+    """
+    if not task.done():
+        return "Pending"
+    if task.cancelled() or task.exception() is not None:
+        return "Failure"
+    return "Queued" if queued else "Success"
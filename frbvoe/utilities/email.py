@@ -1,24 +1,175 @@
 """This function is a utility to send a VOEvent email."""
 
 # This function requires some user customization, depending on the user preferences.
-# import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.policy import compat32
+from time import perf_counter
+from typing import Any, Dict, List, Sequence, Tuple
 
 import picologging as logging
+from aiosmtplib import SMTPException
 
-# from typing import Any, Dict
+from frbvoe.utilities.smtp import SMTPPool
+from frbvoe.utilities.xml import ivorn
 
 logging.basicConfig()
 log = logging.getLogger()
 
+UNDISCLOSED = "undisclosed-recipients:;"
 
-def send_email(email_report):
+# Field of a queued payload holding the subscribers left to email.
+RECIPIENTS = "recipients"
+# Policy of the encoded messages, with the CRLF line endings of SMTP.
+POLICY = compat32.clone(linesep="\r\n")
+
+
+# Closing lines of every VOEvent email.
+FOOTER = """
+**********
+This email was generated automatically by the {observatory_name} frb-voe Service.
+Please direct comments, questions, and concerns to {email}.
+
+--
+You are receiving this email because you are currently a subscriber to
+the public {observatory_name} frb-voe Service.
+To unsubscribe, please contact {email}.
+"""
+
+HEADER = """{kind}-type VOEvent
+
+WHO
+\tProduced: {date}
+\tVOEvent IVORN: {ivorn}
+"""
+
+OBSERVATORY = """
+WHAT
+\tobservatory parameters:
+\t\tsampling_time: {sampling_time} s
+\t\tbandwidth: {bandwidth} MHz
+\t\tcentre_frequency: {central_frequency} MHz
+\t\tnpol: {npol}
+\t\tbits_per_sample: {bits_per_sample}
+\t\ttsys: {tsys} K
+"""
+
+RETRACTION = """
+WHAT
+
+WHERE and WHEN
+\tTimestamp [UTC]: {date}
+\tLocalization: ({right_ascension}, {declination})
+\t+/- {pos_error_deg_95} degrees (J2000)
+
+HOW
+\tDescription: Human-issued retraction. For more information,
+\tsee: {website}
+
+WHY
+
+CITATIONS
+\t{internal_id}
+"""
+
+SUBJECT = "{observatory_name}_VOE_{kind}"
+
+# Body template of every kind of VOEvent email, built once at import.
+TEMPLATES: Dict[str, str] = {
+    "detection": HEADER + OBSERVATORY + FOOTER,
+    "subsequent": HEADER + OBSERVATORY + FOOTER,
+    "retraction": HEADER + RETRACTION + FOOTER,
+    "update": "{update_message}",
+}
+
+
+def render_email(email_report: Dict[str, Any]) -> Tuple[str, str]:
+    """Renders the subject and body of a VOEvent email.
+
+    Args:
+        email_report (Dict[str, Any]): The VOEvent payload.
+
+    Returns:
+        Tuple[str, str]: The subject and the plain text body.
+    """
+    values = {
+        **email_report,
+        "ivorn": ivorn(
+            email_report["observatory_name"] or "",
+            email_report["kind"],
+            email_report.get("internal_id") or email_report["date"],
+        ),
+    }
+    return SUBJECT.format_map(values), TEMPLATES[values["kind"]].format_map(values)
+
+
+class Email:
+    """A VOEvent email, rendered and encoded once for all of its recipients.
+
+    The message is flattened once into its headers and its MIME body. The copy
+    sent to a subscriber only adds a To header, so emailing N subscribers costs
+    one render and N byte concatenations.
+
+    Args:
+        email_report (Dict[str, Any]): The VOEvent payload.
+
+    Attributes:
+        sender (str): Address of the VOEvent author.
+        headers (bytes): Encoded headers shared by every copy, but To.
+        body (bytes): Encoded MIME body shared by every copy.
+    """
+
+    def __init__(self, email_report: Dict[str, Any]):
+        """Initializes the email."""
+        subject, email_message = render_email(email_report)
+        message = MIMEMultipart()
+        message["From"] = email_report["email"]
+        message["Subject"] = subject
+        message.attach(MIMEText(email_message, "plain"))
+        headers, self.body = message.as_bytes(policy=POLICY).split(b"\r\n\r\n", 1)
+        self.headers = headers + b"\r\n"
+        self.sender = email_report["email"]
+
+    def to(self, recipients: Sequence[str]) -> bytes:
+        """Returns the copy of the email sent to some recipients.
+
+        Args:
+            recipients (Sequence[str]): Envelope recipients of the copy. A copy
+                for one recipient is addressed to them; a copy for many is sent
+                as blind carbon copies.
+
+        Returns:
+            bytes: The encoded message.
+        """
+        recipient = recipients[0] if len(recipients) == 1 else UNDISCLOSED
+        if recipient.isascii() and "\r" not in recipient and "\n" not in recipient:
+            to = b"To: " + recipient.encode() + b"\r\n"
+        else:
+            to = POLICY.fold_binary("To", recipient)
+        return self.headers + to + b"\r\n" + self.body
+
+
+class UndeliveredEmail(SMTPException):
+    """Some subscribers could not be emailed, but may be on another attempt.
+
+    Args:
+        message (str): The error message.
+        recipients (List[str]): The subscribers left to email.
+    """
+
+    def __init__(self, message: str, recipients: List[str]):
+        """Initializes the error."""
+        super().__init__(message)
+        self.recipients = recipients
+
+
+def send_email(email_report, receiver_emails: Sequence[str] = ()):
     """Sends an email with the provided email_report.
 
     Args:
         email_report (Dict[str, Any]):
         A dictionary containing the email report information.
+        receiver_emails (Sequence[str]): Addresses of the subscribers.
 
     Returns:
         str: The status of the email sending process.
@@ -27,101 +178,54 @@ def send_email(email_report):
     Raises:
         None
     """
-    subject = f"{email_report['observatory_name']}_VOE_{email_report['kind']}"
-    if email_report["kind"] in ["detection", "subsequent"]:
-        email_message = f"""
-            {email_report['kind']}-type VOEvent\n
-            \n
-            WHO\n
-            Produced: {email_report["date"]}\n
-            \tVOEvent IVORN: #TODO\n
-            \n
-            WHAT\n
-            \tobservatory parameters:\n
-            \t\tsampling_time: {email_report['sampling_time']} s\n
-            \n
-            \t\tbandwidth: {email_report['bandwidth']} MHz\n
-            \n
-            \t\tcentre_frequency: {email_report['central_frequency']} MHz\n
-            \n
-            \t\tnpol: {email_report['npol']}\n
-            \n
-            \t\tbits_per_sample: {email_report['bits_per_sample']}\n
-            \n
-            \t\ttsys: {email_report['tsys']} K\n
-            \n
-            **********
-            This email was generated automatically by the
-            {email_report['observatory_name']} frb-voe Service.
-            Please direct comments, questions, and concerns to {email_report['email']}.
-
-            --
-            You are receiving this email because you are currently a subscriber to
-            the public {email_report['observatory_name']} frb-voe Service.
-            To unsubscribe, please contact {email_report['email']}.
-        """
-    if email_report["kind"] == "retraction":
-        email_message = f"""
-            {email_report['kind']}-type VOEvent\n
-            \n
-            WHO\n
-            Produced: {email_report['date']}\n
-            \tVOEvent IVORN: #TODO\n
-            \n
-            WHAT\n
-            WHERE and WHEN\n
-            \tTimestamp [UTC]: {email_report['date']}\n
-            \tLocalization: ({email_report['ra']}, {email_report['dec']})
-            +/- {email_report['pos_error_deg_95']} degrees (J2000)\n
-            \n\n
-            HOW\n
-            \tDescription: Human-issued retraction. For more information,
-            see: {email_report['website']}\n
-            \n\n
-            WHY\n
-            CITATIONS\n
-            \t{email_report['internal_id']}\n
-
-            **********
-            This email was generated automatically by the
-            {email_report['observatory_name']} frb-voe Service.
-            Please direct comments, questions, and concerns to {email_report['email']}.
-
-            --
-            You are receiving this email because you are currently a subscriber to
-            the public {email_report['observatory_name']} frb-voe Service.
-            To unsubscribe, please contact {email_report['email']}.
-        """
-    if email_report["kind"] == "update":
-        email_message = email_report["update_message"]
-
-    # Email configuration
-    receiver_email = "john.smith@email.com"  # TODO: load from DB
-    # smtp_server = email_report.smtp_server  # Change to the appropriate server
-    # smtp_port = email_report.smtp_port  # Change to the appropriate port
-
-    # Create a message
-    message = MIMEMultipart()
-    message["From"] = email_report["email"]
-    message["To"] = receiver_email
-    message["Subject"] = subject
-    message.attach(MIMEText(email_message, "plain"))
-
-    # # Connect to the SMTP server
-    # server = smtplib.SMTP(smtp_server, smtp_port)
-    # server.starttls()  # Secure the connection
-    # server.login(email_report.email, email_report.email_password)
-    # server.login("username", "password")  # TODO: load from secrets
-    # Send the email
-    # server.send_message(message)
-
-    # # Quit the server
-    # server.quit()
+    Email(email_report)
+    # Without an SMTP server, the email is only composed.
+    log.warning(
+        f"No SMTP server configured, not emailing {len(receiver_emails)} subscribers"
+    )
     status = "Success"
 
     return status
 
 
+async def deliver_email(
+    email_report: Dict[str, Any], receiver_emails: Sequence[str], smtp: SMTPPool
+) -> Dict[str, Any]:
+    """Emails a VOEvent to the subscribers through the SMTP pool.
+
+    Args:
+        email_report (Dict[str, Any]): The VOEvent payload.
+        receiver_emails (Sequence[str]): Addresses of the subscribers.
+        smtp (SMTPPool): The worker's SMTP pool.
+
+    Returns:
+        Dict[str, Any]: The delivery report of `SMTPPool.deliver`, with the
+        seconds spent rendering the email added to its `timings`.
+
+    Raises:
+        UndeliveredEmail: If a message could not be delivered, or a subscriber
+            was refused temporarily.
+    """
+    start = perf_counter()
+    email = Email(email_report)
+    render = perf_counter() - start
+    report = await smtp.deliver(email.sender, list(receiver_emails), email.to)
+    report["timings"]["render"] = render
+    report["timings"]["total"] += render
+    log.info(
+        f"Emailed {report['recipients']} subscribers in {report['messages']} "
+        f"messages ({len(report['refused'])} refused): "
+        + ", ".join(f"{stage} {time:.3f}s" for stage, time in report["timings"].items())
+    )
+    if report["undelivered"]:
+        raise UndeliveredEmail(
+            f"The VOEvent email could not be delivered to "
+            f"{len(report['undelivered'])} of {report['recipients']} subscribers.",
+            report["undelivered"],
+        )
+    return report
+
+
 # \t\tbackend: {email_report.backend}\n
 # \n
 # \tevent parameters:\n
@@ -0,0 +1,218 @@
+"""Streaming exports of the MongoDB collections.
+
+Documents are read through a server-side cursor, `batch_size` at a time, and
+every batch is encoded into one chunk of output before the next is read, so an
+export holds at most one batch in memory however large the collection is.
+
+Formats:
+    ndjson: One JSON document per line.
+    csv: One row per document, under a header of the model's fields.
+    columns: One JSON object per batch, mapping every field to the column of
+        its values, like the row groups of a columnar file.
+"""
+
+import csv
+import io
+from typing import (
+    Any,
+    AsyncIterator,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+import orjson
+
+from frbvoe.models.subscriber import Subscriber
+from frbvoe.models.tns import TNS
+from frbvoe.models.voe import VOEvent
+
+# Fields never exported, left out by the database.
+SECRETS = ("email_password", "tns_api_key", "location")
+PROJECTION = dict.fromkeys(SECRETS, 0)
+
+# Fields of the documents of each collection, in export order.
+FIELDS = {
+    collection: [
+        "_id",
+        *(field for field in model.model_fields if field not in SECRETS),
+    ]
+    for collection, model in (
+        ("voe", VOEvent),
+        ("tns", TNS),
+        ("subscriber", Subscriber),
+    )
+}
+
+# Content type and file extension of each format.
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "columns": ("application/x-ndjson", "columns.ndjson"),
+}
+
+# Documents read per round trip, and encoded per chunk.
+BATCH_SIZE = 1000
+
+
+def _default(value: Any) -> str:
+    """Serializes the BSON types orjson does not know, e.g. ObjectId."""
+    return str(value)
+
+
+def _cell(value: Any) -> Any:
+    """Returns the CSV cell of a value."""
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value, default=_default).decode()
+    return value
+
+
+class Encoder:
+    """Encodes batches of documents of a collection into an export format.
+
+    Args:
+        collection (str): Name of the collection, a key of `FIELDS`.
+        format (str): The export format, a key of `FORMATS`.
+
+    Raises:
+        ValueError: If the collection or the format is unknown.
+    """
+
+    def __init__(self, collection: str, format: str = "ndjson"):
+        """Initializes the encoder."""
+        if collection not in FIELDS:
+            raise ValueError(f"Unknown collection: {collection}")
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format: {format}")
+        self.fields = FIELDS[collection]
+        self.format = format
+        self.content_type, self.extension = FORMATS[format]
+
+    def header(self) -> bytes:
+        """Returns the output preceding the first batch."""
+        if self.format == "csv":
+            return self._csv([self.fields])
+        return b""
+
+    def encode(self, documents: List[Dict[str, Any]]) -> bytes:
+        """Encodes a batch of documents.
+
+        Args:
+            documents (List[Dict[str, Any]]): The documents.
+
+        Returns:
+            bytes: The chunk of output.
+        """
+        if not documents:
+            return b""
+        if self.format == "csv":
+            return self._csv(
+                [_cell(document.get(field)) for field in self.fields]
+                for document in documents
+            )
+        if self.format == "columns":
+            columns = {
+                field: [document.get(field) for document in documents]
+                for field in self.fields
+            }
+            return orjson.dumps(columns, default=_default) + b"\n"
+        return b"".join(
+            orjson.dumps(document, default=_default, option=orjson.OPT_APPEND_NEWLINE)
+            for document in documents
+        )
+
+    @staticmethod
+    def _csv(rows: Iterable[List[Any]]) -> bytes:
+        """Encodes rows as CSV."""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+
+def batches(
+    documents: Iterable[Dict[str, Any]], batch_size: int = BATCH_SIZE
+) -> Iterator[List[Dict[str, Any]]]:
+    """Groups documents into batches.
+
+    Args:
+        documents (Iterable[Dict[str, Any]]): The documents, e.g. a cursor.
+        batch_size (int): Documents per batch. Defaults to 1000.
+
+    Yields:
+        List[Dict[str, Any]]: The batches.
+    """
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def stream(
+    collection,
+    encoder: Encoder,
+    query: Optional[Dict[str, Any]] = None,
+    batch_size: int = BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """Streams a collection in an export format.
+
+    Args:
+        collection (AsyncIOMotorCollection): The collection.
+        encoder (Encoder): The encoder of the collection and format.
+        query (Optional[Dict[str, Any]]): Filter of the documents exported.
+            Defaults to all of them.
+        batch_size (int): Documents per round trip and chunk. Defaults to 1000.
+
+    Yields:
+        bytes: The chunks of output.
+    """
+    header = encoder.header()
+    if header:
+        yield header
+    batch = []
+    async for document in collection.find(
+        query or {}, PROJECTION, batch_size=batch_size
+    ):
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield encoder.encode(batch)
+            batch = []
+    if batch:
+        yield encoder.encode(batch)
+
+
+def export(
+    collection,
+    encoder: Encoder,
+    output: BinaryIO,
+    query: Optional[Dict[str, Any]] = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Writes a collection to a file in an export format, e.g. from the CLI.
+
+    Args:
+        collection (pymongo.collection.Collection): The collection.
+        encoder (Encoder): The encoder of the collection and format.
+        output (BinaryIO): The file written to.
+        query (Optional[Dict[str, Any]]): Filter of the documents exported.
+            Defaults to all of them.
+        batch_size (int): Documents per round trip and chunk. Defaults to 1000.
+
+    Returns:
+        int: The number of documents exported.
+    """
+    output.write(encoder.header())
+    exported = 0
+    cursor = collection.find(query or {}, PROJECTION, batch_size=batch_size)
+    for batch in batches(cursor, batch_size):
+        output.write(encoder.encode(batch))
+        exported += len(batch)
+    return exported
@@ -0,0 +1,114 @@
+"""Shared, pooled async HTTP client for the outbound Comet and TNS requests."""
+
+from typing import Any, Dict
+
+import httpx
+import picologging as logging
+
+logging.basicConfig()
+log = logging.getLogger()
+
+# httpcore trace events marking that a request got hold of a connection.
+_CONNECTED = (
+    "http11.send_request_headers.started",
+    "http2.send_request_headers.started",
+)
+
+
+class HTTPClient:
+    """Keep-alive HTTP client with a bounded connection pool.
+
+    One client is created per Sanic worker, so every alert reuses warm TCP and
+    TLS connections instead of paying a fresh handshake. HTTP/2 is negotiated
+    through ALPN where the remote supports it.
+
+    Args:
+        timeout (float): Read, write and pool timeout in seconds.
+        connect_timeout (float): Connection timeout in seconds.
+        max_connections (int): Maximum number of open connections.
+        max_keepalive_connections (int): Maximum number of idle connections kept.
+        keepalive_expiry (float): Seconds an idle connection is kept open.
+        http2 (bool): Whether to negotiate HTTP/2.
+
+    Attributes:
+        session (httpx.AsyncClient): The underlying client.
+        metrics (Dict[str, int]): Pool metrics; `opened` and `reused` connections,
+            `waiting` requests queued for a connection, and `requests` in total.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+    ):
+        """Initializes the client."""
+        self.metrics: Dict[str, int] = {
+            "requests": 0,
+            "opened": 0,
+            "reused": 0,
+            "waiting": 0,
+        }
+        self.session = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Sends a request through the pool.
+
+        Args:
+            method (str): HTTP method.
+            url (str): URL of the request.
+            **kwargs (Any): Passed on to `httpx.AsyncClient.request`.
+
+        Returns:
+            httpx.Response: The response.
+        """
+        opened = False
+        waiting = True
+        self.metrics["requests"] += 1
+        self.metrics["waiting"] += 1
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            nonlocal opened, waiting
+            if event == "connection.connect_tcp.started":
+                opened = True
+            if waiting and (opened or event in _CONNECTED):
+                waiting = False
+                self.metrics["waiting"] -= 1
+
+        try:
+            response = await self.session.request(
+                method, url, extensions={"trace": trace}, **kwargs
+            )
+        finally:
+            if waiting:
+                self.metrics["waiting"] -= 1
+            self.metrics["opened" if opened else "reused"] += 1
+        return response
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        """Sends a POST request through the pool.
+
+        Args:
+            url (str): URL of the request.
+            **kwargs (Any): Passed on to `httpx.AsyncClient.request`.
+
+        Returns:
+            httpx.Response: The response.
+        """
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self) -> None:
+        """Closes every pooled connection."""
+        log.info(f"Closing the HTTP pool: {self.metrics}")
+        await self.session.aclose()
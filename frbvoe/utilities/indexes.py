@@ -0,0 +1,163 @@
+"""MongoDB indexes of the frbvoe database, created or verified at startup."""
+
+from typing import Any, Dict, Iterator, List, Tuple
+
+import picologging as logging
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
+from pymongo.errors import OperationFailure
+
+from frbvoe.utilities import outbox, tns
+
+logging.basicConfig()
+log = logging.getLogger()
+
+# Indexes of every collection.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "voe": [
+        IndexModel([("internal_id", ASCENDING)], name="internal_id"),
+        IndexModel([("tns_name", ASCENDING)], name="tns_name"),
+        IndexModel([("date", DESCENDING)], name="date"),
+        IndexModel([("kind", ASCENDING), ("date", DESCENDING)], name="kind_date"),
+        IndexModel([("location", GEOSPHERE), ("date", DESCENDING)], name="location"),
+        IndexModel([("dm", ASCENDING)], name="dm"),
+        IndexModel([("trace.trace_id", ASCENDING)], name="trace_id", sparse=True),
+        # Rejects the resubmissions of an archived VOEvent.
+        IndexModel(
+            [("dedup_key", ASCENDING)], name="dedup_key", unique=True, sparse=True
+        ),
+    ],
+    "subscriber": [
+        IndexModel([("contact_email", ASCENDING)], name="contact_email", unique=True),
+        IndexModel([("requested_service", ASCENDING)], name="requested_service"),
+    ],
+    "tns": [IndexModel([("tns_name", ASCENDING)], name="tns_name")],
+    "tns_report": [IndexModel([("status", ASCENDING)], name="status")],
+    # Finds the due items, and those a worker claimed.
+    "outbox": [
+        IndexModel(
+            [("status", ASCENDING), ("next_attempt", ASCENDING)],
+            name="status_next_attempt",
+        ),
+        IndexModel([("lease", ASCENDING)], name="lease", sparse=True),
+    ],
+    # Deletes the cached TNS names once they expire.
+    "tns_cache": [
+        IndexModel([("expires", ASCENDING)], name="expires", expireAfterSeconds=0)
+    ],
+}
+
+# Query shapes served by the indexes, checked for collection scans. Those of
+# the outbox and the TNS are built by the same functions as their queries; the
+# reads meant to scan, e.g. loading every subscriber or an export, are left out.
+QUERIES: Dict[str, List[Dict[str, Any]]] = {
+    "voe": [
+        {"internal_id": ""},
+        {"tns_name": ""},
+        {"kind": "detection", "date": {"$gte": ""}},
+        {
+            "location": {
+                "$geoWithin": {"$centerSphere": [[0.0, 0.0], 0.01]},
+            },
+        },
+        {"dm": {"$gte": 0.0, "$lte": 1.0}},
+        {"trace.trace_id": ""},
+        {"dedup_key": ""},
+    ],
+    "subscriber": [{"contact_email": ""}, {"requested_service": "emails"}],
+    "tns": [{"tns_name": ""}],
+    "tns_report": [{"status": "submitted"}, tns.lapsed(0.0)],
+    "tns_cache": [tns.unexpired("")],
+    "outbox": outbox.QUERIES,
+}
+
+
+def _spec(index: Dict[str, Any]) -> Tuple[List[Tuple[str, Any]], bool]:
+    """Returns the keys and uniqueness of an index document."""
+    keys = index["key"]
+    keys = keys.items() if hasattr(keys, "items") else keys
+    return [
+        (key, order if isinstance(order, str) else int(order)) for key, order in keys
+    ], bool(index.get("unique"))
+
+
+async def ensure_indexes(
+    database, indexes: Dict[str, List[IndexModel]] = INDEXES
+) -> Dict[str, Dict[str, str]]:
+    """Creates the missing indexes and verifies the existing ones.
+
+    Creating an index that already exists is a no-op, so this is safe to run
+    every time a worker starts.
+
+    Args:
+        database (AsyncIOMotorDatabase): The frbvoe database.
+        indexes (Dict[str, List[IndexModel]]): Indexes by collection.
+            Defaults to INDEXES.
+
+    Returns:
+        Dict[str, Dict[str, str]]: Status of every index by collection and
+        name; "Created", "Verified", or the error that prevented creating it.
+    """
+    report: Dict[str, Dict[str, str]] = {}
+    for name, models in indexes.items():
+        collection = database[name]
+        existing = [
+            _spec(index) for index in (await collection.index_information()).values()
+        ]
+        report[name] = {}
+        for model in models:
+            document = model.document
+            # An index with the same keys may have been created under another name.
+            if _spec(document) in existing:
+                report[name][document["name"]] = "Verified"
+                continue
+            try:
+                await collection.create_indexes([model])
+                report[name][document["name"]] = "Created"
+            except OperationFailure as error:
+                # e.g. duplicate contact emails, or another index of that name.
+                log.error(f"Could not create index {name}.{document['name']}: {error}")
+                report[name][document["name"]] = str(error)
+    log.info(f"MongoDB indexes: {report}")
+    return report
+
+
+def stages(plan: Dict[str, Any]) -> Iterator[str]:
+    """Yields every stage of a query plan.
+
+    Args:
+        plan (Dict[str, Any]): A plan from the output of `explain`.
+
+    Yields:
+        str: The stage names, from the root down.
+    """
+    yield plan.get("stage", "")
+    for child in ("inputStage", "queryPlan"):
+        if child in plan:
+            yield from stages(plan[child])
+    for child in plan.get("inputStages", []):
+        yield from stages(child)
+
+
+async def collection_scans(
+    database, queries: Dict[str, List[Dict[str, Any]]] = QUERIES
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Explains the query shapes and reports those scanning a whole collection.
+
+    Args:
+        database (AsyncIOMotorDatabase): The frbvoe database.
+        queries (Dict[str, List[Dict[str, Any]]]): Query filters by collection.
+            Defaults to QUERIES.
+
+    Returns:
+        List[Tuple[str, Dict[str, Any]]]: The collection and filter of every
+        query whose winning plan is a COLLSCAN.
+    """
+    scans = []
+    for name, filters in queries.items():
+        for query in filters:
+            explained = await database[name].find(query).explain()
+            plan = explained["queryPlanner"]["winningPlan"]
+            if "COLLSCAN" in stages(plan):
+                log.warning(f"Query {query} on {name} scans the whole collection")
+                scans.append((name, query))
+    return scans
@@ -0,0 +1,391 @@
+"""Latency histograms, outcome counters and gauges, shared across workers.
+
+Every worker claims a slot, one row of a shared-memory array created by the
+main process, and is the only writer of its row, so recording a sample is a
+couple of float additions without any lock. `/metrics` reads every row: the
+counters and histograms are summed across workers, and the gauges (e.g. the
+event-loop lag) are reported per worker, since a sum of them means nothing.
+The counters of the pools of the worker (HTTP, SMTP and the TNS name cache)
+are sampled from their `metrics` along with the gauges.
+The rows of workers that exited stay, so the counters never go backwards.
+
+Without the main process, e.g. in tests, a worker keeps a private array.
+"""
+
+import asyncio
+import os
+import resource
+import time
+from bisect import bisect_left
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import numpy as np
+import picologging as logging
+from sanic import Sanic
+
+logging.basicConfig()
+log = logging.getLogger()
+
+T = TypeVar("T")
+
+# Stages timed, their outcomes, and the VOEvent kinds they are counted by.
+STAGES = (
+    "request",
+    "validation",
+    "association",
+    "outbox",
+    "comet",
+    "email",
+    "database",
+    "tns",
+)
+STATUSES = ("Success", "Failure", "Pending", "Queued", "Skipped", "Duplicate")
+KINDS = ("detection", "subsequent", "retraction", "update", "unknown")
+
+# Upper bounds, in seconds, of the latency histogram buckets; the last bucket
+# (+Inf) holds the rest.
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Gauges, reported per worker.
+GAUGES = {
+    "event_loop_lag_seconds": "Event loop lag of the worker.",
+    "outbox_depth": "Items waiting in the outbox, as seen by the worker.",
+    "background_sinks": "Sinks still running after the latency budget.",
+    "http_waiting_requests": "Requests waiting for an HTTP connection.",
+    "resident_memory_bytes": "Resident memory of the worker.",
+    "peak_resident_memory_bytes": "Peak resident memory of the worker.",
+}
+
+# Counters of the pools, summed across workers: the pool and the key of its
+# `metrics` they are sampled from, and their description.
+POOLS = {
+    "http_requests": ("http", "requests", "Requests sent through the HTTP pool."),
+    "http_connections_opened": ("http", "opened", "HTTP connections opened."),
+    "http_connections_reused": (
+        "http",
+        "reused",
+        "HTTP requests sent on a kept-alive connection.",
+    ),
+    "smtp_messages": ("smtp", "messages", "Messages sent through the SMTP pool."),
+    "smtp_connections_opened": ("smtp", "opened", "SMTP connections opened."),
+    "smtp_connections_reused": (
+        "smtp",
+        "reused",
+        "SMTP messages sent on a kept-alive connection.",
+    ),
+    "tns_names_cached": ("tns_names", "hits", "TNS names found in the LRU."),
+    "tns_names_stored": ("tns_names", "stored", "TNS names found in MongoDB."),
+    "tns_names_looked_up": ("tns_names", "misses", "TNS names looked up on the TNS."),
+    "tns_names_coalesced": (
+        "tns_names",
+        "coalesced",
+        "TNS name lookups that waited for the same one in flight.",
+    ),
+    "traces_dropped": (
+        "tracer",
+        "dropped",
+        "OTLP requests dropped while the trace collector was unreachable.",
+    ),
+}
+
+# Slots of the shared array: workers, including restarted ones.
+SLOTS = 64
+
+# Offsets of the sections of a row.
+_HISTOGRAMS = 0
+_SUMS = _HISTOGRAMS + len(STAGES) * (len(BUCKETS) + 1)
+_COUNTERS = _SUMS + len(STAGES)
+_GAUGES = _COUNTERS + len(KINDS) * len(STAGES) * len(STATUSES)
+_POOLS = _GAUGES + len(GAUGES)
+WIDTH = _POOLS + len(POOLS)
+
+_STAGE = {stage: index for index, stage in enumerate(STAGES)}
+_STATUS = {status: index for index, status in enumerate(STATUSES)}
+_KIND = {kind: index for index, kind in enumerate(KINDS)}
+_GAUGE = {gauge: index for index, gauge in enumerate(GAUGES)}
+_POOL = {counter: index for index, counter in enumerate(POOLS)}
+
+
+def allocate(slots: int = SLOTS) -> Tuple[Any, Any, Any]:
+    """Allocates the shared memory of the metrics, in the main process.
+
+    Args:
+        slots (int): The number of worker slots. Defaults to 64.
+
+    Returns:
+        Tuple[Any, Any, Any]: The values, the PID owning each slot, and the
+        lock taken to claim a slot.
+    """
+    return RawArray("d", slots * WIDTH), RawArray("q", slots), Lock()
+
+
+def memory() -> Tuple[float, float]:
+    """Returns the resident and peak resident memory of the process, in bytes."""
+    # ru_maxrss is in kilobytes on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024.0
+    try:
+        with open("/proc/self/statm") as statm:
+            resident = int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        resident = peak
+    return float(resident), max(peak, float(resident))
+
+
+def _alive(pid: int) -> bool:
+    """Returns whether a process is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """The metrics of a worker, in its slot of the shared array.
+
+    Args:
+        values (Optional[Any]): The shared values, from `allocate`. Defaults
+            to a private array.
+        pids (Optional[Any]): The PIDs owning the slots.
+        lock (Optional[Any]): The lock taken to claim a slot.
+
+    Raises:
+        RuntimeError: If every slot belongs to a running worker.
+    """
+
+    def __init__(self, values: Any = None, pids: Any = None, lock: Any = None):
+        """Claims a slot for the worker."""
+        if values is None:
+            values, pids, lock = allocate(slots=1)
+        self.values = values
+        self.pids = pids
+        self.slots = len(pids)
+        with lock:
+            for slot in range(self.slots):
+                pid = self.pids[slot]
+                if pid == 0 or pid == os.getpid() or not _alive(pid):
+                    break
+            else:
+                raise RuntimeError("No free metrics slot.")
+            self.pids[slot] = os.getpid()
+        self.slot = slot
+        self.base = slot * WIDTH
+        # The values of the pool counters at the last sample.
+        self.sampled: Dict[str, int] = {}
+        for gauge in range(len(GAUGES)):
+            self.values[self.base + _GAUGES + gauge] = 0.0
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Records the latency of a stage.
+
+        Args:
+            stage (str): The stage, one of `STAGES`.
+            seconds (float): Its latency.
+        """
+        index = _STAGE[stage]
+        bucket = bisect_left(BUCKETS, seconds)
+        self.values[self.base + index * (len(BUCKETS) + 1) + bucket] += 1.0
+        self.values[self.base + _SUMS + index] += seconds
+
+    def count(self, kind: Optional[str], stage: str, status: str) -> None:
+        """Counts the outcome of a stage for a VOEvent.
+
+        Args:
+            kind (Optional[str]): The kind of the VOEvent, None if unknown.
+            stage (str): The stage, one of `STAGES`.
+            status (str): Its outcome, one of `STATUSES`.
+        """
+        index = (_KIND.get(kind, _KIND["unknown"]) * len(STAGES) + _STAGE[stage]) * len(
+            STATUSES
+        ) + _STATUS[status]
+        self.values[self.base + _COUNTERS + index] += 1.0
+
+    def gauge(self, name: str, value: float) -> None:
+        """Sets a gauge of the worker.
+
+        Args:
+            name (str): The gauge, a key of `GAUGES`.
+            value (float): Its value.
+        """
+        self.values[self.base + _GAUGES + _GAUGE[name]] = value
+
+    def sample(self, pools: Dict[str, Any]) -> None:
+        """Adds what the pool counters counted since the last sample.
+
+        The counters of the pools are added to rather than set, so they keep
+        counting in a slot reclaimed from a worker that exited.
+
+        Args:
+            pools (Dict[str, Any]): The pools of the worker, by name, e.g.
+                `{"http": HTTPClient}`; each has a `metrics` dictionary. Pools
+                that are None are skipped.
+        """
+        for counter, (pool, key, _) in POOLS.items():
+            if pools.get(pool) is None:
+                continue
+            value = pools[pool].metrics.get(key, 0)
+            added = value - self.sampled.get(counter, 0)
+            self.sampled[counter] = value
+            if added > 0:
+                self.values[self.base + _POOLS + _POOL[counter]] += added
+        if pools.get("http") is not None:
+            self.gauge("http_waiting_requests", pools["http"].metrics["waiting"])
+
+    async def time(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Awaits an awaitable and records its latency, even if it fails.
+
+        Args:
+            stage (str): The stage, one of `STAGES`.
+            awaitable (Awaitable[T]): The awaitable.
+
+        Returns:
+            T: Its result.
+        """
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    async def monitor(
+        self,
+        stop: asyncio.Event,
+        interval: float = 1.0,
+        depth: Optional[Callable[[], Awaitable[int]]] = None,
+        background: Optional[Callable[[], int]] = None,
+        pools: Optional[Callable[[], Dict[str, Any]]] = None,
+    ) -> None:
+        """Samples the gauges every `interval` seconds until `stop` is set.
+
+        Args:
+            stop (asyncio.Event): Stops sampling once set.
+            interval (float): Seconds between samples. Defaults to 1.
+            depth (Optional[Callable[[], Awaitable[int]]]): Returns the outbox
+                depth.
+            background (Optional[Callable[[], int]]): Returns the number of
+                sinks running in the background.
+            pools (Optional[Callable[[], Dict[str, Any]]]): Returns the pools
+                of the worker, see `sample`.
+        """
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            start = loop.time()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            # The sleep overshoots by the time the loop was busy elsewhere.
+            self.gauge(
+                "event_loop_lag_seconds", max(0.0, loop.time() - start - interval)
+            )
+            resident, peak = memory()
+            self.gauge("resident_memory_bytes", resident)
+            self.gauge("peak_resident_memory_bytes", peak)
+            if background is not None:
+                self.gauge("background_sinks", background())
+            if pools is not None:
+                self.sample(pools())
+            if depth is not None:
+                try:
+                    self.gauge("outbox_depth", await depth())
+                except Exception as error:
+                    log.error(f"While measuring the outbox depth: {error}")
+
+    def rows(self) -> np.ndarray:
+        """Returns the rows of every slot, as a (slots, WIDTH) array."""
+        return np.frombuffer(self.values, dtype=np.float64).reshape(self.slots, WIDTH)
+
+    def render(self) -> str:
+        """Renders the metrics of every worker in the Prometheus text format.
+
+        Returns:
+            str: The exposition.
+        """
+        rows = self.rows()
+        total = rows.sum(axis=0)
+        lines: List[str] = [
+            "# HELP frbvoe_stage_seconds Latency of the stages of a request.",
+            "# TYPE frbvoe_stage_seconds histogram",
+        ]
+        for index, stage in enumerate(STAGES):
+            start = _HISTOGRAMS + index * (len(BUCKETS) + 1)
+            end = start + len(BUCKETS) + 1
+            counts = np.cumsum(total[start:end])
+            for bound, count in zip((*BUCKETS, "+Inf"), counts.tolist()):
+                lines.append(
+                    f'frbvoe_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} '
+                    f"{count:g}"
+                )
+            lines.append(
+                f'frbvoe_stage_seconds_sum{{stage="{stage}"}} '
+                f"{total[_SUMS + index]:.9g}"
+            )
+            lines.append(
+                f'frbvoe_stage_seconds_count{{stage="{stage}"}} {counts[-1]:g}'
+            )
+        lines += [
+            "# HELP frbvoe_voevents_total Outcomes of the stages, by VOEvent kind.",
+            "# TYPE frbvoe_voevents_total counter",
+        ]
+        counters = total[_COUNTERS:_GAUGES].reshape(
+            len(KINDS), len(STAGES), len(STATUSES)
+        )
+        for (kind, stage, status), count in np.ndenumerate(counters):
+            if count:
+                lines.append(
+                    f'frbvoe_voevents_total{{kind="{KINDS[kind]}",'
+                    f'stage="{STAGES[stage]}",status="{STATUSES[status]}"}} '
+                    f"{count:g}"
+                )
+        for counter, (_, _, description) in POOLS.items():
+            lines += [
+                f"# HELP frbvoe_{counter}_total {description}",
+                f"# TYPE frbvoe_{counter}_total counter",
+                f"frbvoe_{counter}_total {total[_POOLS + _POOL[counter]]:g}",
+            ]
+        workers = [slot for slot in range(self.slots) if self.pids[slot]]
+        for index, (gauge, description) in enumerate(GAUGES.items()):
+            lines += [
+                f"# HELP frbvoe_{gauge} {description}",
+                f"# TYPE frbvoe_{gauge} gauge",
+            ]
+            for slot in workers:
+                if _alive(self.pids[slot]):
+                    lines.append(
+                        f'frbvoe_{gauge}{{worker="{slot}"}} '
+                        f"{rows[slot, _GAUGES + index]:.9g}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics(app: Sanic) -> Metrics:
+    """Returns the metrics of the worker, private ones if none were set up.
+
+    Args:
+        app (Sanic): The application.
+
+    Returns:
+        Metrics: The metrics.
+    """
+    if not hasattr(app.ctx, "metrics"):
+        app.ctx.metrics = Metrics()
+    return app.ctx.metrics
@@ -0,0 +1,561 @@
+"""Durable outbound queue for VOEvent broadcasts.
+
+Every broadcast (one VOEvent to one sink, e.g. Comet or email) is stored as an
+item keyed by an idempotency key before the HTTP response is returned. Background
+workers drain the queue, retrying failed broadcasts with exponential backoff
+until they succeed, so a flapping broker or SMTP server never drops an alert.
+A claimed item is leased to its worker, which extends the lease while the
+broadcast is in flight, so a slow one is never claimed and sent again.
+A broadcast still failing after `max_attempts` attempts is marked "dead" and
+left for an operator. Sent items are kept for `retention` seconds, the window
+in which enqueueing the same broadcast again is a no-op.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import picologging as logging
+from pymongo import UpdateOne
+
+from frbvoe.utilities.tracing import TRACE
+
+logging.basicConfig()
+log = logging.getLogger()
+
+Sender = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class PartialBroadcast(Exception):
+    """A broadcast succeeded in part; only the rest is attempted again.
+
+    Args:
+        message (str): The error message.
+        payload (Dict[str, Any]): The payload of the next attempt, e.g. with
+            only the recipients not reached yet.
+    """
+
+    def __init__(self, message: str, payload: Dict[str, Any]):
+        """Initializes the error."""
+        super().__init__(message)
+        self.payload = payload
+
+
+def idempotency_key(payload: Dict[str, Any], sink: str) -> str:
+    """Returns the idempotency key of a broadcast.
+
+    Args:
+        payload (Dict[str, Any]): JSON-serializable VOEvent payload.
+        sink (str): Name of the sink, e.g. "comet" or "email".
+
+    Returns:
+        str: Key that is identical for identical broadcasts, whatever their
+        trace context.
+    """
+    payload = {key: value for key, value in payload.items() if key != TRACE}
+    digest = hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"{digest[:32]}:{sink}"
+
+
+def due(now: float) -> Dict[str, Any]:
+    """Returns the filter of the items due by a time.
+
+    Args:
+        now (float): Unix time.
+
+    Returns:
+        Dict[str, Any]: The MongoDB filter.
+    """
+    return {"status": "pending", "next_attempt": {"$lte": now}}
+
+
+def leased(token: str) -> Dict[str, Any]:
+    """Returns the filter of the items claimed with a lease token.
+
+    Args:
+        token (str): The lease token.
+
+    Returns:
+        Dict[str, Any]: The MongoDB filter.
+    """
+    return {"lease": token}
+
+
+# Filter of the items waiting to be sent.
+PENDING = {"status": "pending"}
+
+# Filters of the MongoDB outbox, explained for collection scans at startup.
+QUERIES = [due(0.0), leased(""), PENDING]
+
+
+class Outbox:
+    """Base class of the outbound queue backends.
+
+    Args:
+        base_backoff (float): Delay before the first retry, in seconds.
+        max_backoff (float): Upper bound of the retry delay, in seconds.
+        lease (float): Seconds a claimed item stays invisible to other workers.
+        max_attempts (int): Attempts after which an item is marked "dead".
+        retention (float): Seconds a sent item is kept, so that enqueueing the
+            same broadcast again is a no-op. Defaults to a week.
+    """
+
+    def __init__(
+        self,
+        base_backoff: float = 1.0,
+        max_backoff: float = 300.0,
+        lease: float = 60.0,
+        max_attempts: int = 20,
+        retention: float = 7 * 86400.0,
+    ):
+        """Initializes the outbox."""
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+
+    def backoff(self, attempts: int) -> float:
+        """Returns the delay before the next attempt, with full jitter.
+
+        Args:
+            attempts (int): Number of attempts made so far.
+
+        Returns:
+            float: Delay in seconds.
+        """
+        ceiling = min(self.max_backoff, self.base_backoff * 2 ** max(attempts - 1, 0))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def failed(self, item: Dict[str, Any], error: str) -> Dict[str, Any]:
+        """Returns the fields of an item updated after a failed attempt.
+
+        Args:
+            item (Dict[str, Any]): The claimed item.
+            error (str): Why the attempt failed.
+
+        Returns:
+            Dict[str, Any]: Its attempts, status, next attempt and error.
+        """
+        attempts = item["attempts"] + 1
+        if attempts >= self.max_attempts:
+            log.error(f"Broadcast {item['_id']} is dead after {attempts} attempts.")
+            status = "dead"
+        else:
+            status = "pending"
+        return {
+            "attempts": attempts,
+            "status": status,
+            "next_attempt": time.time() + self.backoff(attempts),
+            "error": error,
+        }
+
+    @staticmethod
+    def item(payload: Dict[str, Any], sink: str) -> Dict[str, Any]:
+        """Builds a new queue item.
+
+        Args:
+            payload (Dict[str, Any]): JSON-serializable VOEvent payload.
+            sink (str): Name of the sink.
+
+        Returns:
+            Dict[str, Any]: The queue item.
+        """
+        return {
+            "_id": idempotency_key(payload, sink),
+            "sink": sink,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt": time.time(),
+            "error": None,
+        }
+
+    async def setup(self) -> None:
+        """Prepares the backend before workers start."""
+
+    async def put(self, payload: Dict[str, Any], sinks: List[str]) -> List[str]:
+        """Enqueues a payload for each sink. Enqueueing twice is a no-op.
+
+        Args:
+            payload (Dict[str, Any]): JSON-serializable VOEvent payload.
+            sinks (List[str]): Names of the sinks to broadcast to.
+
+        Returns:
+            List[str]: The idempotency keys of the queued items.
+        """
+        raise NotImplementedError
+
+    async def put_many(
+        self, payloads: List[Dict[str, Any]], sinks: List[str]
+    ) -> List[str]:
+        """Enqueues many payloads for each sink at once.
+
+        Args:
+            payloads (List[Dict[str, Any]]): JSON-serializable VOEvent payloads.
+            sinks (List[str]): Names of the sinks to broadcast to.
+
+        Returns:
+            List[str]: The idempotency keys of the queued items.
+        """
+        keys = []
+        for payload in payloads:
+            keys += await self.put(payload, sinks)
+        return keys
+
+    async def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """Claims up to `limit` due items for this worker.
+
+        Args:
+            limit (int): Maximum number of items to claim.
+
+        Returns:
+            List[Dict[str, Any]]: The claimed items.
+        """
+        raise NotImplementedError
+
+    async def ack(self, item: Dict[str, Any]) -> None:
+        """Marks an item as sent.
+
+        Args:
+            item (Dict[str, Any]): The claimed item.
+        """
+        raise NotImplementedError
+
+    async def extend(self, item: Dict[str, Any]) -> None:
+        """Extends the lease of an item being sent by `lease` seconds.
+
+        Args:
+            item (Dict[str, Any]): The claimed item.
+        """
+        raise NotImplementedError
+
+    async def retry(
+        self,
+        item: Dict[str, Any],
+        error: str,
+        payload: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Schedules another attempt of an item, or marks it dead.
+
+        Args:
+            item (Dict[str, Any]): The claimed item.
+            error (str): Why the attempt failed.
+            payload (Optional[Dict[str, Any]]): The payload of the next attempt,
+                if it changed, see `PartialBroadcast`.
+        """
+        raise NotImplementedError
+
+    async def depth(self) -> int:
+        """Returns the number of items waiting to be sent."""
+        raise NotImplementedError
+
+
+class MongoOutbox(Outbox):
+    """Outbound queue stored in the `frbvoe.outbox` MongoDB collection.
+
+    Args:
+        collection (AsyncIOMotorCollection): The outbox collection.
+    """
+
+    def __init__(self, collection, **kwargs):
+        """Initializes the outbox."""
+        super().__init__(**kwargs)
+        self.collection = collection
+
+    async def setup(self) -> None:
+        """Creates the index of the sent items.
+
+        MongoDB deletes the sent items `retention` seconds after they were sent.
+        The indexes used to find and claim due items are in `INDEXES`.
+        """
+        await self.collection.create_index(
+            "sent_at",
+            expireAfterSeconds=int(self.retention),
+            partialFilterExpression={"status": "sent"},
+        )
+
+    async def put(self, payload: Dict[str, Any], sinks: List[str]) -> List[str]:
+        """Enqueues a payload for each sink. Enqueueing twice is a no-op."""
+        keys = []
+        for sink in sinks:
+            item = self.item(payload, sink)
+            await self.collection.update_one(
+                {"_id": item["_id"]}, {"$setOnInsert": item}, upsert=True
+            )
+            keys.append(item["_id"])
+        return keys
+
+    async def put_many(
+        self, payloads: List[Dict[str, Any]], sinks: List[str]
+    ) -> List[str]:
+        """Enqueues many payloads for each sink in one bulk write."""
+        items = [self.item(payload, sink) for payload in payloads for sink in sinks]
+        if items:
+            await self.collection.bulk_write(
+                [
+                    UpdateOne({"_id": item["_id"]}, {"$setOnInsert": item}, upsert=True)
+                    for item in items
+                ],
+                ordered=False,
+            )
+        return [item["_id"] for item in items]
+
+    async def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """Claims up to `limit` due items for this worker."""
+        now = time.time()
+        cursor = self.collection.find(due(now), {"_id": 1}).limit(limit)
+        ids = [document["_id"] async for document in cursor]
+        if not ids:
+            return []
+        # Only the worker whose update matched a document owns it.
+        token = uuid.uuid4().hex
+        await self.collection.update_many(
+            {"_id": {"$in": ids}, **due(now)},
+            {"$set": {"next_attempt": now + self.lease, "lease": token}},
+        )
+        return [document async for document in self.collection.find(leased(token))]
+
+    async def ack(self, item: Dict[str, Any]) -> None:
+        """Marks an item as sent."""
+        await self.collection.update_one(
+            {"_id": item["_id"]},
+            {
+                # A date, for the TTL index.
+                "$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)},
+                "$unset": {"lease": 1},
+            },
+        )
+
+    async def extend(self, item: Dict[str, Any]) -> None:
+        """Extends the lease of an item being sent by `lease` seconds."""
+        await self.collection.update_one(
+            {"_id": item["_id"], "lease": item["lease"]},
+            {"$set": {"next_attempt": time.time() + self.lease}},
+        )
+
+    async def retry(
+        self,
+        item: Dict[str, Any],
+        error: str,
+        payload: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Schedules another attempt of an item, or marks it dead."""
+        update = self.failed(item, error)
+        if payload is not None:
+            update["payload"] = payload
+        await self.collection.update_one(
+            {"_id": item["_id"]}, {"$set": update, "$unset": {"lease": 1}}
+        )
+
+    async def depth(self) -> int:
+        """Returns the number of items waiting to be sent."""
+        return await self.collection.count_documents(PENDING)
+
+
+class FileOutbox(Outbox):
+    """Outbound queue journaled to a local file, used when MongoDB is unreachable.
+
+    Every change is appended to a JSON-lines journal that is replayed (and
+    compacted) on startup, keeping the pending and dead items and the items
+    sent within `retention` seconds. Each worker process owns its own journal.
+
+    Args:
+        path (Path): Path of the journal file.
+    """
+
+    def __init__(self, path: Path, **kwargs):
+        """Initializes the outbox."""
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.lock = asyncio.Lock()
+
+    async def setup(self) -> None:
+        """Replays and compacts the journal."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            with self.path.open() as journal:
+                for line in journal:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final write from a crash; everything before it holds.
+                        log.warning(f"Skipping corrupt line in {self.path}")
+                        continue
+                    self.items[item["_id"]] = item
+        now = time.time()
+        self.items = {
+            key: {**item, "next_attempt": min(item["next_attempt"], now)}
+            for key, item in self.items.items()
+            if item["status"] != "sent" or item["sent_at"] > now - self.retention
+        }
+        compacted = self.path.with_suffix(".tmp")
+        with compacted.open("w") as journal:
+            for item in self.items.values():
+                journal.write(json.dumps(item) + "\n")
+        os.replace(compacted, self.path)
+
+    async def _write(self, *items: Dict[str, Any]) -> None:
+        """Appends items to the journal and syncs it to disk, off the loop."""
+        lines = []
+        for item in items:
+            self.items[item["_id"]] = item
+            lines.append(json.dumps(item) + "\n")
+        # One append at a time, so the lines of two writes never interleave.
+        async with self.lock:
+            await asyncio.to_thread(self._append, lines)
+
+    def _append(self, lines: List[str]) -> None:
+        """Appends lines to the journal and syncs it to disk."""
+        with self.path.open("a") as journal:
+            journal.writelines(lines)
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    async def put(self, payload: Dict[str, Any], sinks: List[str]) -> List[str]:
+        """Enqueues a payload for each sink. Enqueueing twice is a no-op."""
+        keys = []
+        for sink in sinks:
+            item = self.item(payload, sink)
+            if item["_id"] not in self.items:
+                await self._write(item)
+            keys.append(item["_id"])
+        return keys
+
+    async def put_many(
+        self, payloads: List[Dict[str, Any]], sinks: List[str]
+    ) -> List[str]:
+        """Enqueues many payloads for each sink with a single sync to disk."""
+        keys, items = [], {}
+        for payload in payloads:
+            for sink in sinks:
+                item = self.item(payload, sink)
+                keys.append(item["_id"])
+                if item["_id"] not in self.items:
+                    items[item["_id"]] = item
+        if items:
+            await self._write(*items.values())
+        return keys
+
+    async def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """Claims up to `limit` due items for this worker."""
+        now = time.time()
+        claimed = []
+        for item in self.items.values():
+            if len(claimed) == limit:
+                break
+            if item["status"] == "pending" and item["next_attempt"] <= now:
+                item["next_attempt"] = now + self.lease
+                claimed.append(dict(item))
+        return claimed
+
+    async def ack(self, item: Dict[str, Any]) -> None:
+        """Marks an item as sent."""
+        await self._write({**item, "status": "sent", "sent_at": time.time()})
+
+    async def retry(
+        self,
+        item: Dict[str, Any],
+        error: str,
+        payload: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Schedules another attempt of an item, or marks it dead."""
+        await self._write(
+            {
+                **item,
+                "payload": item["payload"] if payload is None else payload,
+                **self.failed(item, error),
+            }
+        )
+
+    async def extend(self, item: Dict[str, Any]) -> None:
+        """Extends the lease of an item being sent by `lease` seconds."""
+        # Leases are not journaled: a restarted worker retries at once.
+        if item["_id"] in self.items:
+            self.items[item["_id"]]["next_attempt"] = time.time() + self.lease
+
+    async def depth(self) -> int:
+        """Returns the number of items waiting to be sent."""
+        return sum(item["status"] == "pending" for item in self.items.values())
+
+
+async def deliver(outbox: Outbox, senders: Dict[str, Sender], batch_size: int) -> int:
+    """Claims one batch of due items and broadcasts them concurrently.
+
+    Args:
+        outbox (Outbox): The outbound queue.
+        senders (Dict[str, Sender]): Async senders keyed by sink name.
+        batch_size (int): Maximum number of items per batch.
+
+    Returns:
+        int: Number of items claimed.
+    """
+    items = await outbox.claim(batch_size)
+
+    async def renew(item: Dict[str, Any]) -> None:
+        # Keeps the item from being claimed again while it is being sent.
+        while True:
+            await asyncio.sleep(outbox.lease / 2)
+            try:
+                await outbox.extend(item)
+            except Exception as error:
+                log.error(f"While extending the lease of {item['_id']}: {error}")
+
+    async def send(item: Dict[str, Any]) -> None:
+        renewing = asyncio.ensure_future(renew(item))
+        try:
+            await senders[item["sink"]](item["payload"])
+        except Exception as error:
+            log.warning(
+                f"Broadcast {item['_id']} failed "
+                f"(attempt {item['attempts'] + 1}): {error}"
+            )
+            await outbox.retry(item, str(error), getattr(error, "payload", None))
+        else:
+            await outbox.ack(item)
+        finally:
+            renewing.cancel()
+
+    await asyncio.gather(*(send(item) for item in items))
+    return len(items)
+
+
+async def drain(
+    outbox: Outbox,
+    senders: Dict[str, Sender],
+    batch_size: int = 10,
+    poll_interval: float = 1.0,
+    stop: Optional[asyncio.Event] = None,
+) -> None:
+    """Background worker that drains the outbound queue forever.
+
+    Args:
+        outbox (Outbox): The outbound queue.
+        senders (Dict[str, Sender]): Async senders keyed by sink name.
+        batch_size (int): Maximum number of items per batch. Defaults to 10.
+        poll_interval (float): Seconds to sleep when the queue is empty.
+            Defaults to 1.0.
+        stop (Optional[asyncio.Event]): Stops the worker once set.
+    """
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        try:
+            claimed = await deliver(outbox, senders, batch_size)
+        except Exception as error:
+            log.exception(f"While draining the outbox: {error}")
+            claimed = 0
+        if claimed < batch_size:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
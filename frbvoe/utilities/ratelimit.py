@@ -0,0 +1,148 @@
+"""Token buckets limiting the rate of the requests to external services.
+
+The TNS enforces per-bot quotas, which every worker would exceed on its own
+share of the traffic. The buckets therefore live in a shared-memory array
+created by the main process, like the metrics, so that the workers draw from
+the same tokens. A caller reserves the next token under a lock, letting the
+bucket go into debt, and sleeps until its token is due: calls queue in the
+order they arrive, across workers, instead of failing.
+
+Without the main process, e.g. in tests, a worker keeps private buckets.
+"""
+
+import asyncio
+import time
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from typing import Any, Dict, Tuple
+
+# The external services limited.
+BUCKETS = ("tns", "comet", "smtp")
+
+# Values of each bucket in the shared array: its tokens and last refill time.
+_TOKENS, _REFILLED = 0, 1
+_WIDTH = 2
+
+
+def allocate(buckets: Tuple[str, ...] = BUCKETS) -> Tuple[Any, Any]:
+    """Allocates the shared memory of the buckets, in the main process.
+
+    Args:
+        buckets (Tuple[str, ...]): The buckets. Defaults to BUCKETS.
+
+    Returns:
+        Tuple[Any, Any]: The values, and the lock taken to draw a token.
+    """
+    return RawArray("d", len(buckets) * _WIDTH), Lock()
+
+
+class RateLimiter:
+    """The token buckets of the external services, shared by the workers.
+
+    A bucket holds up to `burst` tokens and gains `rate` tokens per second;
+    every request takes one. Services without a rate are not limited.
+
+    Args:
+        rates (Dict[str, Tuple[float, float]]): The rate, in requests per
+            second, and burst of each bucket.
+        values (Optional[Any]): The shared values, from `allocate`. Defaults
+            to a private array.
+        lock (Optional[Any]): The lock taken to draw a token.
+        buckets (Tuple[str, ...]): The buckets of the array. Defaults to
+            BUCKETS.
+
+    Attributes:
+        waited (Dict[str, float]): Seconds the worker waited for each bucket.
+    """
+
+    def __init__(
+        self,
+        rates: Dict[str, Tuple[float, float]],
+        values: Any = None,
+        lock: Any = None,
+        buckets: Tuple[str, ...] = BUCKETS,
+    ):
+        """Initializes the limiter."""
+        if values is None:
+            values, lock = allocate(buckets)
+        self.values = values
+        self.lock = lock
+        self.index = {bucket: n * _WIDTH for n, bucket in enumerate(buckets)}
+        self.rates = {
+            bucket: (float(rate), max(1.0, float(burst)))
+            for bucket, (rate, burst) in rates.items()
+            if bucket in self.index and rate > 0
+        }
+        self.waited = dict.fromkeys(self.rates, 0.0)
+
+    def reserve(self, bucket: str, tokens: float = 1.0) -> float:
+        """Takes tokens from a bucket, going into debt if it lacks them.
+
+        Args:
+            bucket (str): The bucket.
+            tokens (float): The tokens taken; negative to give them back.
+                Defaults to 1.
+
+        Returns:
+            float: Seconds until the tokens are due.
+        """
+        rate, burst = self.rates[bucket]
+        base = self.index[bucket]
+        with self.lock:
+            # The monotonic clock is shared by the processes of a host.
+            now = time.monotonic()
+            refilled = self.values[base + _REFILLED]
+            available = self.values[base + _TOKENS]
+            if refilled == 0.0:
+                available = burst
+            available = min(burst, available + (now - refilled) * rate) - tokens
+            # Tokens given back never fill the bucket past its burst.
+            available = min(burst, available)
+            self.values[base + _TOKENS] = available
+            self.values[base + _REFILLED] = now
+        return max(0.0, -available / rate)
+
+    async def acquire(self, bucket: str) -> None:
+        """Waits for a token of a bucket, in turn with the other callers.
+
+        Args:
+            bucket (str): The bucket, e.g. "tns". Unlimited buckets return at
+                once.
+        """
+        if bucket not in self.rates:
+            return
+        delay = self.reserve(bucket)
+        if delay <= 0:
+            return
+        self.waited[bucket] += delay
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            # The token goes to the next caller.
+            self.reserve(bucket, -1.0)
+            raise
+
+
+def rates(config: Any) -> Dict[str, Tuple[float, float]]:
+    """Returns the rates of the buckets set in the configuration.
+
+    `SANIC_<BUCKET>_RATE` is the rate, in requests per second, and
+    `SANIC_<BUCKET>_BURST` the burst of a bucket, e.g. `SANIC_TNS_RATE`.
+
+    Args:
+        config (Any): The application configuration.
+
+    Returns:
+        Dict[str, Tuple[float, float]]: The rate and burst of each bucket.
+    """
+    defaults = {"tns": (0.5, 5.0)}
+    limits = {}
+    # SANIC_TNS_RATE, SANIC_TNS_BURST, SANIC_COMET_RATE, SANIC_COMET_BURST,
+    # SANIC_SMTP_RATE, SANIC_SMTP_BURST
+    for bucket in BUCKETS:
+        rate, burst = defaults.get(bucket, (0.0, 1.0))
+        limits[bucket] = (
+            float(config.get(f"{bucket.upper()}_RATE", rate)),
+            float(config.get(f"{bucket.upper()}_BURST", burst)),
+        )
+    return limits
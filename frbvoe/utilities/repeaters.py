@@ -0,0 +1,331 @@
+"""Association of new detections with past events, e.g. of known repeaters.
+
+Every worker keeps the positions, errors and DMs of the archived VOEvents in
+an in-memory crossmatch catalog, with the few other fields an association
+reports in numpy columns. The events the worker archives itself are added as
+they are saved, and those archived by the other workers are picked up from a
+MongoDB change stream or, on standalone mongod servers, by polling the
+archive. New events are merged into the catalog in the background, off the
+path of the requests.
+
+The workers generate the `_id`s of their VOEvents, so an event may commit
+after one with a later `_id` was read. Polling therefore reads again the
+`_id`s generated up to `overlap` seconds before the newest one read, and
+skips the events it added within that window.
+"""
+
+import asyncio
+from datetime import timedelta
+from math import hypot
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+import picologging as logging
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from frbvoe.utilities.crossmatch import Catalog, error_radius
+
+logging.basicConfig()
+log = logging.getLogger()
+
+# Fields of the archived VOEvents read into the index.
+PROJECTION = {
+    "right_ascension": 1,
+    "declination": 1,
+    "pos_error_deg_95": 1,
+    "semi_major": 1,
+    "dm": 1,
+    "dm_error": 1,
+    "tns_name": 1,
+    "internal_id": 1,
+}
+
+
+# Columns of the events kept for the associations, and their types.
+COLUMNS = {
+    "_id": "S12",
+    "dm": np.float64,
+    "dm_error": np.float64,
+    "tns_name": object,
+    "internal_id": object,
+}
+
+
+def slim(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the fields of an archived event kept in the index.
+
+    Args:
+        event (Dict[str, Any]): The archived document, with its `_id`.
+
+    Returns:
+        Dict[str, Any]: Its `_id` and the fields of PROJECTION.
+    """
+    return {"_id": event["_id"], **{field: event.get(field) for field in PROJECTION}}
+
+
+class RepeaterIndex:
+    """Archived VOEvents indexed by position for associating new detections.
+
+    Args:
+        sigma (float): Scale of the combined position errors. Defaults to 1.
+        dm_tolerance (float): DM difference, in pc/cm^3, allowed on top of the
+            combined DM errors. Defaults to 5.
+        cell (float): Angular size of the catalog cells in degrees.
+            Defaults to 1.
+        overlap (float): Seconds of `_id`s read again by every refresh.
+            Defaults to 60.
+
+    Attributes:
+        catalog (Catalog): Positions and error radii of the events.
+        columns (Dict[str, np.ndarray]): The fields of COLUMNS of the events,
+            by their index in the catalog, grown by doubling.
+        known (Set[ObjectId]): The `_id`s of the events added within
+            `overlap` seconds of the newest one, which may be read again.
+        last_id (Optional[ObjectId]): Newest `_id` added, e.g. read from the
+            archive.
+    """
+
+    def __init__(
+        self,
+        sigma: float = 1.0,
+        dm_tolerance: float = 5.0,
+        cell: float = 1.0,
+        overlap: float = 60.0,
+    ):
+        """Initializes the index."""
+        self.sigma = sigma
+        self.dm_tolerance = dm_tolerance
+        self.overlap = overlap
+        # Merged by `compact`, in the background, or else every 4096 events.
+        self.catalog = Catalog(cell=cell)
+        self.columns = {name: np.empty(0, dtype) for name, dtype in COLUMNS.items()}
+        self.known: Set[ObjectId] = set()
+        self.last_id: Optional[ObjectId] = None
+
+    def __len__(self) -> int:
+        """Returns the number of events."""
+        return len(self.catalog)
+
+    def add(self, events: List[Dict[str, Any]]) -> int:
+        """Adds archived events to the index.
+
+        Args:
+            events (List[Dict[str, Any]]): The events, with at least their
+                position; events without one, or in the index already, are
+                skipped.
+
+        Returns:
+            int: The number of events added.
+        """
+        events = [
+            event
+            for event in events
+            if event.get("right_ascension") is not None
+            and event.get("declination") is not None
+            and event.get("_id") not in self.known
+        ]
+        if not events:
+            return 0
+        ids = [event["_id"] for event in events if event.get("_id") is not None]
+        self.known.update(ids)
+        if ids:
+            self.last_id = max(ids) if self.last_id is None else max(*ids, self.last_id)
+        self._append(events)
+        self.catalog.add(
+            [event["right_ascension"] for event in events],
+            [event["declination"] for event in events],
+            error_radius(
+                [event.get("pos_error_deg_95") or 0.0 for event in events],
+                [event.get("semi_major") or 0.0 for event in events],
+            ),
+        )
+        return len(events)
+
+    def _append(self, events: List[Dict[str, Any]]) -> None:
+        """Appends the fields of COLUMNS of events to the columns."""
+        start = len(self.catalog)
+        end = start + len(events)
+        for name, column in self.columns.items():
+            if end > len(column):
+                grown = np.empty(max(end, 2 * len(column)), column.dtype)
+                grown[:start] = column[:start]
+                self.columns[name] = column = grown
+            values = [event.get(name) for event in events]
+            if name == "_id":
+                values = [value.binary if value else b"" for value in values]
+            elif column.dtype == np.float64:
+                values = [np.nan if value is None else value for value in values]
+            column[start:end] = values
+
+    def past(self, index: int) -> Dict[str, Any]:
+        """Returns the fields of COLUMNS of an event of the catalog.
+
+        Args:
+            index (int): Its index in the catalog.
+
+        Returns:
+            Dict[str, Any]: Its fields, None where missing.
+        """
+        past: Dict[str, Any] = {}
+        for name, column in self.columns.items():
+            value = column[index]
+            if name == "_id":
+                value = ObjectId(value) if value else None
+            elif column.dtype == np.float64:
+                value = None if np.isnan(value) else float(value)
+            past[name] = value
+        return past
+
+    def compact(self) -> None:
+        """Merges the new events into the catalog, and forgets the old `_id`s.
+
+        Called in the background, so the requests never wait for a merge.
+        """
+        self.catalog.build()
+        if self.last_id is not None:
+            since = self.last_id.generation_time - timedelta(seconds=self.overlap)
+            oldest = ObjectId.from_datetime(since)
+            self.known = {id for id in self.known if id >= oldest}
+
+    def saved(self, event: Dict[str, Any]) -> None:
+        """Adds an event this worker just archived.
+
+        Args:
+            event (Dict[str, Any]): The archived document, with its `_id`.
+        """
+        self.add([slim(event)])
+
+    async def refresh(self, collection) -> int:
+        """Adds the events archived since the last refresh.
+
+        Args:
+            collection (AsyncIOMotorCollection): The VOEvent collection.
+
+        Returns:
+            int: The number of events added.
+        """
+        query: Dict[str, Any] = {"location": {"$exists": True}}
+        if self.last_id is not None:
+            since = self.last_id.generation_time - timedelta(seconds=self.overlap)
+            query["_id"] = {"$gte": ObjectId.from_datetime(since)}
+        events = []
+        async for event in collection.find(query, PROJECTION).sort("_id", 1):
+            self.last_id = max(self.last_id or event["_id"], event["_id"])
+            events.append(event)
+        added = self.add(events)
+        self.compact()
+        return added
+
+    async def watch(self, collection, stop: asyncio.Event, interval: float) -> None:
+        """Keeps the index current until `stop` is set.
+
+        The index follows a change stream of the archive, or polls it every
+        `interval` seconds where change streams are not supported.
+
+        Args:
+            collection (AsyncIOMotorCollection): The VOEvent collection.
+            stop (asyncio.Event): Stops watching once set.
+            interval (float): Seconds between refreshes when polling.
+        """
+        pipeline = [
+            {
+                "$match": {
+                    "operationType": "insert",
+                    "fullDocument.location": {"$exists": True},
+                }
+            },
+            {
+                "$project": {
+                    "fullDocument._id": 1,
+                    **{f"fullDocument.{field}": 1 for field in PROJECTION},
+                }
+            },
+        ]
+        while not stop.is_set():
+            try:
+                async with collection.watch(pipeline, max_await_time_ms=1000) as stream:
+                    # Events archived before the stream opened are picked up here.
+                    await self.refresh(collection)
+                    while not stop.is_set():
+                        change = await stream.try_next()
+                        if change is not None:
+                            self.add([change["fullDocument"]])
+                        elif self.catalog.pending:
+                            # Idle: merge what this worker and the others saved.
+                            self.compact()
+            except OperationFailure as error:
+                log.warning(f"Change streams unavailable, polling instead: {error}")
+                await self.poll(collection, stop, interval)
+            except PyMongoError as error:
+                log.error(f"Repeater change stream failed: {error}")
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def poll(self, collection, stop: asyncio.Event, interval: float) -> None:
+        """Refreshes the index every `interval` seconds until `stop` is set.
+
+        Args:
+            collection (AsyncIOMotorCollection): The VOEvent collection.
+            stop (asyncio.Event): Stops polling once set.
+            interval (float): Seconds between refreshes.
+        """
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.refresh(collection)
+            except PyMongoError as error:
+                log.error(f"While refreshing the repeater index: {error}")
+
+    def associate(self, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Finds the past event a new detection most likely repeats.
+
+        A past event is a candidate when the error regions overlap and, if
+        both have a DM, the DMs agree within `dm_tolerance` plus the combined
+        DM errors. Of the candidates, the nearest with a TNS name is chosen,
+        or else the nearest.
+
+        Args:
+            event (Dict[str, Any]): The new VOEvent payload.
+
+        Returns:
+            Optional[Dict[str, Any]]: The `id`, `tns_name`, `internal_id`,
+            `dm` and `separation` (degrees) of the past event, or None.
+        """
+        if event.get("right_ascension") is None or event.get("declination") is None:
+            return None
+        error = float(
+            error_radius(event.get("pos_error_deg_95"), event.get("semi_major"))
+        )
+        indices, separations = self.catalog.match(
+            event["right_ascension"], event["declination"], error, self.sigma
+        )
+        dm = event.get("dm")
+        candidates = []
+        for index, separation in zip(indices.tolist(), separations.tolist()):
+            past = self.past(index)
+            if dm is not None and past.get("dm") is not None:
+                errors = hypot(
+                    event.get("dm_error") or 0.0, past.get("dm_error") or 0.0
+                )
+                if abs(dm - past["dm"]) > self.dm_tolerance + errors:
+                    continue
+            candidates.append((past, separation))
+        if not candidates:
+            return None
+        past, separation = next(
+            (candidate for candidate in candidates if candidate[0].get("tns_name")),
+            candidates[0],
+        )
+        return {
+            "id": str(past["_id"]) if past.get("_id") is not None else None,
+            "tns_name": past.get("tns_name"),
+            "internal_id": past.get("internal_id"),
+            "dm": past.get("dm"),
+            "separation": separation,
+        }
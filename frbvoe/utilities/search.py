@@ -0,0 +1,202 @@
+"""Cone, time-window and DM searches over the VOEvent archive.
+
+Every archived VOEvent with a position carries a GeoJSON point, `location`,
+indexed with a 2dsphere index. MongoDB's spherical geometry treats the point
+as a direction on the unit sphere, so `$centerSphere` with an angular radius
+is an exact sky cone search. Results are sorted newest first and paginated
+with a cursor on (date, _id), so every page is an index range scan however
+deep it is.
+"""
+
+import base64
+from math import radians
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import orjson
+from bson import ObjectId
+
+# Results per page, by default and at most.
+LIMIT = 100
+MAX_LIMIT = 1000
+
+# Fields left out of the results.
+PROJECTION = {"email_password": 0, "location": 0}
+
+
+def location(
+    right_ascension: Optional[float], declination: Optional[float]
+) -> Optional[Dict[str, Any]]:
+    """Returns the GeoJSON point of a sky position.
+
+    GeoJSON longitudes span -180 to 180 degrees, so right ascensions past 180
+    degrees are wrapped around.
+
+    Args:
+        right_ascension (Optional[float]): Right ascension in degrees.
+        declination (Optional[float]): Declination in degrees.
+
+    Returns:
+        Optional[Dict[str, Any]]: The point, or None without a position.
+    """
+    if right_ascension is None or declination is None:
+        return None
+    longitude = right_ascension % 360.0
+    if longitude > 180.0:
+        longitude -= 360.0
+    return {"type": "Point", "coordinates": [longitude, declination]}
+
+
+def encode_cursor(document: Mapping[str, Any]) -> str:
+    """Returns the cursor of the page following a document."""
+    return base64.urlsafe_b64encode(
+        orjson.dumps([document["date"], str(document["_id"])])
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, ObjectId]:
+    """Returns the date and _id a cursor points after.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        date, _id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(date), ObjectId(_id)
+    except Exception as error:
+        raise ValueError(f"Invalid cursor: {cursor}") from error
+
+
+def _float(args: Mapping[str, Any], name: str) -> Optional[float]:
+    """Reads an optional float query parameter."""
+    value = args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, not {value!r}.") from None
+
+
+def build_query(args: Mapping[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """Builds the MongoDB filter of a search.
+
+    Args:
+        args (Mapping[str, Any]): The search parameters; `ra`, `dec` and
+            `radius` in degrees for a cone search, `start` and `end` dates,
+            `dm_min` and `dm_max` in pc/cm^3, `kind`, `limit`, and the `cursor`
+            of the previous page.
+
+    Returns:
+        Tuple[Dict[str, Any], int]: The filter, and the number of results.
+
+    Raises:
+        ValueError: If a parameter is invalid.
+    """
+    query: Dict[str, Any] = {}
+    right_ascension = _float(args, "ra")
+    declination = _float(args, "dec")
+    radius = _float(args, "radius")
+    if (right_ascension, declination, radius).count(None) not in (0, 3):
+        raise ValueError("A cone search needs ra, dec and radius.")
+    if radius is not None:
+        if not 0 < radius <= 180 or not -90 <= declination <= 90:
+            raise ValueError("radius must be in (0, 180] and dec in [-90, 90].")
+        center = location(right_ascension, declination)["coordinates"]
+        query["location"] = {"$geoWithin": {"$centerSphere": [center, radians(radius)]}}
+    dates = {}
+    if args.get("start"):
+        dates["$gte"] = str(args["start"])
+    if args.get("end"):
+        dates["$lte"] = str(args["end"])
+    if dates:
+        query["date"] = dates
+    dms = {}
+    dm_min = _float(args, "dm_min")
+    dm_max = _float(args, "dm_max")
+    if dm_min is not None:
+        dms["$gte"] = dm_min
+    if dm_max is not None:
+        dms["$lte"] = dm_max
+    if dms:
+        query["dm"] = dms
+    if args.get("kind"):
+        query["kind"] = str(args["kind"])
+    if args.get("cursor"):
+        date, _id = decode_cursor(str(args["cursor"]))
+        query = {
+            "$and": [
+                query,
+                {"$or": [{"date": {"$lt": date}}, {"date": date, "_id": {"$lt": _id}}]},
+            ]
+        }
+    limit = _float(args, "limit")
+    limit = LIMIT if limit is None else int(limit)
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be in [1, {MAX_LIMIT}].")
+    return query, limit
+
+
+async def search(collection, args: Mapping[str, Any]) -> Dict[str, Any]:
+    """Searches the VOEvent archive.
+
+    Args:
+        collection (AsyncIOMotorCollection): The VOEvent collection.
+        args (Mapping[str, Any]): The search parameters, see `build_query`.
+
+    Returns:
+        Dict[str, Any]: The VOEvents found, newest first, as `results`, and the
+        `cursor` of the next page, None on the last page.
+
+    Raises:
+        ValueError: If a parameter is invalid.
+    """
+    query, limit = build_query(args)
+    results: List[Dict[str, Any]] = await (
+        collection.find(query, PROJECTION)
+        .sort([("date", -1), ("_id", -1)])
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    cursor = encode_cursor(results[limit - 1]) if len(results) > limit else None
+    for result in results:
+        result["_id"] = str(result["_id"])
+    return {"results": results[:limit], "cursor": cursor}
+
+
+async def backfill_locations(collection) -> int:
+    """Adds the GeoJSON point to VOEvents archived without one.
+
+    Args:
+        collection (AsyncIOMotorCollection): The VOEvent collection.
+
+    Returns:
+        int: The number of VOEvents updated.
+    """
+    longitude = {"$mod": ["$right_ascension", 360]}
+    result = await collection.update_many(
+        {
+            "location": {"$exists": False},
+            "right_ascension": {"$type": "number"},
+            "declination": {"$type": "number"},
+        },
+        [
+            {
+                "$set": {
+                    "location": {
+                        "type": "Point",
+                        "coordinates": [
+                            {
+                                "$cond": [
+                                    {"$gt": [longitude, 180]},
+                                    {"$subtract": [longitude, 360]},
+                                    longitude,
+                                ]
+                            },
+                            "$declination",
+                        ],
+                    }
+                }
+            }
+        ],
+    )
+    return result.modified_count
@@ -0,0 +1,249 @@
+"""Pooled async SMTP delivery of the VOEvent emails."""
+
+import asyncio
+from contextlib import asynccontextmanager
+from itertools import islice
+from time import perf_counter
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Union
+
+import aiosmtplib
+import picologging as logging
+
+from frbvoe.utilities.breaker import CircuitBreaker
+from frbvoe.utilities.ratelimit import RateLimiter
+
+logging.basicConfig()
+log = logging.getLogger()
+
+
+class SMTPPool:
+    """Bounded pool of authenticated connections to one SMTP server.
+
+    Connections are opened lazily, kept open between alerts, and reopened when
+    the server has dropped them, so an alert costs one TLS handshake per pooled
+    connection at most rather than one per message. The pool size is also the
+    number of messages sent to the server concurrently.
+
+    Args:
+        hostname (str): SMTP server hostname.
+        port (int): SMTP server port. Defaults to 587.
+        username (Optional[str]): Login username, if the server needs one.
+        password (Optional[str]): Login password, if the server needs one.
+        start_tls (Optional[bool]): Whether to upgrade with STARTTLS. Defaults to
+            None, upgrading if the server supports it.
+        use_tls (bool): Whether to connect with implicit TLS. Defaults to False.
+        size (int): Maximum number of connections, and of concurrent sends.
+        timeout (float): Timeout of every SMTP command in seconds.
+        bcc_size (int): Maximum number of recipients of one message. Subscribers
+            are sent one message per batch, as blind carbon copies.
+        limiter (Optional[RateLimiter]): Paces the messages to the quota of the
+            server, across workers.
+        breaker (Optional[CircuitBreaker]): Fails the messages at once while
+            the server is down, and times them out adaptively.
+
+    Attributes:
+        metrics (Dict[str, int]): Pool metrics; connections `opened` and
+            `reused`, and `messages` sent.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int = 587,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        start_tls: Optional[bool] = None,
+        use_tls: bool = False,
+        size: int = 4,
+        timeout: float = 10.0,
+        bcc_size: int = 50,
+        limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        """Initializes the pool."""
+        self.options = {
+            "hostname": hostname,
+            "port": port,
+            "username": username or None,
+            "password": password or None,
+            "start_tls": start_tls,
+            "use_tls": use_tls,
+            "timeout": timeout,
+        }
+        self.size = size
+        self.bcc_size = max(1, bcc_size)
+        self.limiter = limiter
+        self.breaker = breaker
+        self.idle: List[aiosmtplib.SMTP] = []
+        self.slots = asyncio.Semaphore(size)
+        self.metrics: Dict[str, int] = {"opened": 0, "reused": 0, "messages": 0}
+
+    @asynccontextmanager
+    async def connection(
+        self, timings: Optional[Dict[str, float]] = None
+    ) -> AsyncIterator[aiosmtplib.SMTP]:
+        """Checks a connected client out of the pool.
+
+        The client is returned to the pool afterwards, unless sending through it
+        raised, in which case it is closed.
+
+        Args:
+            timings (Optional[Dict[str, float]]): Seconds spent waiting for a slot
+                (`acquire`) and connecting (`connect`) are added to it.
+
+        Yields:
+            aiosmtplib.SMTP: The client.
+        """
+        timings = timings if timings is not None else {}
+        start = perf_counter()
+        async with self.slots:
+            waited = perf_counter()
+            timings["acquire"] = timings.get("acquire", 0.0) + waited - start
+            client = self.idle.pop() if self.idle else None
+            if client is None or not client.is_connected:
+                client = aiosmtplib.SMTP(**self.options)
+                await client.connect()
+                self.metrics["opened"] += 1
+            else:
+                self.metrics["reused"] += 1
+            timings["connect"] = timings.get("connect", 0.0) + perf_counter() - waited
+            try:
+                yield client
+            except BaseException:
+                client.close()
+                raise
+            self.idle.append(client)
+
+    async def sendmail(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        message: bytes,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> Dict[str, str]:
+        """Sends one message through a pooled connection.
+
+        A connection the server closed while it sat idle is reopened and the
+        message is sent again once.
+
+        Args:
+            sender (str): Envelope sender.
+            recipients (Sequence[str]): Envelope recipients.
+            message (bytes): The encoded message.
+            timings (Optional[Dict[str, float]]): Seconds spent per stage are
+                added to it.
+
+        Returns:
+            Dict[str, str]: The refused recipients and the server's reply.
+        """
+        timings = timings if timings is not None else {}
+        if self.limiter is not None:
+            await self.limiter.acquire("smtp")
+        if self.breaker is not None:
+            return await self.breaker.call(
+                self._resend(sender, recipients, message, timings)
+            )
+        return await self._resend(sender, recipients, message, timings)
+
+    async def _resend(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        message: bytes,
+        timings: Dict[str, float],
+    ) -> Dict[str, str]:
+        """Sends one message, again once if the connection was dropped."""
+        try:
+            return await self._sendmail(sender, recipients, message, timings)
+        except aiosmtplib.SMTPServerDisconnected:
+            return await self._sendmail(sender, recipients, message, timings)
+
+    async def _sendmail(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        message: bytes,
+        timings: Dict[str, float],
+    ) -> Dict[str, str]:
+        """Sends one message through a pooled connection, once."""
+        async with self.connection(timings) as client:
+            start = perf_counter()
+            refused, _ = await client.sendmail(sender, recipients, message)
+            timings["send"] = timings.get("send", 0.0) + perf_counter() - start
+        self.metrics["messages"] += 1
+        return {recipient: str(reply) for recipient, reply in refused.items()}
+
+    async def deliver(
+        self,
+        sender: str,
+        recipients: Sequence[str],
+        message: Union[bytes, Callable[[Sequence[str]], bytes]],
+    ) -> Dict[str, Any]:
+        """Delivers a message to many recipients in parallel BCC batches.
+
+        Args:
+            sender (str): Envelope sender.
+            recipients (Sequence[str]): Envelope recipients.
+            message (Union[bytes, Callable[[Sequence[str]], bytes]]): The encoded
+                message, or a function returning the message sent to a batch.
+
+        Returns:
+            Dict[str, Any]: The delivery report; number of `recipients`,
+            `messages` and `failed` messages, the `refused` recipients with the
+            server's reply, the `undelivered` recipients worth another attempt
+            (those of the failed messages, and those refused temporarily), and
+            `timings` in seconds per stage, summed over the messages, with the
+            wall-clock `total`.
+        """
+        start = perf_counter()
+        remaining = iter(recipients)
+        batches = list(iter(lambda: list(islice(remaining, self.bcc_size)), []))
+        timings: Dict[str, float] = {"acquire": 0.0, "connect": 0.0, "send": 0.0}
+        results = await asyncio.gather(
+            *(
+                self.sendmail(
+                    sender,
+                    batch,
+                    message(batch) if callable(message) else message,
+                    timings,
+                )
+                for batch in batches
+            ),
+            return_exceptions=True,
+        )
+        refused: Dict[str, str] = {}
+        undelivered: List[str] = []
+        failed = 0
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                failed += 1
+                log.error(f"SMTP delivery to {len(batch)} recipients failed: {result}")
+                refused.update({recipient: str(result) for recipient in batch})
+                undelivered += batch
+            else:
+                refused.update(result)
+                # 4xx replies are temporary, 5xx ones permanent.
+                undelivered += [
+                    recipient
+                    for recipient, reply in result.items()
+                    if reply.startswith("4")
+                ]
+        timings["total"] = perf_counter() - start
+        return {
+            "recipients": len(recipients),
+            "messages": len(batches),
+            "failed": failed,
+            "refused": refused,
+            "undelivered": undelivered,
+            "timings": timings,
+        }
+
+    async def close(self) -> None:
+        """Closes every pooled connection."""
+        log.info(f"Closing the SMTP pool: {self.metrics}")
+        idle, self.idle = self.idle, []
+        for client in idle:
+            try:
+                await client.quit()
+            except aiosmtplib.SMTPException:
+                client.close()
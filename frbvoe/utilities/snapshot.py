@@ -0,0 +1,397 @@
+"""Columnar snapshots of the VOEvent archive for offline analytics.
+
+A snapshot is a directory of `.npy` files, one per column, that `load`
+memory-maps without parsing anything:
+
+    _id.npy                 The ObjectIds, as 12-byte strings.
+    date.npy                Detection times, as datetime64[us], NaT if missing.
+    <numeric>.npy           float64, NaN if missing (e.g. dm.npy, snr.npy).
+    <string>.npy            int32 codes into <string>.categories.npy, -1 if
+                            missing (e.g. kind.npy, observatory_name.npy).
+    meta.json               The number of rows and the columns.
+
+Snapshots are written to `<path>/<timestamp>/` and published by pointing the
+`<path>/latest` symlink at them, so readers never see a partial snapshot. The
+columns are sized from a count of the archive and filled one cursor batch at
+a time, so writing one holds a single batch in memory.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Mapping, Optional, Union
+
+import numpy as np
+import picologging as logging
+from numpy.lib.format import write_array_header_1_0
+
+from frbvoe.utilities.export import BATCH_SIZE, batches
+
+logging.basicConfig()
+log = logging.getLogger()
+
+# Columns stored as float64; the integer fields fit exactly.
+NUMERIC = (
+    "right_ascension",
+    "declination",
+    "pos_error_deg_95",
+    "semi_major",
+    "semi_minor",
+    "dm",
+    "dm_error",
+    "snr",
+    "flux",
+    "width",
+    "sampling_time",
+    "bandwidth",
+    "central_frequency",
+    "gain",
+    "tsys",
+    "importance",
+    "npol",
+    "bits_per_sample",
+)
+
+# Columns dictionary-encoded. Unique free text (internal_id, update_message)
+# would make dictionaries as large as the archive, and stays in MongoDB.
+STRINGS = ("kind", "observatory_name", "email", "tns_name")
+
+PROJECTION = dict.fromkeys(("_id", "date", *NUMERIC, *STRINGS), 1)
+
+# Snapshots kept besides the latest, by default.
+KEEP = 1
+
+
+def _dates(values: List[Any]) -> np.ndarray:
+    """Returns the datetime64 of VOEvent dates, NaT where missing or invalid."""
+    try:
+        return np.array(values, dtype="datetime64[us]")
+    except ValueError:
+        dates = np.empty(len(values), dtype="datetime64[us]")
+        for index, value in enumerate(values):
+            try:
+                dates[index] = np.datetime64(value, "us")
+            except ValueError:
+                dates[index] = np.datetime64("NaT")
+        return dates
+
+
+class SnapshotWriter:
+    """Writes the columns of a snapshot, one batch of documents at a time.
+
+    Every column is a `.npy` file whose header gives it `capacity` rows;
+    batches are appended to the files, so they never sit in memory or in
+    dirty mapped pages, and the rows left over are zero-filled on close.
+
+    Args:
+        directory (Path): The snapshot directory, created if missing.
+        capacity (int): The number of rows preallocated.
+    """
+
+    def __init__(self, directory: Path, capacity: int):
+        """Initializes the writer."""
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.capacity = capacity
+        self.rows = 0
+        self.dtypes = {
+            "_id": np.dtype("S12"),
+            "date": np.dtype("datetime64[us]"),
+            **dict.fromkeys(NUMERIC, np.dtype(np.float64)),
+            **dict.fromkeys(STRINGS, np.dtype(np.int32)),
+        }
+        self.files = {
+            name: self._column(name, dtype) for name, dtype in self.dtypes.items()
+        }
+        self.categories: Dict[str, Dict[str, int]] = {field: {} for field in STRINGS}
+
+    def _column(self, name: str, dtype: np.dtype) -> BinaryIO:
+        """Opens the file of a column, after its header."""
+        column = open(self.directory / f"{name}.npy", "wb")
+        header = {"descr": dtype.str, "fortran_order": False, "shape": (self.capacity,)}
+        write_array_header_1_0(column, header)
+        return column
+
+    def append(self, documents: List[Dict[str, Any]]) -> None:
+        """Appends a batch of documents.
+
+        Documents past the capacity, archived while the snapshot was counted,
+        are left for the next snapshot.
+
+        Args:
+            documents (List[Dict[str, Any]]): The documents.
+        """
+        documents = documents[: self.capacity - self.rows]
+        if not documents:
+            return
+        columns = {
+            "_id": np.array([document["_id"].binary for document in documents], "S12"),
+            "date": _dates([document.get("date") for document in documents]),
+        }
+        for field in NUMERIC:
+            columns[field] = np.array(
+                [document.get(field) for document in documents], dtype=np.float64
+            )
+        for field in STRINGS:
+            codes = self.categories[field]
+            columns[field] = np.array(
+                [
+                    (
+                        -1
+                        if document.get(field) is None
+                        else codes.setdefault(document[field], len(codes))
+                    )
+                    for document in documents
+                ],
+                dtype=np.int32,
+            )
+        for name, column in columns.items():
+            self.files[name].write(column.tobytes())
+        self.rows += len(documents)
+
+    def close(self) -> Dict[str, Any]:
+        """Writes the dictionaries and the metadata, and closes the columns.
+
+        Returns:
+            Dict[str, Any]: The metadata.
+        """
+        for name, column in self.files.items():
+            # Zero-fills the rows the header promises but were never written.
+            column.truncate(
+                column.tell() + (self.capacity - self.rows) * self.dtypes[name].itemsize
+            )
+            column.close()
+        for field, codes in self.categories.items():
+            np.save(
+                self.directory / f"{field}.categories.npy",
+                np.array(list(codes), dtype=str),
+            )
+        meta = {
+            "rows": self.rows,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "numeric": list(NUMERIC),
+            "strings": list(STRINGS),
+        }
+        (self.directory / "meta.json").write_text(json.dumps(meta))
+        return meta
+
+
+def _publish(path: Path, directory: Path, keep: int) -> None:
+    """Points `latest` at a snapshot and removes the oldest snapshots."""
+    link = path / "latest.tmp"
+    if link.is_symlink():
+        link.unlink()
+    link.symlink_to(directory.name)
+    os.replace(link, path / "latest")
+    snapshots = sorted(
+        child
+        for child in path.iterdir()
+        if child.is_dir() and not child.is_symlink() and child != directory
+    )
+    for old in snapshots[: max(0, len(snapshots) - keep)]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _directory(path: Path) -> Path:
+    """Returns the directory of a new snapshot."""
+    return path / datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def snapshot(
+    collection,
+    path: Union[str, Path],
+    batch_size: int = BATCH_SIZE,
+    keep: int = KEEP,
+) -> Path:
+    """Writes a snapshot of the VOEvent collection, e.g. from the CLI.
+
+    Args:
+        collection (pymongo.collection.Collection): The VOEvent collection.
+        path (Union[str, Path]): The directory of the snapshots.
+        batch_size (int): Documents per round trip. Defaults to 1000.
+        keep (int): Older snapshots kept. Defaults to 1.
+
+    Returns:
+        Path: The snapshot directory.
+    """
+    path = Path(path)
+    # The VOEvents archived up to now; later ones go into the next snapshot.
+    last = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    query = {"_id": {"$lte": last["_id"]}} if last else {}
+    directory = _directory(path)
+    writer = SnapshotWriter(directory, collection.count_documents(query))
+    cursor = collection.find(query, PROJECTION, batch_size=batch_size)
+    for batch in batches(cursor, batch_size):
+        writer.append(batch)
+    writer.close()
+    _publish(path, directory, keep)
+    return directory
+
+
+async def snapshot_async(
+    collection,
+    path: Union[str, Path],
+    batch_size: int = BATCH_SIZE,
+    keep: int = KEEP,
+) -> Path:
+    """Writes a snapshot of the VOEvent collection from the server.
+
+    Args:
+        collection (AsyncIOMotorCollection): The VOEvent collection.
+        path (Union[str, Path]): The directory of the snapshots.
+        batch_size (int): Documents per round trip. Defaults to 1000.
+        keep (int): Older snapshots kept. Defaults to 1.
+
+    Returns:
+        Path: The snapshot directory.
+    """
+    path = Path(path)
+    last = await collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    query = {"_id": {"$lte": last["_id"]}} if last else {}
+    directory = _directory(path)
+    writer = SnapshotWriter(directory, await collection.count_documents(query))
+    batch = []
+    async for document in collection.find(query, PROJECTION, batch_size=batch_size):
+        batch.append(document)
+        if len(batch) == batch_size:
+            writer.append(batch)
+            batch = []
+    writer.append(batch)
+    writer.close()
+    _publish(path, directory, keep)
+    return directory
+
+
+async def snapshots(
+    collection, path: Union[str, Path], stop, interval: float, keep: int = KEEP
+) -> None:
+    """Writes a snapshot every `interval` seconds until `stop` is set.
+
+    Every worker runs this loop; the first to take the lock on the snapshot
+    directory writes the snapshot, and the others skip it while it is recent.
+
+    Args:
+        collection (AsyncIOMotorCollection): The VOEvent collection.
+        path (Union[str, Path]): The directory of the snapshots.
+        stop (asyncio.Event): Stops the loop once set.
+        interval (float): Seconds between snapshots.
+        keep (int): Older snapshots kept. Defaults to 1.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+            return
+        except asyncio.TimeoutError:
+            pass
+        with open(path / ".lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            latest = path / "latest" / "meta.json"
+            if latest.exists() and time.time() - latest.stat().st_mtime < interval / 2:
+                continue
+            try:
+                directory = await snapshot_async(collection, path, keep=keep)
+                log.info(f"Wrote the archive snapshot {directory}")
+            except Exception as error:
+                log.error(f"While writing the archive snapshot: {error}")
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class Snapshot(Mapping):
+    """A snapshot, with its columns memory-mapped on first access.
+
+    Numeric columns and `date` are returned as they are; string columns as
+    their codes, see `strings` and `code`.
+
+    Args:
+        path (Union[str, Path]): The snapshot directory, or the directory of
+            the snapshots to load the latest.
+
+    Attributes:
+        rows (int): The number of rows.
+        meta (Dict[str, Any]): The metadata.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """Reads the metadata of the snapshot."""
+        path = Path(path)
+        if (path / "latest").exists():
+            path = (path / "latest").resolve()
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text())
+        self.rows = int(self.meta["rows"])
+        self.names = ["_id", "date", *self.meta["numeric"], *self.meta["strings"]]
+        self._columns: Dict[str, np.ndarray] = {}
+        self._categories: Dict[str, np.ndarray] = {}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """Returns a column."""
+        if name not in self._columns:
+            if name not in self.names:
+                raise KeyError(name)
+            column = np.load(self.path / f"{name}.npy", mmap_mode="r")
+            self._columns[name] = column[: self.rows]
+        return self._columns[name]
+
+    def __iter__(self):
+        """Iterates over the column names."""
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        """Returns the number of columns."""
+        return len(self.names)
+
+    def categories(self, name: str) -> np.ndarray:
+        """Returns the distinct values of a string column, by code."""
+        if name not in self._categories:
+            self._categories[name] = np.load(self.path / f"{name}.categories.npy")
+        return self._categories[name]
+
+    def code(self, name: str, value: Optional[str]) -> int:
+        """Returns the code of a value of a string column, -1 if absent.
+
+        Args:
+            name (str): The string column.
+            value (Optional[str]): The value.
+
+        Returns:
+            int: The code, e.g. for `snapshot["kind"] == code`.
+        """
+        found = np.flatnonzero(self.categories(name) == value)
+        return int(found[0]) if len(found) else -1
+
+    def strings(self, name: str) -> np.ndarray:
+        """Decodes a string column, with None where missing.
+
+        Args:
+            name (str): The string column.
+
+        Returns:
+            np.ndarray: The values, as an object array.
+        """
+        # The code -1 of missing values picks the None appended last.
+        values = np.append(self.categories(name).astype(object), None)
+        return values[self[name]]
+
+
+def load(path: Union[str, Path]) -> Snapshot:
+    """Memory-maps a snapshot.
+
+    Args:
+        path (Union[str, Path]): The snapshot directory, or the directory of
+            the snapshots to load the latest.
+
+    Returns:
+        Snapshot: The snapshot.
+    """
+    return Snapshot(path)
@@ -0,0 +1,158 @@
+"""In-process cache of the subscribers, kept current from MongoDB.
+
+The cache is loaded when a worker starts and is then updated incrementally from
+a MongoDB change stream. Standalone mongod servers do not support change
+streams, so the cache falls back to polling the collection. Either way, the
+alert path only reads the cache and never waits on a subscriber query.
+"""
+
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+import picologging as logging
+from pymongo.errors import OperationFailure, PyMongoError
+
+logging.basicConfig()
+log = logging.getLogger()
+
+# Requested services that include each kind of broadcast.
+SERVICES = {"emails": ("emails", "both"), "xmls": ("xmls", "both")}
+
+
+class SubscriberRegistry:
+    """Subscribers of the `frbvoe.subscriber` collection, keyed by service.
+
+    Args:
+        collection (AsyncIOMotorCollection): The subscriber collection.
+        poll_interval (float): Seconds between reloads when change streams are
+            not available. Defaults to 30.
+
+    Attributes:
+        subscribers (Dict[Any, Dict[str, Any]]): Subscriber documents by `_id`.
+        services (Dict[str, Tuple[Dict[str, Any], ...]]): Subscriber documents
+            by requested service ("emails", "xmls" or "both").
+        broadcasts (Dict[str, Tuple[Dict[str, Any], ...]]): Subscriber documents
+            by kind of broadcast they receive ("emails" or "xmls").
+        emails (Tuple[str, ...]): Addresses VOEvent emails are sent to.
+    """
+
+    def __init__(self, collection, poll_interval: float = 30.0):
+        """Initializes the registry."""
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.subscribers: Dict[Any, Dict[str, Any]] = {}
+        self.services: Dict[str, Tuple[Dict[str, Any], ...]] = {}
+        self.broadcasts: Dict[str, Tuple[Dict[str, Any], ...]] = {}
+        self.emails: Tuple[str, ...] = ()
+        self._index()
+
+    def _index(self) -> None:
+        """Rebuilds the per-service views after a change."""
+        self.services = {
+            service: tuple(
+                subscriber
+                for subscriber in self.subscribers.values()
+                if subscriber.get("requested_service") == service
+            )
+            for service in ("emails", "xmls", "both")
+        }
+        self.broadcasts = {
+            broadcast: tuple(
+                subscriber
+                for service in services
+                for subscriber in self.services[service]
+            )
+            for broadcast, services in SERVICES.items()
+        }
+        self.emails = tuple(
+            dict.fromkeys(
+                subscriber.get("subscriber_email") or subscriber["contact_email"]
+                for subscriber in self.broadcasts["emails"]
+            )
+        )
+
+    def recipients(self, broadcast: str) -> Tuple[Dict[str, Any], ...]:
+        """Returns the subscribers of a kind of broadcast.
+
+        Args:
+            broadcast (str): "emails" or "xmls".
+
+        Returns:
+            Tuple[Dict[str, Any], ...]: The subscriber documents.
+        """
+        return self.broadcasts[broadcast]
+
+    async def load(self) -> None:
+        """Loads every subscriber from MongoDB."""
+        self.subscribers = {
+            subscriber["_id"]: subscriber
+            async for subscriber in self.collection.find({})
+        }
+        self._index()
+        log.info(f"Loaded {len(self.subscribers)} subscribers")
+
+    def apply(self, change: Dict[str, Any]) -> None:
+        """Applies one change stream event to the cache.
+
+        Args:
+            change (Dict[str, Any]): The change stream event.
+        """
+        operation = change["operationType"]
+        if operation in ("insert", "replace", "update"):
+            subscriber = change.get("fullDocument")
+            if subscriber is None:
+                # Deleted again before the update could be looked up.
+                self.subscribers.pop(change["documentKey"]["_id"], None)
+            else:
+                self.subscribers[subscriber["_id"]] = subscriber
+        elif operation == "delete":
+            self.subscribers.pop(change["documentKey"]["_id"], None)
+        elif operation in ("drop", "invalidate"):
+            self.subscribers = {}
+        self._index()
+
+    async def watch(self, stop: Optional[asyncio.Event] = None) -> None:
+        """Keeps the cache current until `stop` is set.
+
+        Args:
+            stop (Optional[asyncio.Event]): Stops watching once set.
+        """
+        stop = stop or asyncio.Event()
+        while not stop.is_set():
+            try:
+                async with self.collection.watch(
+                    full_document="updateLookup", max_await_time_ms=1000
+                ) as stream:
+                    # Changes made before the stream opened are picked up here.
+                    await self.load()
+                    while not stop.is_set():
+                        change = await stream.try_next()
+                        if change is not None:
+                            self.apply(change)
+            except OperationFailure as error:
+                log.warning(f"Change streams unavailable, polling instead: {error}")
+                await self.poll(stop)
+            except PyMongoError as error:
+                log.error(f"Subscriber change stream failed: {error}")
+                await self._sleep(stop, self.poll_interval)
+
+    async def poll(self, stop: asyncio.Event) -> None:
+        """Reloads the cache every `poll_interval` seconds until `stop` is set.
+
+        Args:
+            stop (asyncio.Event): Stops polling once set.
+        """
+        while not stop.is_set():
+            try:
+                await self.load()
+            except PyMongoError as error:
+                log.error(f"While reloading the subscribers: {error}")
+            await self._sleep(stop, self.poll_interval)
+
+    @staticmethod
+    async def _sleep(stop: asyncio.Event, seconds: float) -> None:
+        """Sleeps for `seconds`, waking up early if `stop` is set."""
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,704 @@
+"""Batched submission of FRB reports to the TNS, and polling of their replies.
+
+The TNS does not name an FRB in the response to its report: it returns a
+report ID, whose reply has to be polled until the report is processed. The
+reports submitted within `window` seconds of each other are sent in one bulk
+report, so naming a night's worth of FRBs takes one round trip, and the reply
+of each bulk report is polled with backoff. The report IDs are stored in the
+`frbvoe.tns_report` collection, so the polling resumes after a restart; the
+API keys are not stored, but looked up by bot name in `SANIC_TNS_API_KEYS`.
+A worker polls a bulk report under a lease it renews before every poll, and
+the workers claim the reports whose lease lapsed, e.g. since their worker
+restarted, so that every reply is polled by one worker only.
+The client throttles itself by the rate-limit headers of the TNS.
+
+The TNS names of internal names are looked up through a `NameCache`: the LRU
+of the worker, then the `frbvoe.tns` collection shared by the workers, then
+the TNS, with concurrent lookups of a name coalesced into one. The names are
+shared in their own collection, `frbvoe.tns_cache`, whose TTL index deletes
+them once they expire.
+"""
+
+import asyncio
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import orjson
+import picologging as logging
+from pymongo import ReturnDocument
+
+from frbvoe.utilities.breaker import CircuitBreaker
+from frbvoe.utilities.http import HTTPClient
+from frbvoe.utilities.ratelimit import RateLimiter
+
+logging.basicConfig()
+log = logging.getLogger()
+
+# API of the TNS, by whether it is the sandbox.
+URLS = {
+    True: "https://sandbox.wis-tns.org/api/",
+    False: "https://www.wis-tns.org/api/",
+}
+
+# The TNS account a report is sent with: sandbox, API key and bot name.
+Account = Tuple[bool, str, str]
+
+# Called with the references of the reports of a bulk report, e.g. the IDs of
+# their documents, and their TNS names once named.
+Named = Callable[[List[Any], List[Optional[str]]], Awaitable[Any]]
+
+
+class TNSError(RuntimeError):
+    """The TNS rejected a report."""
+
+
+def tns_name(feedback: Dict[str, Any]) -> Optional[str]:
+    """Returns the TNS name in the feedback on one report, if any.
+
+    Args:
+        feedback (Dict[str, Any]): The feedback, keyed by TNS message code.
+
+    Returns:
+        Optional[str]: The name, e.g. "FRB20210826A".
+    """
+    for message in feedback.values():
+        if isinstance(message, dict) and message.get("objname"):
+            name = str(message["objname"])
+            prefix = str(message.get("name_prefix") or "FRB")
+            return name if name.startswith(prefix) else f"{prefix}{name}"
+    return None
+
+
+def name_key(account: Account, internal_name: str) -> str:
+    """Returns the cache key of an internal name.
+
+    Args:
+        account (Account): The TNS account it is looked up with.
+        internal_name (str): The internal name, e.g. an internal ID.
+
+    Returns:
+        str: The key, distinct for the TNS and its sandbox.
+    """
+    return f"{'sandbox' if account[0] else 'tns'}:{internal_name}"
+
+
+def lapsed(now: float) -> Dict[str, Any]:
+    """Returns the filter of the bulk reports awaiting a reply without a worker.
+
+    Args:
+        now (float): Unix time.
+
+    Returns:
+        Dict[str, Any]: The MongoDB filter.
+    """
+    return {
+        "status": "submitted",
+        "$or": [{"lease": {"$lt": now}}, {"lease": {"$exists": False}}],
+    }
+
+
+def unexpired(key: str) -> Dict[str, Any]:
+    """Returns the filter of a cached TNS name, unless it expired.
+
+    Args:
+        key (str): The cache key, see `name_key`.
+
+    Returns:
+        Dict[str, Any]: The MongoDB filter.
+    """
+    return {"_id": key, "expires": {"$gt": datetime.now(timezone.utc)}}
+
+
+class RateLimit:
+    """The rate limit of the TNS, from the headers of its last response."""
+
+    def __init__(self):
+        """Initializes the limit."""
+        self.resume = 0.0
+
+    def update(self, status_code: int, headers: Any) -> None:
+        """Reads the limit from a response.
+
+        Args:
+            status_code (int): The status code of the response.
+            headers (Any): Its headers.
+        """
+        remaining = headers.get("x-rate-limit-remaining")
+        if status_code == 429 or (remaining is not None and int(remaining) <= 0):
+            reset = float(headers.get("x-rate-limit-reset") or 60.0)
+            self.resume = max(self.resume, time.monotonic() + reset)
+            log.warning(f"Throttling the TNS requests for {reset:g}s")
+
+    async def wait(self) -> None:
+        """Waits until the limit resets, if it was reached."""
+        delay = self.resume - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class TNSClient:
+    """Batches the reports of a worker into bulk reports and polls their replies.
+
+    Args:
+        client (HTTPClient): The worker's pooled HTTP client.
+        collection (Optional[AsyncIOMotorCollection]): The `tns_report`
+            collection, storing the report IDs. Defaults to None (not stored).
+        named (Optional[Named]): Called once a bulk report is named.
+        window (float): Seconds a report waits for others to be sent with.
+            Defaults to 1.
+        batch_size (int): Maximum number of reports per bulk report.
+            Defaults to 100.
+        base_backoff (float): Delay before the first poll of a reply, in
+            seconds. Defaults to 5.
+        max_backoff (float): Upper bound of the delay between polls, in
+            seconds. Defaults to 300.
+        expiry (float): Seconds after which a reply is no longer polled.
+            Defaults to a day.
+        urls (Dict[bool, str]): The API of the TNS, by whether it is the
+            sandbox. Defaults to URLS.
+        cache (Optional[NameCache]): Remembers the names of the reports.
+        limiter (Optional[RateLimiter]): Paces the requests to the quota of
+            the TNS, across workers.
+        breaker (Optional[CircuitBreaker]): Fails the requests at once while
+            the TNS is down, and times them out adaptively.
+        api_keys (Optional[Dict[str, str]]): The API keys of the TNS bots, by
+            bot name, to poll the bulk reports sent before a restart. The keys
+            of the reports sent since are remembered too.
+        lease (float): Seconds a bulk report stays with its worker after the
+            next poll is due, and between two claims of the lapsed ones.
+            Defaults to 60.
+    """
+
+    def __init__(
+        self,
+        client: HTTPClient,
+        collection=None,
+        named: Optional[Named] = None,
+        window: float = 1.0,
+        batch_size: int = 100,
+        base_backoff: float = 5.0,
+        max_backoff: float = 300.0,
+        expiry: float = 86400.0,
+        urls: Dict[bool, str] = URLS,
+        cache: Optional["NameCache"] = None,
+        limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        api_keys: Optional[Dict[str, str]] = None,
+        lease: float = 60.0,
+    ):
+        """Initializes the client."""
+        self.client = client
+        self.collection = collection
+        self.named = named
+        self.window = window
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.expiry = expiry
+        self.urls = urls
+        self.cache = cache
+        self.limiter = limiter
+        self.breaker = breaker
+        self.api_keys = dict(api_keys or {})
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self.limit = RateLimit()
+        self.pending: Dict[
+            Account, List[Tuple[Dict[str, Any], Any, asyncio.Future]]
+        ] = {}
+        self.full = asyncio.Event()
+        self.polls: Set[asyncio.Task] = set()
+
+    def submit(
+        self, account: Account, report: Dict[str, Any], reference: Any = None
+    ) -> asyncio.Future:
+        """Queues a report for the next bulk report of its account.
+
+        Args:
+            account (Account): The TNS account to send the report with.
+            report (Dict[str, Any]): The JSON-serializable FRB report.
+            reference (Any): Passed on to `named` with its TNS name, e.g. the
+                ID of its document. Defaults to None.
+
+        Returns:
+            asyncio.Future: The TNS name of the FRB, once named.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting anymore when the reply comes.
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self.pending.setdefault(account, []).append((report, reference, future))
+        if len(self.pending[account]) >= self.batch_size:
+            self.full.set()
+        return future
+
+    def backoff(self, attempts: int) -> float:
+        """Returns the delay before the next poll of a reply, with jitter.
+
+        Args:
+            attempts (int): Number of polls made so far.
+
+        Returns:
+            float: Delay in seconds.
+        """
+        ceiling = min(self.max_backoff, self.base_backoff * 2 ** max(attempts - 1, 0))
+        return random.uniform(ceiling / 2, ceiling)
+
+    async def request(
+        self, account: Account, endpoint: str, data: Dict[str, Any]
+    ) -> Tuple[int, Dict[str, Any]]:
+        """Sends a request to the TNS, waiting out its rate limit.
+
+        Args:
+            account (Account): The TNS account.
+            endpoint (str): The endpoint, e.g. "bulk-report".
+            data (Dict[str, Any]): The data of the request.
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: The status code and the JSON response.
+        """
+        sandbox, api_key, bot_name = account
+        while True:
+            await self.limit.wait()
+            if self.limiter is not None:
+                await self.limiter.acquire("tns")
+            sending = self.client.post(
+                self.urls[sandbox] + endpoint,
+                headers={"User-Agent": bot_name},
+                data={"api_key": api_key, "data": orjson.dumps(data).decode()},
+            )
+            if self.breaker is not None:
+                sending = self.breaker.call(sending)
+            response = await sending
+            self.limit.update(response.status_code, response.headers)
+            if response.status_code != 429:
+                return response.status_code, response.json()
+
+    async def search(self, account: Account, internal_name: str) -> Optional[str]:
+        """Looks up the TNS name of an internal name on the TNS.
+
+        Args:
+            account (Account): The TNS account.
+            internal_name (str): The internal name.
+
+        Returns:
+            Optional[str]: The TNS name, None if the TNS does not know it.
+
+        Raises:
+            TNSError: If the TNS did not answer the lookup.
+        """
+        status_code, response = await self.request(
+            account, "get/search", {"internal_name": internal_name}
+        )
+        if status_code != 200:
+            raise TNSError(f"{status_code}: {response.get('id_message', response)}")
+        for found in (response.get("data") or {}).get("reply") or []:
+            name = tns_name({"reply": {**found, "name_prefix": found.get("prefix")}})
+            if name:
+                return name
+        return None
+
+    async def flush(self) -> List[int]:
+        """Sends the queued reports, one bulk report per account and batch.
+
+        Returns:
+            List[int]: The IDs of the bulk reports sent.
+        """
+        sent = []
+        pending, self.pending = self.pending, {}
+        self.full.clear()
+        for account, queued in pending.items():
+            for start in range(0, len(queued), self.batch_size):
+                end = start + self.batch_size
+                reports, references, futures = zip(*queued[start:end])
+                try:
+                    document = await self.send(account, reports, references)
+                except Exception as error:
+                    log.error(
+                        f"While sending {len(reports)} reports to the TNS: {error}"
+                    )
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+                sent.append(document["_id"])
+                self.follow(document, account, list(futures))
+        return sent
+
+    async def send(
+        self,
+        account: Account,
+        reports: Sequence[Dict[str, Any]],
+        references: Sequence[Any] = (),
+    ) -> Dict[str, Any]:
+        """Sends one bulk report and stores its ID, without the API key.
+
+        Args:
+            account (Account): The TNS account.
+            reports (Sequence[Dict[str, Any]]): The FRB reports.
+            references (Sequence[Any]): Their references, see `submit`.
+
+        Returns:
+            Dict[str, Any]: The stored bulk report, keyed by its ID.
+
+        Raises:
+            TNSError: If the TNS did not accept the bulk report.
+        """
+        status_code, response = await self.request(
+            account,
+            "bulk-report",
+            {"frb_report": {str(n): report for n, report in enumerate(reports)}},
+        )
+        report_id = (response.get("data") or {}).get("report_id")
+        if status_code != 200 or report_id is None:
+            raise TNSError(f"{status_code}: {response.get('id_message', response)}")
+        log.info(f"Sent {len(reports)} reports to the TNS as report {report_id}")
+        sandbox, api_key, bot_name = account
+        self.api_keys.setdefault(bot_name, api_key)
+        document = {
+            "_id": int(report_id),
+            "account": {"sandbox": sandbox, "bot_name": bot_name},
+            "reports": list(reports),
+            "references": list(references) or [None] * len(reports),
+            "status": "submitted",
+            "attempts": 0,
+            "submitted": time.time(),
+            "owner": self.owner,
+            "lease": time.time() + self.lease,
+        }
+        if self.collection is not None:
+            await self.collection.insert_one(dict(document))
+        return document
+
+    async def reply(
+        self, account: Account, report_id: int, count: int
+    ) -> Optional[List[Optional[str]]]:
+        """Polls the reply of a bulk report.
+
+        Args:
+            account (Account): The TNS account it was sent with.
+            report_id (int): The ID of the bulk report.
+            count (int): The number of reports it holds.
+
+        Returns:
+            Optional[List[Optional[str]]]: The TNS name of each report, None
+            for those rejected, or None if the bulk report is not processed.
+
+        Raises:
+            TNSError: If the TNS rejected the whole bulk report.
+        """
+        status_code, response = await self.request(
+            account, "bulk-report-reply", {"report_id": str(report_id)}
+        )
+        if status_code == 404:
+            return None
+        feedback = ((response.get("data") or {}).get("feedback") or {}).get(
+            "frb_report", []
+        )
+        if status_code != 200 and not feedback:
+            raise TNSError(f"{status_code}: {response.get('id_message', response)}")
+        names = [tns_name(entry) for entry in feedback]
+        return (names + [None] * count)[:count]
+
+    def follow(
+        self,
+        document: Dict[str, Any],
+        account: Account,
+        futures: List[asyncio.Future],
+    ) -> None:
+        """Polls the reply of a bulk report in the background.
+
+        Args:
+            document (Dict[str, Any]): The stored bulk report.
+            account (Account): The TNS account it was sent with.
+            futures (List[asyncio.Future]): The TNS name of each report.
+        """
+        task = asyncio.ensure_future(self.poll(document, account, futures))
+        self.polls.add(task)
+        task.add_done_callback(self.polls.discard)
+
+    async def poll(
+        self,
+        document: Dict[str, Any],
+        account: Account,
+        futures: List[asyncio.Future],
+    ):
+        """Polls the reply of a bulk report until it is named or expires.
+
+        Args:
+            document (Dict[str, Any]): The stored bulk report.
+            account (Account): The TNS account it was sent with.
+            futures (List[asyncio.Future]): The TNS name of each report.
+        """
+        reports = document["reports"]
+        attempts = document.get("attempts", 0)
+        names, error = None, None
+        while time.time() < document["submitted"] + self.expiry:
+            delay = self.backoff(attempts + 1)
+            if not await self.renew(document, attempts, delay):
+                log.info(f"TNS report {document['_id']} is polled by another worker")
+                return
+            await asyncio.sleep(delay)
+            attempts += 1
+            try:
+                names = await self.reply(account, document["_id"], len(reports))
+            except TNSError as rejected:
+                error = rejected
+                break
+            except Exception as failure:
+                log.warning(f"While polling TNS report {document['_id']}: {failure}")
+                continue
+            if names is not None:
+                break
+        else:
+            error = TNSError(f"TNS report {document['_id']} expired.")
+        if names is not None and self.named is not None:
+            try:
+                await self.named(document["references"], names)
+            except Exception as failure:
+                log.error(f"While saving the names of TNS report: {failure}")
+        if names is not None and self.cache is not None:
+            for report, name in zip(reports, names):
+                if name and report.get("internal_id"):
+                    await self.cache.put(account, report["internal_id"], name)
+        if self.collection is not None:
+            await self.collection.update_one(
+                {"_id": document["_id"], "owner": self.owner},
+                {
+                    "$set": {
+                        "status": "named" if names is not None else "failed",
+                        "attempts": attempts,
+                        "names": names,
+                        "error": str(error) if error else None,
+                    }
+                },
+            )
+        log.info(f"TNS report {document['_id']}: {names or error}")
+        for n, future in enumerate(futures):
+            if future.done():
+                continue
+            if names is None:
+                future.set_exception(error or TNSError("No reply."))
+            elif names[n] is None:
+                future.set_exception(TNSError("The TNS rejected the report."))
+            else:
+                future.set_result(names[n])
+
+    async def renew(
+        self, document: Dict[str, Any], attempts: int, delay: float
+    ) -> bool:
+        """Extends the lease of the worker on a bulk report before a poll.
+
+        Args:
+            document (Dict[str, Any]): The stored bulk report.
+            attempts (int): Number of polls made so far.
+            delay (float): Seconds until the next poll.
+
+        Returns:
+            bool: False if another worker claimed the bulk report.
+        """
+        if self.collection is None:
+            return True
+        try:
+            result = await self.collection.update_one(
+                {"_id": document["_id"], "owner": self.owner},
+                {
+                    "$set": {
+                        "attempts": attempts,
+                        "lease": time.time() + delay + self.lease,
+                    }
+                },
+            )
+        except Exception as error:
+            log.warning(f"While renewing TNS report {document['_id']}: {error}")
+            return True
+        return result.matched_count > 0
+
+    async def resume(self) -> int:
+        """Claims the bulk reports whose lease lapsed, and polls their replies.
+
+        Returns:
+            int: The number of bulk reports resumed.
+        """
+        if self.collection is None:
+            return 0
+        resumed, seen = 0, set()
+        while True:
+            now = time.time()
+            # Only one worker's update matches a lapsed lease.
+            document = await self.collection.find_one_and_update(
+                lapsed(now),
+                {"$set": {"owner": self.owner, "lease": now + self.lease}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if document is None or document["_id"] in seen:
+                return resumed
+            seen.add(document["_id"])
+            stored = document["account"]
+            api_key = self.api_keys.get(stored["bot_name"])
+            if api_key is None:
+                # Left to a worker with the key once the lease lapses.
+                log.error(
+                    f"Not polling TNS report {document['_id']}: no API key for "
+                    f"the bot {stored['bot_name']} in SANIC_TNS_API_KEYS"
+                )
+                continue
+            account = (stored["sandbox"], api_key, stored["bot_name"])
+            self.follow(document, account, [])
+            resumed += 1
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Sends the queued reports every `window` seconds until `stop` is set.
+
+        Args:
+            stop (asyncio.Event): Stops the client once set.
+        """
+        claimed = -math.inf
+        while not stop.is_set():
+            if time.monotonic() - claimed >= self.lease:
+                claimed = time.monotonic()
+                try:
+                    resumed = await self.resume()
+                    if resumed:
+                        log.info(f"Resumed polling {resumed} TNS reports")
+                except Exception as error:
+                    log.error(f"While resuming the TNS reports: {error}")
+            try:
+                await asyncio.wait_for(self.full.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as error:
+                log.exception(f"While sending the TNS reports: {error}")
+        # The replies of the last reports are polled after the restart.
+        await self.flush()
+        for task in list(self.polls):
+            task.cancel()
+
+
+class NameCache:
+    """Cache of the TNS names of internal names, with single-flight lookups.
+
+    Names are cached for `ttl` seconds, and internal names the TNS does not
+    know for `negative_ttl` seconds, first in the LRU of the worker then in
+    the `frbvoe.tns_cache` collection, under their cache key.
+
+    Args:
+        lookup (Callable[[Account, str], Awaitable[Optional[str]]]): Looks up
+            a name on the TNS, e.g. `TNSClient.search`.
+        collection (Optional[AsyncIOMotorCollection]): The `tns_cache`
+            collection. Defaults to None (the LRU only).
+        size (int): The number of names in the LRU. Defaults to 10000.
+        ttl (float): Seconds a name is cached. Defaults to a week.
+        negative_ttl (float): Seconds an unknown name is cached.
+            Defaults to 10 minutes.
+
+    Attributes:
+        metrics (Dict[str, int]): Lookups answered by the LRU (`hits`), by
+            MongoDB (`stored`), by the TNS (`misses`), and lookups that waited
+            for the same one in flight (`coalesced`).
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[Account, str], Awaitable[Optional[str]]],
+        collection=None,
+        size: int = 10_000,
+        ttl: float = 7 * 86400.0,
+        negative_ttl: float = 600.0,
+    ):
+        """Initializes the cache."""
+        self.lookup = lookup
+        self.collection = collection
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.names: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.metrics = {"hits": 0, "stored": 0, "misses": 0, "coalesced": 0}
+
+    def remember(self, key: str, name: Optional[str], expires: float) -> None:
+        """Adds a name to the LRU, evicting the least recent.
+
+        Args:
+            key (str): The cache key, see `name_key`.
+            name (Optional[str]): The TNS name, None if unknown.
+            expires (float): When it expires, as a UNIX time.
+        """
+        self.names[key] = (name, expires)
+        self.names.move_to_end(key)
+        while len(self.names) > self.size:
+            self.names.popitem(last=False)
+
+    async def put(self, account: Account, internal_name: str, name: Optional[str]):
+        """Caches the TNS name of an internal name, e.g. once a report is named.
+
+        Args:
+            account (Account): The TNS account.
+            internal_name (str): The internal name.
+            name (Optional[str]): The TNS name, None if unknown.
+        """
+        key = name_key(account, internal_name)
+        expires = time.time() + (self.ttl if name else self.negative_ttl)
+        self.remember(key, name, expires)
+        if self.collection is not None:
+            await self.collection.update_one(
+                {"_id": key},
+                {
+                    "$set": {
+                        "internal_id": internal_name,
+                        "tns_name": name,
+                        # A date, for the TTL index.
+                        "expires": datetime.fromtimestamp(expires, timezone.utc),
+                    }
+                },
+                upsert=True,
+            )
+
+    async def get(self, account: Account, internal_name: str) -> Optional[str]:
+        """Returns the TNS name of an internal name.
+
+        Args:
+            account (Account): The TNS account to look it up with.
+            internal_name (str): The internal name.
+
+        Returns:
+            Optional[str]: The TNS name, None if the TNS does not know it.
+        """
+        key = name_key(account, internal_name)
+        cached = self.names.get(key)
+        if cached is not None and cached[1] > time.time():
+            self.names.move_to_end(key)
+            self.metrics["hits"] += 1
+            return cached[0]
+        if key in self.in_flight:
+            self.metrics["coalesced"] += 1
+        else:
+            # Shared by the concurrent lookups, and not cancelled with any.
+            task = asyncio.ensure_future(self.load(account, internal_name, key))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(self.in_flight[key])
+
+    async def load(
+        self, account: Account, internal_name: str, key: str
+    ) -> Optional[str]:
+        """Loads a name missing from the LRU, from MongoDB or else the TNS."""
+        if self.collection is not None:
+            # The TTL monitor deletes the expired names only once a minute.
+            document = await self.collection.find_one(unexpired(key))
+            if document is not None:
+                self.metrics["stored"] += 1
+                # Dates are read back without their UTC timezone.
+                expires = document["expires"].replace(tzinfo=timezone.utc)
+                self.remember(key, document["tns_name"], expires.timestamp())
+                return document["tns_name"]
+        self.metrics["misses"] += 1
+        name = await self.lookup(account, internal_name)
+        await self.put(account, internal_name, name)
+        return name
@@ -0,0 +1,445 @@
+"""Tracing of every alert, from its detection time to its broadcasts.
+
+Each VOEvent received gets a trace: a root span for the request and child
+spans for receiving, validating, associating, serializing, each sink and the
+insert. The spans known before the VOEvent is archived are stored on its
+document, as `trace`, together with the detection time (`VOEvent.date`). The
+spans that end later, e.g. the broadcasts sent by the outbox workers, are
+buffered and pushed onto the document in bulk by a background task, which
+also exports every span in the OTLP/JSON format to a file (one request per
+line, as read by the collector's `otlpjsonfile` receiver) or to a collector.
+
+All times are Unix epoch nanoseconds.
+"""
+
+import asyncio
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import numpy as np
+import orjson
+import picologging as logging
+from pymongo import UpdateOne
+
+logging.basicConfig()
+log = logging.getLogger()
+
+T = TypeVar("T")
+
+# Key of the trace context in the queued payloads.
+TRACE = "trace"
+
+# Sinks whose spans end a broadcast.
+BROADCASTS = ("comet", "email")
+
+# Flushes a buffered span may wait for its document to be archived.
+ATTEMPTS = 3
+
+SERVICE = "frbvoe"
+
+# OTLP requests kept for the collector while it is unreachable.
+MAX_UNSENT = 10000
+
+
+def _id(size: int) -> str:
+    """Returns a random hex identifier of `size` bytes."""
+    return os.urandom(size).hex()
+
+
+def detection_time(date: Optional[str]) -> Optional[int]:
+    """Returns the Unix time of a VOEvent date, read as UTC if naive.
+
+    Args:
+        date (Optional[str]): The date, e.g. "2020-01-13 16:55:08.844845".
+
+    Returns:
+        Optional[int]: Nanoseconds since the epoch, None if invalid.
+    """
+    try:
+        detected = datetime.fromisoformat(date)
+    except (TypeError, ValueError):
+        return None
+    if detected.tzinfo is None:
+        detected = detected.replace(tzinfo=timezone.utc)
+    return int(detected.timestamp() * 1e6) * 1000
+
+
+def span(
+    name: str,
+    start: int,
+    end: Optional[int] = None,
+    ok: bool = True,
+    span_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Returns an ended span.
+
+    Args:
+        name (str): The span name, e.g. "validate" or "comet".
+        start (int): Its start time.
+        end (Optional[int]): Its end time. Defaults to now.
+        ok (bool): Whether it succeeded. Defaults to True.
+        span_id (Optional[str]): Its 8-byte ID, in hex. Defaults to a new one.
+
+    Returns:
+        Dict[str, Any]: The span.
+    """
+    return {
+        "name": name,
+        "span_id": span_id or _id(8),
+        "start": start,
+        "end": end or time.time_ns(),
+        "status": "ok" if ok else "error",
+    }
+
+
+class Trace:
+    """The spans of one alert.
+
+    Args:
+        date (Optional[str]): The detection time of the VOEvent.
+        received (Optional[int]): When the request arrived. Defaults to now.
+
+    Attributes:
+        trace_id (str): The 16-byte trace ID, in hex.
+        root (str): The 8-byte ID of the root span, the parent of the others.
+        spans (List[Dict[str, Any]]): The spans ended so far.
+    """
+
+    def __init__(self, date: Optional[str] = None, received: Optional[int] = None):
+        """Starts the trace."""
+        self.trace_id = _id(16)
+        self.root = _id(8)
+        self.detected = detection_time(date)
+        self.received = received or time.time_ns()
+        self.spans: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Adds a span around a block, failed if the block raises."""
+        start = time.time_ns()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.spans.append(span(name, start, ok=ok))
+
+    def context(self) -> Dict[str, Any]:
+        """Returns what identifies the trace, e.g. in a queued payload."""
+        return {
+            "trace_id": self.trace_id,
+            "root": self.root,
+            "detected": self.detected,
+        }
+
+    def document(self) -> Dict[str, Any]:
+        """Returns the trace stored on the VOEvent document."""
+        return {**self.context(), "received": self.received, "spans": list(self.spans)}
+
+
+def otlp(trace: Dict[str, Any], spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Returns spans of a trace as an OTLP/JSON export request.
+
+    Args:
+        trace (Dict[str, Any]): The `trace_id`, `root` span ID and `detected`
+            time of the trace.
+        spans (List[Dict[str, Any]]): The spans; the one whose ID is `root` is
+            the root span.
+
+    Returns:
+        Dict[str, Any]: The ExportTraceServiceRequest.
+    """
+    attributes = []
+    if trace.get("detected") is not None:
+        attributes.append(
+            {
+                "key": "frbvoe.detection_time_unix_nano",
+                "value": {"intValue": str(trace["detected"])},
+            }
+        )
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": SERVICE}}
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": SERVICE},
+                        "spans": [
+                            {
+                                "traceId": trace["trace_id"],
+                                "spanId": span["span_id"],
+                                **(
+                                    {}
+                                    if span["span_id"] == trace["root"]
+                                    else {"parentSpanId": trace["root"]}
+                                ),
+                                "name": span["name"],
+                                "kind": 1,
+                                "startTimeUnixNano": str(span["start"]),
+                                "endTimeUnixNano": str(span["end"]),
+                                "status": {"code": 1 if span["status"] == "ok" else 2},
+                                "attributes": attributes,
+                            }
+                            for span in spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+class Tracer:
+    """Stores the spans ended after their VOEvent was archived, and exports.
+
+    Spans are buffered, and pushed onto their documents and exported in bulk
+    by `run`, so tracing an alert costs it a few dictionary appends.
+
+    Args:
+        collection (Optional[AsyncIOMotorCollection]): The VOEvent collection
+            the spans are pushed onto. Defaults to None (not stored).
+        path (Optional[Path]): File the OTLP/JSON requests are appended to.
+        endpoint (Optional[str]): Base URL of an OTLP/HTTP collector, e.g.
+            "http://localhost:4318".
+        client (Optional[HTTPClient]): The worker's pooled HTTP client, needed
+            with `endpoint`.
+        max_unsent (int): OTLP requests kept for the collector while it is
+            unreachable; the oldest are dropped beyond. Defaults to MAX_UNSENT.
+    """
+
+    def __init__(
+        self,
+        collection=None,
+        path: Optional[Path] = None,
+        endpoint: Optional[str] = None,
+        client=None,
+        max_unsent: int = MAX_UNSENT,
+    ):
+        """Initializes the tracer."""
+        self.collection = collection
+        self.path = Path(path) if path else None
+        self.endpoint = endpoint.rstrip("/") if endpoint else None
+        self.client = client
+        # Spans to push onto the documents by trace ID, and failed attempts.
+        self.pending: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.attempts: Dict[str, int] = defaultdict(int)
+        # OTLP requests to export, and those the collector has yet to accept.
+        self.exports: List[Dict[str, Any]] = []
+        self.unsent: List[Dict[str, Any]] = []
+        self.max_unsent = max_unsent
+        # OTLP requests dropped while the collector was unreachable.
+        self.metrics = {"dropped": 0}
+
+    def record(
+        self, trace: Dict[str, Any], spans: List[Dict[str, Any]], store: bool = True
+    ) -> None:
+        """Buffers spans of a trace.
+
+        Args:
+            trace (Dict[str, Any]): The context of the trace, see
+                `Trace.context`.
+            spans (List[Dict[str, Any]]): The spans.
+            store (bool): Whether to push them onto the document; False for
+                the spans archived with it. Defaults to True.
+        """
+        if store and self.collection is not None:
+            self.pending[trace["trace_id"]].extend(spans)
+        if self.path or self.endpoint:
+            self.exports.append(otlp(trace, spans))
+
+    async def timed(self, trace: Trace, name: str, awaitable: Awaitable[T]) -> T:
+        """Awaits an awaitable, recording its span even if it fails.
+
+        Args:
+            trace (Trace): The trace.
+            name (str): The span name.
+            awaitable (Awaitable[T]): The awaitable.
+
+        Returns:
+            T: Its result.
+        """
+        start = time.time_ns()
+        ok = False
+        try:
+            result = await awaitable
+            ok = True
+            return result
+        finally:
+            self.record(trace.context(), [span(name, start, ok=ok)])
+
+    async def flush(self) -> None:
+        """Pushes the buffered spans onto their documents and exports."""
+        pending, self.pending = self.pending, defaultdict(list)
+        if pending:
+            await self._store(pending)
+        exports, self.exports = self.exports, []
+        if self.endpoint:
+            self.unsent.extend(exports)
+        if self.path and exports:
+            await asyncio.to_thread(self._append, exports)
+        if self.endpoint and self.unsent:
+            await self._post()
+
+    def _append(self, exports: List[Dict[str, Any]]) -> None:
+        """Appends OTLP requests to the file, one per line."""
+        with open(self.path, "ab") as file:
+            file.write(
+                b"".join(
+                    orjson.dumps(export, option=orjson.OPT_APPEND_NEWLINE)
+                    for export in exports
+                )
+            )
+
+    async def _post(self) -> None:
+        """Posts the unsent OTLP requests, keeping them for the next flush."""
+        unsent, self.unsent = self.unsent, []
+        try:
+            response = await self.client.post(
+                f"{self.endpoint}/v1/traces",
+                json={
+                    "resourceSpans": [
+                        resource
+                        for export in unsent
+                        for resource in export["resourceSpans"]
+                    ]
+                },
+            )
+            response.raise_for_status()
+        except Exception:
+            unsent.extend(self.unsent)
+            dropped = max(len(unsent) - self.max_unsent, 0)
+            self.unsent = unsent[dropped:]
+            if dropped:
+                self.metrics["dropped"] += dropped
+                log.warning(f"Dropped {dropped} OTLP requests for the collector")
+            raise
+
+    async def _store(self, pending: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Pushes spans onto their documents, keeping those not archived yet."""
+        trace_ids = list(pending)
+        result = await self.collection.bulk_write(
+            [
+                UpdateOne(
+                    {"trace.trace_id": trace_id},
+                    {"$push": {"trace.spans": {"$each": pending[trace_id]}}},
+                )
+                for trace_id in trace_ids
+            ],
+            ordered=False,
+        )
+        if result.matched_count == len(trace_ids):
+            for trace_id in trace_ids:
+                self.attempts.pop(trace_id, None)
+            return
+        # Some documents are not archived yet; retry those on the next flush.
+        found = {
+            document["trace"]["trace_id"]
+            async for document in self.collection.find(
+                {"trace.trace_id": {"$in": trace_ids}}, {"trace.trace_id": 1}
+            )
+        }
+        for trace_id in trace_ids:
+            if trace_id in found:
+                self.attempts.pop(trace_id, None)
+                continue
+            self.attempts[trace_id] += 1
+            if self.attempts[trace_id] < ATTEMPTS:
+                self.pending[trace_id].extend(pending[trace_id])
+            else:
+                self.attempts.pop(trace_id)
+                log.warning(f"Dropped the spans of trace {trace_id}")
+
+    async def run(self, stop: asyncio.Event, interval: float = 1.0) -> None:
+        """Flushes every `interval` seconds until `stop` is set, then once more.
+
+        Args:
+            stop (asyncio.Event): Stops the task once set.
+            interval (float): Seconds between flushes. Defaults to 1.
+        """
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as error:
+                log.error(f"While flushing the traces: {error}")
+
+
+def _latency(sink: str) -> Dict[str, Any]:
+    """Returns the expression of the broadcast latency of a sink, in seconds."""
+    spans = {
+        "$filter": {
+            "input": "$trace.spans",
+            "cond": {
+                "$and": [
+                    {"$eq": ["$$this.name", sink]},
+                    {"$eq": ["$$this.status", "ok"]},
+                ]
+            },
+        }
+    }
+    sent = {"$min": {"$map": {"input": spans, "in": "$$this.end"}}}
+    return {"$divide": [{"$subtract": [sent, "$trace.detected"]}, 1e9]}
+
+
+def latency_pipeline(query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns the aggregation of the broadcast latencies of the VOEvents.
+
+    Args:
+        query (Dict[str, Any]): Filter of the VOEvents, e.g. on `date`.
+
+    Returns:
+        List[Dict[str, Any]]: The pipeline, yielding one document per traced
+        VOEvent with the latency, in seconds, from its detection to the end of
+        its first successful broadcast to each of `BROADCASTS`, or None.
+    """
+    return [
+        {"$match": {**query, "trace.detected": {"$type": "number"}}},
+        {"$project": {"_id": 0, **{sink: _latency(sink) for sink in BROADCASTS}}},
+    ]
+
+
+def latency_report(
+    rows: List[Dict[str, Optional[float]]],
+    percentiles: Tuple[int, ...] = (50, 95, 99),
+) -> Dict[str, Dict[str, Any]]:
+    """Summarizes the broadcast latencies of the VOEvents.
+
+    Args:
+        rows (List[Dict[str, Optional[float]]]): The latencies of each
+            VOEvent, from `latency_pipeline`.
+        percentiles (Tuple[int, ...]): The percentiles. Defaults to (50, 95, 99).
+
+    Returns:
+        Dict[str, Dict[str, Any]]: For each sink, and for the first broadcast
+        of each VOEvent as `any`, the `count` of VOEvents and the
+        percentiles of their latency in seconds, e.g. `p95`.
+    """
+    latencies = {sink: [] for sink in (*BROADCASTS, "any")}
+    for row in rows:
+        sent = [row[sink] for sink in BROADCASTS if row.get(sink) is not None]
+        for sink in BROADCASTS:
+            if row.get(sink) is not None:
+                latencies[sink].append(row[sink])
+        if sent:
+            latencies["any"].append(min(sent))
+    report = {}
+    for sink, values in latencies.items():
+        report[sink] = {"count": len(values)}
+        if values:
+            points = np.percentile(values, percentiles)
+            report[sink].update(
+                {f"p{p}": float(point) for p, point in zip(percentiles, points)}
+            )
+    return report
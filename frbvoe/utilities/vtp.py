@@ -0,0 +1,321 @@
+"""Built-in VOEvent Transport Protocol broker, in place of a Comet container.
+
+Without it, the workers POST every VOEvent to a separate Comet process, which
+broadcasts it to its subscribers over VTP. With `SANIC_VTP_PORT` set, the
+server runs the broadcaster itself, in a process managed by Sanic: the main
+process creates a queue, the workers put the XML of their VOEvents on it, and
+the broker process writes them to the connected subscribers.
+
+VTP messages are UTF-8 XML documents, each preceded by its length as a 4-byte
+big-endian integer. The broker sends the VOEvents and, every `interval`
+seconds, an `iamalive` Transport message, which the subscribers answer;
+they acknowledge the VOEvents with `ack` (or `nak`) Transport messages. A
+subscriber silent for several intervals, or too slow to take its messages,
+is disconnected.
+"""
+
+import asyncio
+import queue
+import signal
+import struct
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import picologging as logging
+
+logging.basicConfig()
+log = logging.getLogger()
+
+TRANSPORT = "http://telescope-networks.org/schema/Transport/v1.1"
+
+# Default port of the VTP broadcasters, as served by Comet.
+PORT = 8099
+
+# Messages longer than this are refused, in bytes.
+MAX_SIZE = 1 << 20
+
+# Seconds the broker waits on its queue before checking whether to stop.
+POLL = 1.0
+
+_LENGTH = struct.Struct("!I")
+
+
+def frame(message: bytes) -> bytes:
+    """Returns a VTP message, prefixed with its length.
+
+    Args:
+        message (bytes): The XML document.
+
+    Returns:
+        bytes: The framed message.
+    """
+    return _LENGTH.pack(len(message)) + message
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    """Reads a VTP message.
+
+    Args:
+        reader (asyncio.StreamReader): The connection.
+
+    Returns:
+        bytes: The XML document.
+
+    Raises:
+        asyncio.IncompleteReadError: If the connection was closed.
+        ValueError: If the message is longer than MAX_SIZE.
+    """
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    if length > MAX_SIZE:
+        raise ValueError(f"The VTP message of {length} bytes is too long.")
+    return await reader.readexactly(length)
+
+
+def transport(role: str, origin: str, response: Optional[str] = None) -> bytes:
+    """Returns a Transport message, e.g. an iamalive.
+
+    Args:
+        role (str): Its role: "iamalive", "ack" or "nak".
+        origin (str): The IVORN of the party that originated the exchange.
+        response (Optional[str]): The IVORN of the party responding to it.
+
+    Returns:
+        bytes: The XML document.
+    """
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    reply = f"  <Response>{escape(response)}</Response>\n" if response else ""
+    return (
+        "<?xml version='1.0' encoding='UTF-8'?>\n"
+        f'<trn:Transport xmlns:trn="{TRANSPORT}" version="1.1" role="{role}">\n'
+        f"  <Origin>{escape(origin)}</Origin>\n"
+        f"{reply}"
+        f"  <TimeStamp>{timestamp}</TimeStamp>\n"
+        "</trn:Transport>\n"
+    ).encode()
+
+
+def parse(message: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Returns the role and origin of a Transport message.
+
+    Args:
+        message (bytes): The XML document.
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: The role and origin, None if the
+            message is not a Transport message.
+    """
+    root = ElementTree.fromstring(message)
+    if root.tag != f"{{{TRANSPORT}}}Transport":
+        return None, None
+    return root.get("role"), root.findtext("Origin")
+
+
+class Broker:
+    """Broadcasts VOEvents to the subscribers connected over VTP.
+
+    Args:
+        local_ivo (str): The IVORN of the broker, in its iamalive messages.
+        interval (float): Seconds between two iamalive messages.
+            Defaults to 60.
+        silence (float): Intervals a subscriber may stay silent before being
+            disconnected. Defaults to 3.
+        write_timeout (float): Seconds a subscriber may take to receive a
+            message before being disconnected. Defaults to 5.
+
+    Attributes:
+        subscribers (Dict[asyncio.StreamWriter, float]): The connected
+            subscribers, with when each was last heard from.
+        sent (int): VOEvents broadcast.
+    """
+
+    def __init__(
+        self,
+        local_ivo: str,
+        interval: float = 60.0,
+        silence: float = 3.0,
+        write_timeout: float = 5.0,
+    ):
+        """Initializes the broker, without subscribers."""
+        self.local_ivo = local_ivo
+        self.interval = interval
+        self.silence = silence
+        self.write_timeout = write_timeout
+        self.subscribers: Dict[asyncio.StreamWriter, float] = {}
+        self.sent = 0
+
+    def drop(self, writer: asyncio.StreamWriter, reason: str) -> None:
+        """Disconnects a subscriber.
+
+        Args:
+            writer (asyncio.StreamWriter): Its connection.
+            reason (str): Why, for the logs.
+        """
+        if self.subscribers.pop(writer, None) is not None:
+            log.info(f"VTP subscriber {writer.get_extra_info('peername')} {reason}")
+        writer.close()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serves a subscriber until it disconnects.
+
+        Args:
+            reader (asyncio.StreamReader): Its connection.
+            writer (asyncio.StreamWriter): Its connection.
+        """
+        log.info(f"VTP subscriber {writer.get_extra_info('peername')} connected")
+        self.subscribers[writer] = time.monotonic()
+        reason = "disconnected"
+        try:
+            while True:
+                role, origin = parse(await read_message(reader))
+                if writer in self.subscribers:
+                    self.subscribers[writer] = time.monotonic()
+                if role == "nak":
+                    log.warning(f"VTP subscriber refused {origin}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (ValueError, ElementTree.ParseError) as error:
+            reason = f"sent an invalid message: {error}"
+        finally:
+            self.drop(writer, reason)
+
+    async def send(self, writer: asyncio.StreamWriter, message: bytes) -> bool:
+        """Writes a framed message to a subscriber.
+
+        Args:
+            writer (asyncio.StreamWriter): Its connection.
+            message (bytes): The framed message.
+
+        Returns:
+            bool: Whether the subscriber took it in time.
+        """
+        try:
+            writer.write(message)
+            await asyncio.wait_for(writer.drain(), timeout=self.write_timeout)
+            return True
+        except (asyncio.TimeoutError, ConnectionError) as error:
+            self.drop(writer, f"dropped: {error!r}")
+            return False
+
+    async def broadcast(self, voevent: bytes) -> int:
+        """Sends a VOEvent to every subscriber.
+
+        The writes start in the order of the broadcasts, so every subscriber
+        receives the VOEvents in that order.
+
+        Args:
+            voevent (bytes): The XML of the VOEvent.
+
+        Returns:
+            int: The number of subscribers that took it.
+        """
+        message = frame(voevent)
+        sent = await asyncio.gather(
+            *(self.send(writer, message) for writer in list(self.subscribers))
+        )
+        self.sent += 1
+        return sum(sent)
+
+    async def alive(self, stop: asyncio.Event) -> None:
+        """Sends the iamalive messages, and drops the silent subscribers.
+
+        Args:
+            stop (asyncio.Event): Set to stop.
+        """
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            deadline = time.monotonic() - self.silence * self.interval
+            for writer, heard in list(self.subscribers.items()):
+                if heard < deadline:
+                    self.drop(writer, "dropped: silent")
+            message = frame(transport("iamalive", self.local_ivo))
+            await asyncio.gather(
+                *(self.send(writer, message) for writer in list(self.subscribers))
+            )
+
+    async def serve(self, host: str, port: int, stop: asyncio.Event) -> None:
+        """Serves the subscribers until asked to stop.
+
+        Args:
+            host (str): The address to listen at.
+            port (int): The port to listen at.
+            stop (asyncio.Event): Set to stop.
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info(f"Broadcasting the VOEvents over VTP at {host}:{port}")
+        async with server:
+            await self.alive(stop)
+        for writer in list(self.subscribers):
+            self.drop(writer, "disconnected: the broker stopped")
+
+
+def publish(voevents: Any, voevent: str) -> bool:
+    """Hands the XML of a VOEvent to the broker process, from a worker.
+
+    Args:
+        voevents (multiprocessing.Queue): The queue of the broker.
+        voevent (str): The XML of the VOEvent.
+
+    Returns:
+        bool: False if the queue is full, e.g. since the broker is down.
+    """
+    try:
+        voevents.put_nowait(voevent.encode())
+    except queue.Full:
+        log.error("The queue of the VTP broker is full.")
+        return False
+    return True
+
+
+def run_broker(voevents: Any, host: str, port: int, **options: Any) -> None:
+    """Runs the broker, in the process Sanic manages for it.
+
+    Args:
+        voevents (multiprocessing.Queue): The XML of the VOEvents to broadcast,
+            put by the workers.
+        host (str): The address to listen at.
+        port (int): The port to listen at.
+        **options (Any): Passed on to `Broker`.
+    """
+
+    async def run() -> None:
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        broker = Broker(**options)
+
+        def pump() -> None:
+            # Blocking reads, off the event loop; the broadcasts keep the
+            # order of the queue.
+            try:
+                while not stop.is_set():
+                    try:
+                        voevent = voevents.get(timeout=POLL)
+                    except queue.Empty:
+                        continue
+                    asyncio.run_coroutine_threadsafe(broker.broadcast(voevent), loop)
+            except Exception as error:
+                log.error(f"While reading the queue of the VTP broker: {error}")
+                # Without its queue, the broker would serve nothing.
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(stop.set)
+            log.info("Stopped reading the queue of the VTP broker.")
+
+        reader = threading.Thread(target=pump, name="vtp-queue", daemon=True)
+        reader.start()
+        try:
+            await broker.serve(host, port, stop)
+        finally:
+            stop.set()
+            await asyncio.to_thread(reader.join)
+
+    asyncio.run(run())
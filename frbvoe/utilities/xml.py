@@ -0,0 +1,317 @@
+"""VOEvent 2.0 XML serialization with templates precompiled per kind.
+
+Each template is a list of static strings and slots built once per kind at
+import time, and flattened into a single format string per combination of
+optional fields. Serializing an event is then one string formatting, so
+serializing thousands of events never builds a DOM.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+NAMESPACE = "http://www.ivoa.net/xml/VOEvent/v2.0"
+
+# Citation type of every kind of VOEvent that refers to an earlier event.
+CITES = {"subsequent": "followup", "retraction": "retraction", "update": "supersedes"}
+KINDS = {cite: kind for kind, cite in CITES.items()}
+
+# What parameters: (field, unit, ucd)
+OBSERVATORY_PARAMS = [
+    ("sampling_time", "s", "time.resolution"),
+    ("bandwidth", "MHz", "instr.bandwidth"),
+    ("central_frequency", "MHz", "em.freq;instr"),
+    ("npol", "", "meta.number"),
+    ("bits_per_sample", "", "meta.number"),
+    ("gain", "dB", "instr.param"),
+    ("tsys", "K", "phot.antennaTemp"),
+]
+EVENT_PARAMS = [
+    ("internal_id", "", "meta.id"),
+    ("tns_name", "", "meta.id"),
+    ("dm", "pc/cm^3", "phys.dispMeasure"),
+    ("dm_error", "pc/cm^3", "stat.error;phys.dispMeasure"),
+    ("width", "s", "time.duration;src.var.pulse"),
+    ("snr", "", "stat.snr"),
+    ("flux", "Jy", "phot.flux"),
+    ("semi_major", "deg", "phys.angSize.smajAxis;pos.errorEllipse"),
+    ("semi_minor", "deg", "phys.angSize.sminAxis;pos.errorEllipse"),
+]
+
+
+def _escape(value: str) -> str:
+    """Escapes a string for use in XML text and double-quoted attributes."""
+    return (
+        value.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+    )
+
+
+class Slot:
+    """A part of a template filled from the event's values.
+
+    The slot renders to nothing unless every one of its fields is set.
+
+    Args:
+        fields (Tuple[str, ...]): Names of the values substituted, in order.
+        fmt (str): %-format string with one `%s` per field.
+        when (Tuple[str, ...]): Names of further values that must be set.
+    """
+
+    __slots__ = ("fields", "fmt", "when")
+
+    def __init__(self, fields: Tuple[str, ...], fmt: str, when: Tuple[str, ...] = ()):
+        """Initializes the slot."""
+        self.fields = fields
+        self.fmt = fmt
+        self.when = when
+
+
+Chunk = Union[str, Slot]
+
+
+def _param(field: str, unit: str, ucd: str) -> Slot:
+    """Returns the slot of a What parameter."""
+    unit = f' unit="{escape(unit)}"' if unit else ""
+    return Slot(
+        (field,), f'      <Param name="{field}" value="%s"{unit} ucd="{ucd}"/>\n'
+    )
+
+
+def _compile(kind: str) -> List[Chunk]:
+    """Builds the template of a kind of VOEvent.
+
+    Args:
+        kind (str): Which kind of VOEvent.
+
+    Returns:
+        List[Chunk]: Static strings and slots, in document order.
+    """
+    observation = kind in ("detection", "subsequent")
+    chunks: List[Chunk] = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<voe:VOEvent xmlns:voe="{NAMESPACE}" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        f'xsi:schemaLocation="{NAMESPACE} '
+        'http://www.ivoa.net/xml/VOEvent/VOEvent-v2.0.xsd" '
+        'version="2.0" role="observation" ',
+        Slot(("ivorn",), 'ivorn="%s">\n'),
+        "  <Who>\n",
+        Slot(("author_ivorn",), "    <AuthorIVORN>%s</AuthorIVORN>\n"),
+        Slot(("iso_date",), "    <Date>%s</Date>\n"),
+        "    <Author>\n",
+        Slot(("observatory_name",), "      <shortName>%s</shortName>\n"),
+        Slot(("email",), "      <contactEmail>%s</contactEmail>\n"),
+        "    </Author>\n  </Who>\n  <What>\n",
+        Slot(("kind",), '    <Param name="kind" value="%s" ucd="meta.code"/>\n'),
+    ]
+    if observation:
+        chunks.append('    <Group name="observatory parameters">\n')
+        chunks.extend(_param(*param) for param in OBSERVATORY_PARAMS)
+        chunks.append('    </Group>\n    <Group name="event parameters">\n')
+        chunks.extend(_param(*param) for param in EVENT_PARAMS)
+        chunks.append("    </Group>\n")
+    else:
+        chunks.append('    <Group name="event parameters">\n')
+        chunks.extend(_param(*param) for param in EVENT_PARAMS[:2])
+        chunks.append("    </Group>\n")
+    chunks += [
+        "  </What>\n  <WhereWhen>\n    <ObsDataLocation>\n"
+        '      <ObservatoryLocation id="GEOLUN"/>\n'
+        "      <ObservationLocation>\n"
+        '        <AstroCoordSystem id="UTC-FK5-GEO"/>\n'
+        '        <AstroCoords coord_system_id="UTC-FK5-GEO">\n',
+        Slot(
+            ("iso_date",),
+            '          <Time unit="s"><TimeInstant><ISOTime>%s</ISOTime>'
+            "</TimeInstant></Time>\n",
+        ),
+        Slot(
+            ("right_ascension", "declination"),
+            '          <Position2D unit="deg"><Name1>RA</Name1><Name2>Dec</Name2>'
+            "<Value2><C1>%s</C1><C2>%s</C2></Value2>",
+        ),
+        Slot(("pos_error_deg_95",), "<Error2Radius>%s</Error2Radius>"),
+        Slot((), "</Position2D>\n", when=("right_ascension", "declination")),
+        "        </AstroCoords>\n      </ObservationLocation>\n"
+        "    </ObsDataLocation>\n  </WhereWhen>\n  <How>\n",
+    ]
+    if kind == "update":
+        chunks.append(Slot(("update_message",), "    <Description>%s</Description>\n"))
+    elif kind == "retraction":
+        chunks.append("    <Description>Human-issued retraction.</Description>\n")
+    chunks += [
+        Slot(("website",), '    <Reference uri="%s"/>\n'),
+        "  </How>\n",
+        "  <Why",
+        Slot(("importance",), ' importance="%s"'),
+        ">\n",
+        Slot(("tns_name",), "    <Inference><Name>%s</Name></Inference>\n"),
+        "  </Why>\n",
+    ]
+    if kind in CITES:
+        chunks.append(
+            Slot(
+                ("cited_ivorn",),
+                f'  <Citations>\n    <EventIVORN cite="{CITES[kind]}">%s'
+                "</EventIVORN>\n  </Citations>\n",
+            )
+        )
+    chunks.append("</voe:VOEvent>\n")
+    return chunks
+
+
+class Template:
+    """Template of one kind of VOEvent.
+
+    The chunks are flattened into a single %-format string for every
+    combination of unset optional fields, the first time that combination is
+    seen. Rendering is then one lookup and one string formatting.
+
+    Args:
+        chunks (List[Chunk]): Static strings and slots, in document order.
+    """
+
+    def __init__(self, chunks: List[Chunk]):
+        """Initializes the template."""
+        self.chunks = chunks
+        self.fields: Tuple[str, ...] = tuple(
+            dict.fromkeys(
+                field
+                for chunk in chunks
+                if isinstance(chunk, Slot)
+                for field in chunk.fields + chunk.when
+            )
+        )
+        self.compiled: Dict[Tuple[bool, ...], Tuple[str, Tuple[str, ...]]] = {}
+
+    def compile(self, unset: Tuple[bool, ...]) -> Tuple[str, Tuple[str, ...]]:
+        """Flattens the template for one combination of unset fields.
+
+        Args:
+            unset (Tuple[bool, ...]): Whether each of `fields` is unset.
+
+        Returns:
+            Tuple[str, Tuple[str, ...]]: The format string and the ordered
+            fields it substitutes.
+        """
+        missing = {field for field, none in zip(self.fields, unset) if none}
+        fmt: List[str] = []
+        order: List[str] = []
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                fmt.append(chunk.replace("%", "%%"))
+            elif missing.isdisjoint(chunk.fields + chunk.when):
+                fmt.append(chunk.fmt)
+                order.extend(chunk.fields)
+        self.compiled[unset] = ("".join(fmt), tuple(order))
+        return self.compiled[unset]
+
+    def render(self, values: Dict[str, Any]) -> str:
+        """Fills the template.
+
+        Args:
+            values (Dict[str, Any]): Values of every field of the template.
+
+        Returns:
+            str: The document.
+        """
+        unset = tuple([values[field] is None for field in self.fields])
+        fmt, order = self.compiled.get(unset) or self.compile(unset)
+        # Only strings can carry markup; numbers are formatted as they are.
+        return fmt % tuple(
+            [
+                _escape(value) if value.__class__ is str else value
+                for value in map(values.__getitem__, order)
+            ]
+        )
+
+
+TEMPLATES: Dict[str, Template] = {
+    kind: Template(_compile(kind))
+    for kind in ("detection", "subsequent", "retraction", "update")
+}
+
+
+def ivorn(observatory_name: str, kind: str, event_id: str) -> str:
+    """Returns the IVORN of a VOEvent.
+
+    Args:
+        observatory_name (str): Name of the host observatory.
+        kind (str): Which kind of VOEvent.
+        event_id (str): Internal ID (or detection time) of the event.
+
+    Returns:
+        str: The IVORN.
+    """
+    stream = observatory_name.replace(" ", "_")
+    return f"ivo://frbvoe/{stream}#{kind}-{event_id}".replace(" ", "T")
+
+
+def render(values: Dict[str, Any]) -> str:
+    """Renders a VOEvent to XML.
+
+    Args:
+        values (Dict[str, Any]): The VOEvent payload.
+
+    Returns:
+        str: The VOEvent XML document.
+    """
+    event_id = values["internal_id"] or values["date"]
+    observatory_name = values["observatory_name"] or ""
+    values = {
+        **values,
+        "ivorn": ivorn(observatory_name, values["kind"], event_id),
+        "author_ivorn": f"ivo://frbvoe/{observatory_name.replace(' ', '_')}",
+        "iso_date": values["date"].replace(" ", "T"),
+        "cited_ivorn": ivorn(observatory_name, "detection", event_id),
+    }
+    return TEMPLATES[values["kind"]].render(values)
+
+
+def parse(
+    document: Union[str, bytes], types: Optional[Dict[str, Callable]] = None
+) -> Dict[str, Any]:
+    """Parses a VOEvent XML document written by `render`.
+
+    Args:
+        document (Union[str, bytes]): The VOEvent XML document.
+        types (Optional[Dict[str, Callable]]): Converters of the What parameters,
+            keyed by name. Values without a converter are kept as strings.
+
+    Returns:
+        Dict[str, Any]: The VOEvent payload.
+    """
+    types = types or {}
+    root = ElementTree.fromstring(document)
+    values: Dict[str, Any] = {}
+    for param in root.iter("Param"):
+        name = param.get("name")
+        values[name] = types.get(name, str)(param.get("value"))
+    author = root.find("Who/Author")
+    if author is not None:
+        values["observatory_name"] = author.findtext("shortName")
+        values["email"] = author.findtext("contactEmail")
+    iso_date = root.findtext(".//ISOTime") or root.findtext("Who/Date")
+    values["date"] = iso_date.replace("T", " ") if iso_date else None
+    position = root.find(".//Position2D")
+    if position is not None:
+        values["right_ascension"] = float(position.findtext("Value2/C1"))
+        values["declination"] = float(position.findtext("Value2/C2"))
+        error = position.findtext("Error2Radius")
+        if error is not None:
+            values["pos_error_deg_95"] = float(error)
+    reference = root.find("How/Reference")
+    if reference is not None:
+        values["website"] = reference.get("uri")
+    if values.get("kind") == "update":
+        values["update_message"] = root.findtext("How/Description")
+    why = root.find("Why")
+    if why is not None and why.get("importance") is not None:
+        values["importance"] = float(why.get("importance"))
+    if "kind" not in values:
+        cited = root.find("Citations/EventIVORN")
+        values["kind"] = KINDS[cited.get("cite")] if cited is not None else "detection"
+    return values
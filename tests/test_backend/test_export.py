@@ -0,0 +1,12 @@
+"""Tests for the export endpoint."""
+
+import asyncio
+from types import SimpleNamespace
+
+from frbvoe.backend.export import export_collection
+
+
+def test_subscribers_are_not_exported():
+    request = SimpleNamespace(args={})
+    response = asyncio.run(export_collection(request, "subscriber"))
+    assert response.status == 404
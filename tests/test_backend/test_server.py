@@ -1,7 +1,9 @@
+import os
+
 import pytest
 from sanic import response
 
-from frbvoe.server import create
+from frbvoe.server import available_cpus, create, pool_sizes
 
 
 @pytest.fixture
@@ -20,3 +22,16 @@ def app():
 #     assert request.method.lower() == "post"
 #     assert response.status == 200
 #     assert response.body == "Server shutting down..."
+
+
+def test_available_cpus():
+    assert 1 <= available_cpus() <= (os.cpu_count() or 1)
+
+
+def test_pool_sizes(app):
+    assert pool_sizes(app) == (2, 100)
+    app.config.WORKERS = 4
+    app.config.MONGODB_MAX_CONNECTIONS = 40
+    assert pool_sizes(app) == (2, 10)
+    app.config.MONGODB_MAX_POOL_SIZE = 1
+    assert pool_sizes(app) == (1, 1)
@@ -1,4 +1,8 @@
-from frbvoe.backend.tns import TNS
+import asyncio
+import json
+from types import SimpleNamespace
+
+from frbvoe.backend.tns import TNS, submit_tns
 
 frb_data = {
     "kind": "detection",
@@ -42,11 +46,56 @@ frb_data = {
 # assert response.json() == {"message": "FRB submitted to sandbox TNS."}
 
 
-def test_submit_missing_period():
+class TNSClient:
+    # Stands in for the worker's TNS client, naming every report at once.
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, account, report, reference=None):
+        self.submitted.append((account, report, reference))
+        future = asyncio.get_running_loop().create_future()
+        future.set_result("FRB20250113A")
+        return future
+
+
+class Reports:
+    # Stands in for the tns collection.
+    def __init__(self):
+        self.documents = []
+
+    async def insert_one(self, document):
+        self.documents.append(document)
+        return SimpleNamespace(inserted_id=len(self.documents))
+
+
+def test_submit():
+    client = TNSClient()
     tns = TNS(**frb_data, tns_api_key="***")
-    try:
-        response = tns.submit(frb_data)
-        assert response.status_code != 200
-    except Exception as e:
-        assert True
-        return e
+    assert asyncio.run(tns.submit(client, reference=1)) == "FRB20250113A"
+    ((account, report, reference),) = client.submitted
+    assert account == (True, "***", "bot")
+    assert "tns_api_key" not in report and reference == 1
+
+
+def test_submit_tns():
+    reports = Reports()
+    app = SimpleNamespace(
+        ctx=SimpleNamespace(mongo={"frbvoe": {"tns": reports}}, tns=TNSClient()),
+        config={},
+    )
+
+    async def post(report):
+        request = SimpleNamespace(app=app, json=report)
+        return await submit_tns(request)
+
+    response = asyncio.run(post({**frb_data, "tns_api_key": "***"}))
+    assert response.status == 200
+    assert json.loads(response.body)["tns_name"] == "FRB20250113A"
+    # The API key is not saved with the report.
+    ((document,),) = [reports.documents]
+    assert "tns_api_key" not in document and document["tns_bot_name"] == "bot"
+    # An invalid report is refused at once, without being saved.
+    response = asyncio.run(post(frb_data))
+    assert response.status == 400
+    assert json.loads(response.body)["database"] == "Skipped"
+    assert len(reports.documents) == 1
@@ -1,6 +1,21 @@
+import asyncio
+import json
+import queue
+from types import SimpleNamespace
+
+import httpx
 import pytest
+from pymongo.errors import DuplicateKeyError
 
+from frbvoe.backend.voe import (
+    archive,
+    create_voe,
+    queued,
+    send_to_comet,
+    validate_batch,
+)
 from frbvoe.models.voe import VOEvent
+from frbvoe.utilities.dedupe import RecentVOEvents
 
 
 def test_voevent_creation():
@@ -40,3 +55,226 @@ def test_voevent_creation():
             pos_error_deg_95=0.001,
             importance=0.9979,
         )
+
+
+def test_validate_batch():
+    valid = {
+        "kind": "detection",
+        "observatory_name": "CHIME",
+        "date": "2020-01-13 16:55:08.844845",
+        "email": "john.smith@email.com",
+        "right_ascension": 55.2938,
+        "declination": 14.2049,
+        "dm": 298.53,
+    }
+    invalid = {**valid, "kind": "invalid_kind"}
+    body = json.dumps([valid, invalid, valid]).encode()
+    voevents, errors = validate_batch(body)
+    assert len(voevents) == 2
+    assert list(errors) == [1]
+    assert "kind" in errors[1]
+
+    ndjson = "\n".join(json.dumps(item) for item in (valid, valid, invalid))
+    voevents, errors = validate_batch(ndjson.encode() + b"\n", ndjson=True)
+    assert len(voevents) == 2
+    assert list(errors) == [2]
+
+    with pytest.raises(ValueError):
+        validate_batch(json.dumps(valid).encode())
+
+
+def test_queued():
+    voevent = VOEvent(
+        kind="detection",
+        observatory_name="CHIME",
+        date="2020-01-13 16:55:08.844845",
+        email="john.smith@email.com",
+        dm=298.53,
+    )
+    payload = queued(voevent)
+    assert "email_password" not in payload
+    # The outbox workers rebuild the VOEvent from the payload.
+    assert VOEvent(**payload).dm == 298.53
+
+
+class Archive:
+    # Stands in for the VOEvent collection, with its unique dedup_key index.
+    def __init__(self):
+        self.documents = []
+
+    async def insert_one(self, document):
+        if any(d["dedup_key"] == document["dedup_key"] for d in self.documents):
+            raise DuplicateKeyError("dedup_key")
+        document["_id"] = len(self.documents)
+        self.documents.append(document)
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    async def _find(self, query):
+        for document in self.documents:
+            if document["dedup_key"] in query["dedup_key"]["$in"]:
+                yield document
+
+    def find(self, query, projection):
+        return self._find(query)
+
+
+def test_archive():
+    collection = Archive()
+    app = SimpleNamespace(ctx=SimpleNamespace(mongo={"frbvoe": {"voe": collection}}))
+    voevent = VOEvent(
+        kind="detection",
+        observatory_name="CHIME",
+        date="2020-01-13 16:55:08.844845",
+        email="john.smith@email.com",
+        dm=298.53,
+    )
+    assert asyncio.run(archive(app, voevent, key="a")) == ("0", False)
+    # A resubmission, e.g. to another worker, gets the ID of the original.
+    assert asyncio.run(archive(app, voevent, key="a")) == ("0", True)
+    assert len(collection.documents) == 1
+
+
+class Outbox:
+    # Stands in for the outbox, recording the queued broadcasts.
+    def __init__(self):
+        self.queued = []
+
+    async def put(self, payload, sinks):
+        self.queued.append((payload, sinks))
+
+
+def test_create_voe_updates():
+    outbox = Outbox()
+    app = SimpleNamespace(
+        ctx=SimpleNamespace(
+            mongo={"frbvoe": {"voe": Archive()}},
+            outbox=outbox,
+            recent=RecentVOEvents(),
+        ),
+        config={},
+    )
+    update = {
+        "kind": "update",
+        "observatory_name": "CHIME",
+        "internal_id": "1234",
+        "date": "2020-01-13 16:55:08.844845",
+        "email": "john.smith@email.com",
+        "update_message": "First update.",
+    }
+
+    async def post(voevent):
+        request = SimpleNamespace(
+            app=app, ctx=SimpleNamespace(), body=json.dumps(voevent).encode()
+        )
+        return json.loads((await create_voe(request)).body)
+
+    async def run():
+        first = await post(update)
+        second = await post({**update, "update_message": "Second update."})
+        resubmitted = await post(update)
+        return first, second, resubmitted
+
+    first, second, resubmitted = asyncio.run(run())
+    # Two updates of one event are both broadcast, a resubmission is not.
+    assert not first["duplicate"] and not second["duplicate"]
+    assert first["id"] != second["id"]
+    assert resubmitted["duplicate"] and resubmitted["id"] == first["id"]
+    messages = [payload["update_message"] for payload, _ in outbox.queued]
+    assert messages.count("First update.") == 2
+    assert messages.count("Second update.") == 2
+
+
+class Repeaters:
+    # Stands in for the repeater index, failing its first association.
+    def __init__(self):
+        self.calls = 0
+
+    def associate(self, voevent):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("The index is being rebuilt.")
+        return None
+
+
+class StuckOutbox(Outbox):
+    # Stands in for an outbox that never answers, until unstuck.
+    def __init__(self):
+        super().__init__()
+        self.stuck = True
+
+    async def put(self, payload, sinks):
+        while self.stuck:
+            await asyncio.sleep(0.01)
+        await super().put(payload, sinks)
+
+
+def test_create_voe_retries_after_a_failure():
+    outbox = StuckOutbox()
+    app = SimpleNamespace(
+        ctx=SimpleNamespace(
+            mongo={"frbvoe": {"voe": Archive()}},
+            outbox=outbox,
+            recent=RecentVOEvents(),
+            repeaters=Repeaters(),
+        ),
+        config={},
+    )
+    detection = {
+        "kind": "detection",
+        "observatory_name": "CHIME",
+        "internal_id": "1234",
+        "date": "2020-01-13 16:55:08.844845",
+        "email": "john.smith@email.com",
+    }
+
+    async def post():
+        request = SimpleNamespace(
+            app=app, ctx=SimpleNamespace(), body=json.dumps(detection).encode()
+        )
+        return json.loads((await create_voe(request)).body)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await post()
+        # The client disconnects while the broadcasts are queued.
+        request = asyncio.ensure_future(post())
+        await asyncio.sleep(0.05)
+        request.cancel()
+        outbox.stuck = False
+        # Neither left the retries waiting for the original.
+        return await asyncio.wait_for(post(), timeout=5)
+
+    response = asyncio.run(run())
+    assert response["database"] in ("Success", "Duplicate")
+    assert response["id"] is not None
+
+
+class Comet:
+    # Stands in for the pooled HTTP client, answering Comet with a status.
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.posts = 0
+
+    async def post(self, url, **kwargs):
+        self.posts += 1
+        return httpx.Response(self.status_code)
+
+
+def test_send_to_comet_refused():
+    voevent = VOEvent(
+        kind="detection",
+        observatory_name="CHIME",
+        date="2020-01-13 16:55:08.844845",
+        email="john.smith@email.com",
+    )
+    app = SimpleNamespace(ctx=SimpleNamespace(http=Comet(200)), config={})
+    assert asyncio.run(send_to_comet(app, voevent))
+    # A refusal fails the sink, rather than passing for a success.
+    app.ctx.http = Comet(500)
+    with pytest.raises(RuntimeError):
+        asyncio.run(send_to_comet(app, voevent))
+    # So does a full queue of the built-in VTP broker.
+    app.ctx.vtp = queue.Queue(maxsize=1)
+    assert asyncio.run(send_to_comet(app, voevent))
+    with pytest.raises(RuntimeError):
+        asyncio.run(send_to_comet(app, voevent))
@@ -0,0 +1,65 @@
+"""Tests for the bench command."""
+
+import orjson
+from click.testing import CliRunner
+
+from frbvoe.cli import bench as bench_cli
+from frbvoe.cli.bench import bench
+
+RESULT = {
+    "requests": 10,
+    "concurrency": 2,
+    "workers": 1,
+    "database": False,
+    "requests_per_second": 1000.0,
+    "latency_ms": {"p50": 10.0, "p90": 20.0, "p99": 40.0, "max": 80.0},
+    "statuses": {"200": 10},
+    "memory_mb": {"0": {"rss": 90.0, "peak": 95.0}},
+    "received": {"comet": 10, "email": 10},
+}
+
+
+class Run:
+    # Stands in for the load test, returning a canned result.
+    def __init__(self, result):
+        self.result = result
+        self.options = None
+
+    async def __call__(self, **options):
+        self.options = options
+        return self.result
+
+
+def test_bench(monkeypatch, tmp_path):
+    run = Run(RESULT)
+    monkeypatch.setattr(bench_cli, "run", run)
+    path = tmp_path / "baseline.json"
+    result = CliRunner().invoke(
+        bench,
+        ["--requests", "10", "--concurrency", "2", "--workers", "1"]
+        + ["--mongodb", ":27018", "--save", str(path)],
+    )
+    assert result.exit_code == 0, result.output
+    assert "Throughput: 1000 requests/s" in result.output
+    assert "Received: 10 by Comet, 10 emails" in result.output
+    assert f"Saved the baseline {path}." in result.output
+    assert orjson.loads(path.read_bytes()) == RESULT
+    assert run.options == {
+        "requests": 10,
+        "concurrency": 2,
+        "workers": 1,
+        "warmup": 100,
+        "mongodb": ("localhost", 27018),
+    }
+
+
+def test_bench_regression(monkeypatch, tmp_path):
+    path = tmp_path / "baseline.json"
+    path.write_bytes(orjson.dumps({**RESULT, "requests_per_second": 2000.0}))
+    monkeypatch.setattr(bench_cli, "run", Run(RESULT))
+    result = CliRunner().invoke(
+        bench, ["--concurrency", "2", "--workers", "1", "--baseline", str(path)]
+    )
+    assert result.exit_code == 1
+    assert "Regression: 1000 requests/s, below 2000 by more than 20%" in result.output
+    assert "No regression" not in result.output
@@ -0,0 +1,72 @@
+"""Tests for the export command."""
+
+import csv
+
+from bson import ObjectId
+from click.testing import CliRunner
+
+from frbvoe.cli import export as export_cli
+from frbvoe.cli.export import export
+from frbvoe.utilities.export import FIELDS, PROJECTION
+
+DOCUMENTS = [
+    {"_id": ObjectId(), "kind": "detection", "observatory_name": "CHIME", "dm": 1.0},
+    {"_id": ObjectId(), "kind": "retraction", "observatory_name": "CHIME"},
+    {"_id": ObjectId(), "kind": "update", "observatory_name": "CHIME", "dm": 3.0},
+]
+
+
+class Collection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.calls = []
+
+    def find(self, query, projection, batch_size):
+        self.calls.append((query, projection, batch_size))
+        return iter(self.documents)
+
+
+class Client:
+    # Stands in for MongoClient, over the collections of the frbvoe database.
+    def __init__(self, collections):
+        self.collections = collections
+        self.options = None
+        self.closed = False
+
+    def __call__(self, **options):
+        self.options = options
+        return self
+
+    def __getitem__(self, name):
+        return self.collections if name == "frbvoe" else {}
+
+    def close(self):
+        self.closed = True
+
+
+def test_export(monkeypatch, tmp_path):
+    collection = Collection(DOCUMENTS)
+    client = Client({"voe": collection})
+    monkeypatch.setattr(export_cli, "MongoClient", client)
+    output = tmp_path / "voe.csv"
+    result = CliRunner().invoke(
+        export,
+        ["voe", "--format", "csv", "--output", str(output), "--batch-size", "2"],
+    )
+    assert result.exit_code == 0, result.output
+    assert "Exported 3 documents from voe." in result.output
+    with output.open() as file:
+        rows = list(csv.DictReader(file))
+    assert list(rows[0]) == FIELDS["voe"]
+    assert [row["kind"] for row in rows] == ["detection", "retraction", "update"]
+    assert [row["dm"] for row in rows] == ["1.0", "", "3.0"]
+    # The secrets are left out by the database, a batch at a time.
+    assert collection.calls == [({}, PROJECTION, 2)]
+    assert client.options["host"] == "localhost"
+    assert client.closed
+
+
+def test_export_rejects_unknown_collections():
+    result = CliRunner().invoke(export, ["outbox"])
+    assert result.exit_code == 2
+    assert "Invalid value for '{subscriber|tns|voe}'" in result.output
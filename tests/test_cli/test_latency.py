@@ -0,0 +1,69 @@
+"""Tests for the latency command."""
+
+from click.testing import CliRunner
+
+from frbvoe.cli import latency as latency_cli
+from frbvoe.cli.latency import latency
+
+
+class Collection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter(self.rows)
+
+
+class Client:
+    # Stands in for MongoClient, over the collections of the frbvoe database.
+    def __init__(self, collections):
+        self.collections = collections
+        self.closed = False
+
+    def __call__(self, **options):
+        return self
+
+    def __getitem__(self, name):
+        return self.collections
+
+    def close(self):
+        self.closed = True
+
+
+def test_latency(monkeypatch):
+    rows = [{"comet": float(n), "email": None} for n in range(1, 101)]
+    rows.append({"comet": None, "email": 0.5})
+    collection = Collection(rows)
+    client = Client({"voe": collection})
+    monkeypatch.setattr(latency_cli, "MongoClient", client)
+    result = CliRunner().invoke(
+        latency, ["--start", "2025-01-01", "--end", "2025-02-01"]
+    )
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0].split() == [
+        "sink",
+        "count",
+        "p50",
+        "(s)",
+        "p95",
+        "(s)",
+        "p99",
+        "(s)",
+    ]
+    assert lines[1].split() == ["comet", "100", "50.500", "95.050", "99.010"]
+    assert lines[2].split() == ["email", "1", "0.500", "0.500", "0.500"]
+    assert lines[3].split()[:2] == ["any", "101"]
+    # The dates bound the VOEvents aggregated.
+    match = collection.pipelines[0][0]["$match"]
+    assert match["date"] == {"$gte": "2025-01-01", "$lt": "2025-02-01"}
+    assert client.closed
+
+
+def test_latency_without_broadcasts(monkeypatch):
+    monkeypatch.setattr(latency_cli, "MongoClient", Client({"voe": Collection([])}))
+    result = CliRunner().invoke(latency, [])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines()[1].split() == ["comet", "0", "-", "-", "-"]
@@ -0,0 +1,73 @@
+"""Tests for the snapshot command."""
+
+from bson import ObjectId
+from click.testing import CliRunner
+
+from frbvoe.cli import snapshot as snapshot_cli
+from frbvoe.cli.snapshot import snapshot
+from frbvoe.utilities.snapshot import load
+
+DOCUMENTS = [
+    {
+        "_id": ObjectId(),
+        "kind": "detection",
+        "observatory_name": "CHIME",
+        "date": "2020-01-13 16:55:08.844845",
+        "dm": 298.53,
+    },
+    {
+        "_id": ObjectId(),
+        "kind": "detection",
+        "observatory_name": "DSA-110",
+        "date": "2021-02-01 00:00:00",
+        "dm": 512.0,
+    },
+]
+
+
+class Collection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.batch_sizes = []
+
+    def find_one(self, query, projection, sort):
+        return max(self.documents, key=lambda document: document["_id"])
+
+    def count_documents(self, query):
+        return len(self.documents)
+
+    def find(self, query, projection, batch_size):
+        self.batch_sizes.append(batch_size)
+        return iter(self.documents)
+
+
+class Client:
+    # Stands in for MongoClient, over the collections of the frbvoe database.
+    def __init__(self, collections):
+        self.collections = collections
+        self.closed = False
+
+    def __call__(self, **options):
+        return self
+
+    def __getitem__(self, name):
+        return self.collections
+
+    def close(self):
+        self.closed = True
+
+
+def test_snapshot(monkeypatch, tmp_path):
+    collection = Collection(DOCUMENTS)
+    client = Client({"voe": collection})
+    monkeypatch.setattr(snapshot_cli, "MongoClient", client)
+    result = CliRunner().invoke(
+        snapshot, ["--path", str(tmp_path), "--batch-size", "1"]
+    )
+    assert result.exit_code == 0, result.output
+    loaded = load(tmp_path)
+    assert result.output == f"Wrote the snapshot {loaded.path}.\n"
+    assert loaded.rows == 2
+    assert list(loaded["dm"]) == [298.53, 512.0]
+    assert collection.batch_sizes == [1]
+    assert client.closed
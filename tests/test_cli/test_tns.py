@@ -7,4 +7,4 @@ def test_tns_submit():
     runner = CliRunner()
     result = runner.invoke(submit, ["--help"])
     assert result.exit_code == 0
-    assert "Usage: submit [OPTIONS]" in result.output
+    assert "Usage: submit [OPTIONS] REPORT" in result.output
@@ -1,5 +1,7 @@
 """Test for VOE model."""
 
+import json
+
 import pytest
 from pydantic import ValidationError
 
@@ -39,3 +41,53 @@ def test_voe():
         VOEvent(**sample_request)
     # with pytest.raises(TypeError):
     #     VOEvent(**sample_request).payload is Dict
+
+
+def test_voe_xml_round_trip():
+    detection = {
+        **{
+            key: value
+            for key, value in sample_request.items()
+            if key != "update_message"
+        },
+        "observatory_name": "CHIME",
+        "website": "https://www.example.com/?a=1&b=<2>",
+    }
+    retraction = {
+        "kind": "retraction",
+        "observatory_name": "CHIME",
+        "date": "2025-01-13 16:55:08.844845",
+        "email": "john.smith@email.com",
+        "internal_id": "20210826A",
+    }
+    update = {
+        **retraction,
+        "kind": "update",
+        "tns_name": "FRB20210826A",
+        "update_message": "Refined <DM> & position.",
+    }
+    for payload in (detection, retraction, update):
+        voevent = VOEvent(**payload)
+        document = voevent.to_xml()
+        assert document.startswith('<?xml version="1.0" encoding="UTF-8"?>')
+        assert VOEvent.from_xml(document) == voevent
+
+
+def test_voe_xml_sections():
+    voevent = VOEvent(**sample_request, observatory_name="CHIME")
+    document = voevent.to_xml()
+    for section in ("<Who>", "<What>", "<WhereWhen>", "<How>", "<Why"):
+        assert section in document
+    assert "<Citations>" not in document
+    assert 'ivorn="ivo://frbvoe/CHIME#detection-20210826A"' in document
+
+
+def test_voe_validate_json():
+    payload = {**sample_request, "observatory_name": "CHIME"}
+    voevent = VOEvent.model_validate_json(json.dumps(payload).encode())
+    assert voevent == VOEvent(**payload)
+    # Invalid addresses are rejected every time, not cached.
+    bad = json.dumps({**payload, "email": "john.smith@@email"}).encode()
+    for _ in range(2):
+        with pytest.raises(ValidationError):
+            VOEvent.model_validate_json(bad)
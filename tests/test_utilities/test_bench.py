@@ -0,0 +1,92 @@
+"""Tests for the load test of the server."""
+
+import asyncio
+from email.message import EmailMessage
+
+import aiosmtplib
+
+from frbvoe.utilities.bench import (
+    CometReceiver,
+    SMTPSink,
+    compare,
+    example_payloads,
+    load,
+    worker_memory,
+)
+
+RESULT = {
+    "concurrency": 32,
+    "workers": 2,
+    "database": False,
+    "requests_per_second": 1000.0,
+    "latency_ms": {"p50": 10.0, "p90": 20.0, "p99": 40.0, "max": 80.0},
+    "memory_mb": {"0": {"rss": 90.0, "peak": 95.0}},
+}
+
+
+def test_example_payloads():
+    payloads = list(example_payloads())
+    assert payloads
+    assert all(payload["observatory_name"] == "CHIME" for payload in payloads)
+
+
+def test_stand_ins():
+    async def run():
+        comet, smtp = CometReceiver(), SMTPSink()
+        host, port = await comet.start()
+        seconds, latencies, statuses = await load(
+            f"http://{host}:{port}/", [{"kind": "detection"}], 50, 4
+        )
+        message = EmailMessage()
+        message["From"] = "john.smith@email.com"
+        message["Subject"] = "FRB"
+        message.set_content("An FRB.")
+        host, port = await smtp.start()
+        await aiosmtplib.send(
+            message,
+            hostname=host,
+            port=port,
+            recipients=["jane.doe@email.com"],
+            start_tls=False,
+        )
+        await comet.stop()
+        await smtp.stop()
+        return latencies, statuses, comet.received, smtp.messages
+
+    latencies, statuses, received, messages = asyncio.run(run())
+    assert statuses == {200: 50}
+    assert len(latencies) == 50 and (latencies > 0).all()
+    assert received == 50
+    assert messages == 1
+
+
+def test_worker_memory():
+    metrics = "\n".join(
+        [
+            'frbvoe_resident_memory_bytes{worker="0"} 104857600',
+            'frbvoe_resident_memory_bytes{worker="1"} 52428800',
+            'frbvoe_peak_resident_memory_bytes{worker="0"} 209715200',
+            'frbvoe_peak_resident_memory_bytes{worker="1"} 52428800',
+        ]
+    )
+    assert worker_memory(metrics) == {
+        "0": {"rss": 100.0, "peak": 200.0},
+        "1": {"rss": 50.0, "peak": 50.0},
+    }
+
+
+def test_compare():
+    assert compare(RESULT, RESULT) == []
+    slower = {
+        **RESULT,
+        "requests_per_second": 700.0,
+        "latency_ms": {**RESULT["latency_ms"], "p99": 60.0, "max": 500.0},
+    }
+    regressions = compare(slower, RESULT)
+    assert len(regressions) == 2
+    assert "requests/s" in regressions[0]
+    assert "p99" in regressions[1]
+    assert compare(slower, RESULT, tolerance=0.6) == []
+    heavier = {**RESULT, "memory_mb": {"0": {"rss": 90.0, "peak": 200.0}}}
+    assert "memory" in compare(heavier, RESULT)[0]
+    assert "workers" in compare({**RESULT, "workers": 1}, RESULT)[0]
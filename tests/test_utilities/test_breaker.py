@@ -0,0 +1,139 @@
+"""Tests for the circuit breakers of the sinks."""
+
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from frbvoe.backend.voe import send_to_comet
+from frbvoe.models.voe import VOEvent
+from frbvoe.utilities.breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Breakers,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+async def fail():
+    raise ConnectionError("down")
+
+
+async def succeed():
+    return "ok"
+
+
+def test_opens_after_failures():
+    async def run():
+        breaker = CircuitBreaker("comet", failures=3, reset=60)
+        for _ in range(3):
+            with pytest.raises(ConnectionError):
+                await breaker.call(fail())
+        assert breaker.state == OPEN
+        # Rejected at once, without the call ever starting.
+        call = succeed()
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(call)
+        assert call.cr_frame is None
+
+    asyncio.run(run())
+
+
+def test_half_open_probe():
+    async def run():
+        breaker = CircuitBreaker("tns", failures=1, reset=0)
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail())
+        assert breaker.state == OPEN
+        # A failed probe reopens the breaker.
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail())
+        assert breaker.state == OPEN
+        assert await breaker.call(succeed()) == "ok"
+        assert breaker.state == CLOSED
+
+    asyncio.run(run())
+
+
+def test_single_probe():
+    breaker = CircuitBreaker("smtp", failures=1, reset=0)
+    breaker.failure()
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_timeout():
+    async def run():
+        breaker = CircuitBreaker("comet", min_timeout=0.01, max_timeout=0.05)
+        assert breaker.timeout() == 0.05
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(asyncio.sleep(1))
+        assert breaker.failed == 1
+        # Fast calls bring the timeout down to its lower bound.
+        for _ in range(32):
+            breaker.success(0.0001)
+        assert breaker.timeout() == 0.01
+        for _ in range(200):
+            breaker.success(1.0)
+        assert breaker.timeout() == 0.05
+
+    asyncio.run(run())
+
+
+def test_no_timeout():
+    async def run():
+        breaker = Breakers(
+            overrides={"mongo": {"max_timeout": None}}, min_timeout=0.01
+        )["mongo"]
+        # A slow insert is awaited, rather than abandoned as it may commit.
+        assert await breaker.call(asyncio.sleep(0.05, "inserted")) == "inserted"
+        for _ in range(32):
+            breaker.success(0.0001)
+        assert breaker.timeout() is None
+        assert breaker.report()["timeout"] is None
+
+    asyncio.run(run())
+
+
+def test_breakers():
+    reports = []
+    breakers = Breakers(
+        ("comet",), on_change=lambda b: reports.append(b.report()), failures=1
+    )
+    assert list(breakers.report()) == ["comet"]
+    breakers["smtp"].failure()
+    assert reports[-1]["smtp"]["state"] == OPEN
+    assert reports[-1]["comet"]["state"] == CLOSED
+
+
+def test_refusals_open_the_breaker():
+    # Comet keeps answering 500: send_comet returns False, which is a failure.
+    class Comet:
+        posts = 0
+
+        async def post(self, url, **kwargs):
+            Comet.posts += 1
+            return httpx.Response(500)
+
+    voevent = VOEvent(
+        kind="detection",
+        observatory_name="CHIME",
+        date="2020-01-13 16:55:08.844845",
+        email="john.smith@email.com",
+    )
+    breakers = Breakers(failures=2, reset=60)
+    app = SimpleNamespace(
+        ctx=SimpleNamespace(http=Comet(), breakers=breakers), config={}
+    )
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            asyncio.run(send_to_comet(app, voevent))
+    assert breakers["comet"].state == OPEN
+    assert not breakers["comet"].latencies
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(send_to_comet(app, voevent))
+    assert Comet.posts == 2
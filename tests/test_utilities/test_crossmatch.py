@@ -0,0 +1,80 @@
+"""Tests for the crossmatch engine."""
+
+import numpy as np
+
+from frbvoe.utilities.crossmatch import (
+    Catalog,
+    crossmatch,
+    error_radius,
+    separation,
+    unit_vectors,
+)
+
+rng = np.random.default_rng(0)
+right_ascension = rng.uniform(0.0, 360.0, 20000)
+declination = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, 20000)))
+
+
+def brute_force(ra, dec, radius):
+    separations = separation(
+        unit_vectors(right_ascension, declination), unit_vectors(ra, dec)
+    )
+    return set(np.nonzero(separations <= radius)[0])
+
+
+def test_separation():
+    vectors = unit_vectors([0.0, 90.0, 359.5], [0.0, 0.0, 89.0])
+    assert np.allclose(separation(vectors, unit_vectors(0.0, 0.0)), [0.0, 90.0, 89.0])
+
+
+def test_cone_matches_brute_force():
+    catalog = Catalog(right_ascension, declination, cell=2.0)
+    # Including the poles, the wrap at RA 0/360 and radii spanning many cells.
+    for ra, dec, radius in [
+        (55.2938, 14.2049, 3.0),
+        (359.9, 0.0, 2.0),
+        (0.0, 90.0, 5.0),
+        (120.0, -45.0, 40.0),
+    ]:
+        indices, separations = catalog.cone(ra, dec, radius)
+        assert set(indices) == brute_force(ra, dec, radius)
+        assert np.all(np.diff(separations) >= 0)
+
+
+def test_match_with_errors():
+    catalog = Catalog([10.0, 10.0, 11.0], [0.0, 0.5, 0.0], errors=[0.1, 1.0, 0.0])
+    # 0.3 deg from the first, beyond hypot(0.2, 0.1), and 0.2 deg from the second.
+    indices, _ = catalog.match(10.0, 0.3, error=0.2)
+    assert list(indices) == [1]
+    indices, _ = catalog.match(10.0, 0.3, error=0.2, sigma=2.0)
+    assert list(indices) == [1, 0]
+
+
+def test_match_with_a_coarse_source():
+    errors = np.full(len(right_ascension), 0.05)
+    errors[7] = 60.0
+    catalog = Catalog(right_ascension, declination, errors, rebuild=len(errors))
+    vectors = unit_vectors(right_ascension, declination)
+    for ra, dec, error in [(55.2938, 14.2049, 0.5), (200.0, -60.0, 2.0)]:
+        indices, _ = catalog.match(ra, dec, error)
+        separations = separation(vectors, unit_vectors(ra, dec))
+        expected = np.nonzero(separations <= np.hypot(error, errors))[0]
+        assert set(indices) == set(expected)
+        # The fine sources are searched within their own errors only.
+        fine = catalog._candidates(unit_vectors(ra, dec), np.hypot(error, 0.05), 3)
+        assert len(fine) < 1000
+
+
+def test_incremental_add():
+    catalog = Catalog(right_ascension[:100], declination[:100], rebuild=10)
+    for index in range(100, 125):
+        catalog.add(right_ascension[index], declination[index], ids=[f"new{index}"])
+    assert len(catalog) == 125 and len(catalog.pending) == 5
+    indices, _ = catalog.cone(right_ascension[123], declination[123], 1e-6)
+    assert [catalog.ids[index] for index in indices] == ["new123"]
+    matches = crossmatch(catalog, right_ascension[:3], declination[:3])
+    assert [list(indices) for indices, _ in matches] == [[0], [1], [2]]
+
+
+def test_error_radius():
+    assert np.allclose(error_radius([0.1, np.nan], [0.2, 0.05]), [0.2, 0.05])
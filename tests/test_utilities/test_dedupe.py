@@ -0,0 +1,79 @@
+"""Tests for the deduplication of resubmitted VOEvents."""
+
+import asyncio
+
+from frbvoe.utilities.dedupe import RecentVOEvents, dedup_key, duplicates, originals
+
+VOEVENT = {
+    "kind": "detection",
+    "observatory_name": "CHIME",
+    "internal_id": "1234",
+    "date": "2024-01-01 00:00:00",
+    "dm": 300.0,
+}
+
+
+class Collection:
+    # Stands in for a Motor collection, yielding the archived documents.
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def _find(self, query):
+        for document in self.documents:
+            if document["dedup_key"] in query["dedup_key"]["$in"]:
+                yield document
+
+    def find(self, query, projection):
+        return self._find(query)
+
+
+def test_dedup_key():
+    key = dedup_key(VOEVENT)
+    assert len(key) == 32
+    # Only the identity of a VOEvent with an internal ID matters.
+    assert dedup_key({**VOEVENT, "dm": 301.0}) == key
+    assert dedup_key({**VOEVENT, "kind": "retraction"}) != key
+    # The follow-ups of an event share its date, so their content matters.
+    update = {**VOEVENT, "kind": "update", "update_message": "First update."}
+    assert dedup_key(update) != dedup_key({**update, "update_message": "Second."})
+    # Without one, its whole content does, except the password.
+    anonymous = {**VOEVENT, "internal_id": None}
+    assert dedup_key(anonymous) == dedup_key({**anonymous, "email_password": "x"})
+    assert dedup_key(anonymous) != dedup_key({**anonymous, "dm": 301.0})
+
+
+def test_recent_voevents():
+    async def run():
+        recent = RecentVOEvents(size=2)
+        first = recent.start("a")
+        recent.start("b")
+        assert recent.get("a") is first
+        # "b" is now the least recent.
+        recent.start("c")
+        assert recent.get("b") is None
+        recent.done("a", "id-a")
+        assert await recent.get("a") == "id-a"
+        # A VOEvent that failed to be archived is forgotten.
+        pending = recent.get("c")
+        recent.done("c", None)
+        assert await pending is None
+        assert recent.get("c") is None
+
+    asyncio.run(run())
+
+
+def test_originals():
+    collection = Collection(
+        [{"_id": 1, "dedup_key": "a"}, {"_id": 2, "dedup_key": "b"}]
+    )
+    assert asyncio.run(originals(collection, ["a", "c"])) == {"a": "1"}
+
+
+def test_duplicates():
+    details = {
+        "writeErrors": [
+            {"index": 1, "code": 11000},
+            {"index": 3, "code": 121},
+        ]
+    }
+    assert duplicates(details) == [1]
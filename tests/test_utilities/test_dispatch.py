@@ -0,0 +1,56 @@
+"""Tests for the concurrent sink dispatcher."""
+
+import asyncio
+import time
+
+from frbvoe.utilities.dispatch import dispatch, status
+
+
+async def fast():
+    return "done"
+
+
+async def slow():
+    await asyncio.sleep(0.2)
+    return "done"
+
+
+async def broken():
+    raise RuntimeError("broker is down")
+
+
+def test_dispatch_runs_sinks_concurrently():
+    async def run():
+        start = time.perf_counter()
+        sinks = await dispatch({"a": slow(), "b": slow(), "c": slow()})
+        return time.perf_counter() - start, sinks
+
+    elapsed, sinks = asyncio.run(run())
+    assert elapsed < 0.4
+    assert {name: status(task) for name, task in sinks.items()} == {
+        "a": "Success",
+        "b": "Success",
+        "c": "Success",
+    }
+
+
+def test_dispatch_reports_failures():
+    async def run():
+        return await dispatch({"comet": broken(), "database": fast()})
+
+    sinks = asyncio.run(run())
+    assert status(sinks["comet"]) == "Failure"
+    assert status(sinks["database"]) == "Success"
+    assert sinks["database"].result() == "done"
+
+
+def test_dispatch_respects_latency_budget():
+    async def run():
+        sinks = await dispatch({"comet": slow(), "email": fast()}, budget=0.01)
+        statuses = {name: status(task) for name, task in sinks.items()}
+        await sinks["comet"]
+        return statuses, status(sinks["comet"])
+
+    statuses, finished = asyncio.run(run())
+    assert statuses == {"comet": "Pending", "email": "Success"}
+    assert finished == "Success"
@@ -1,5 +1,8 @@
+import asyncio
 import datetime
 
+import pytest
+
 from frbvoe.utilities import email
 
 # from tests.conftest import voe
@@ -36,3 +39,51 @@ email_report = {
 }
 
 assert email.send_email(email_report) == "Success"
+
+
+def test_email_shares_its_body():
+    message = email.Email(email_report)
+    one = message.to(["alice@example.com"])
+    many = message.to(["alice@example.com", "bob@example.com"])
+    assert b"\r\nTo: alice@example.com\r\n" in one
+    assert b"\r\nTo: undisclosed-recipients:;\r\n" in many
+    assert one.endswith(message.body) and many.endswith(message.body)
+    assert b"Subject: CHIME_VOE_detection" in message.headers
+
+
+def test_render_retraction():
+    subject, body = email.render_email(
+        {
+            **email_report,
+            "kind": "retraction",
+            "internal_id": "38249195",
+            "pos_error_deg_95": 0.1,
+        }
+    )
+    assert subject == "CHIME_VOE_retraction"
+    assert "ivo://frbvoe/CHIME#retraction-38249195" in body
+    assert "Localization: (55.2938, 14.2049)" in body
+
+
+class SMTP:
+    # Stands in for the SMTP pool, delivering to all but the busy recipients.
+    async def deliver(self, sender, recipients, message):
+        message(recipients)
+        busy = [recipient for recipient in recipients if recipient.startswith("busy")]
+        return {
+            "recipients": len(recipients),
+            "messages": 1,
+            "failed": 0,
+            "refused": {recipient: "450 later" for recipient in busy},
+            "undelivered": busy,
+            "timings": {"total": 0.0},
+        }
+
+
+def test_deliver_email_undelivered():
+    recipients = ["alice@example.com", "busy@example.com"]
+    with pytest.raises(email.UndeliveredEmail) as error:
+        asyncio.run(email.deliver_email(email_report, recipients, SMTP()))
+    assert error.value.recipients == ["busy@example.com"]
+    report = asyncio.run(email.deliver_email(email_report, recipients[:1], SMTP()))
+    assert report["undelivered"] == []
@@ -0,0 +1,94 @@
+"""Tests for the streaming exports."""
+
+import asyncio
+import csv
+import io
+
+import orjson
+import pytest
+from bson import ObjectId
+
+from frbvoe.utilities.export import FIELDS, Encoder, export, stream
+
+DOCUMENTS = [
+    {
+        "_id": ObjectId(),
+        "kind": "detection",
+        "observatory_name": "CHIME",
+        "dm": 298.53,
+        "tns_name": None,
+    },
+    {"_id": ObjectId(), "kind": "retraction", "observatory_name": "CHIME"},
+    {"_id": ObjectId(), "kind": "update", "observatory_name": "CHIME", "dm": 300.0},
+]
+
+
+class Cursor:
+    # Stands in for pymongo and Motor cursors.
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class Collection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.calls = []
+
+    def find(self, query, projection, batch_size):
+        self.calls.append((query, projection, batch_size))
+        return Cursor(self.documents)
+
+
+def collect(collection, encoder, batch_size):
+    async def chunks():
+        return [
+            chunk async for chunk in stream(collection, encoder, batch_size=batch_size)
+        ]
+
+    return asyncio.run(chunks())
+
+
+def test_stream_ndjson():
+    collection = Collection(DOCUMENTS)
+    chunks = collect(collection, Encoder("voe"), batch_size=2)
+    assert len(chunks) == 2
+    lines = b"".join(chunks).splitlines()
+    assert [orjson.loads(line)["_id"] for line in lines] == [
+        str(document["_id"]) for document in DOCUMENTS
+    ]
+    assert collection.calls[0][1]["email_password"] == 0
+
+
+def test_stream_csv():
+    chunks = collect(Collection(DOCUMENTS), Encoder("voe", "csv"), batch_size=2)
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+    assert list(rows[0]) == FIELDS["voe"]
+    assert "email_password" not in rows[0]
+    assert [row["dm"] for row in rows] == ["298.53", "", "300.0"]
+
+
+def test_export_columns():
+    output = io.BytesIO()
+    exported = export(
+        Collection(DOCUMENTS), Encoder("voe", "columns"), output, batch_size=2
+    )
+    assert exported == 3
+    first, second = [orjson.loads(line) for line in output.getvalue().splitlines()]
+    assert first["kind"] == ["detection", "retraction"]
+    assert second["dm"] == [300.0]
+
+
+@pytest.mark.parametrize("collection, format", [("outbox", "csv"), ("voe", "xml")])
+def test_encoder_invalid(collection, format):
+    with pytest.raises(ValueError):
+        Encoder(collection, format)
@@ -0,0 +1,38 @@
+"""Tests for the pooled HTTP client."""
+
+import asyncio
+
+from frbvoe.utilities.http import HTTPClient
+
+
+async def serve(reader, writer):
+    # Minimal keep-alive HTTP/1.1 server answering every request with "ok".
+    while True:
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in head.split(b"\r\n"):
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+        await writer.drain()
+
+
+def test_connections_are_reused():
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = HTTPClient(http2=False)
+        for _ in range(3):
+            response = await client.post(f"http://127.0.0.1:{port}/", json={"a": 1})
+            assert response.text == "ok"
+        await client.close()
+        server.close()
+        return client.metrics
+
+    assert asyncio.run(run()) == {
+        "requests": 3,
+        "opened": 1,
+        "reused": 2,
+        "waiting": 0,
+    }
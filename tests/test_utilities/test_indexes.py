@@ -0,0 +1,61 @@
+"""Tests for the MongoDB index manager."""
+
+import asyncio
+
+from frbvoe.utilities.indexes import INDEXES, QUERIES, ensure_indexes, stages
+
+
+class Collection:
+    # Stands in for a Motor collection, keeping index_information's format.
+    def __init__(self):
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+
+    async def index_information(self):
+        return self.indexes
+
+    async def create_indexes(self, models):
+        for model in models:
+            document = model.document
+            self.indexes[document["name"]] = {
+                "key": list(document["key"].items()),
+                **({"unique": True} if document.get("unique") else {}),
+            }
+
+
+def test_ensure_indexes_is_idempotent():
+    database = {name: Collection() for name in INDEXES}
+    # An index created by hand under the default name is verified, not duplicated.
+    database["tns"].indexes["tns_name_1"] = {"key": [("tns_name", 1)]}
+
+    first = asyncio.run(ensure_indexes(database))
+    second = asyncio.run(ensure_indexes(database))
+    assert first["voe"] == dict.fromkeys(
+        [model.document["name"] for model in INDEXES["voe"]], "Created"
+    )
+    assert first["tns"] == {"tns_name": "Verified"}
+    assert database["subscriber"].indexes["contact_email"]["unique"]
+    assert all(
+        status == "Verified"
+        for indexes in second.values()
+        for status in indexes.values()
+    )
+
+
+def test_stages():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {
+            "stage": "OR",
+            "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}],
+        },
+    }
+    assert list(stages(plan)) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+
+
+def test_queries_lead_with_an_indexed_field():
+    for name, filters in QUERIES.items():
+        leading = {"_id"} | {
+            next(iter(model.document["key"])) for model in INDEXES[name]
+        }
+        for query in filters:
+            assert leading & set(query), (name, query)
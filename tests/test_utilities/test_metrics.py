@@ -0,0 +1,106 @@
+"""Tests for the metrics shared across workers."""
+
+import asyncio
+import multiprocessing
+from types import SimpleNamespace
+
+from frbvoe.utilities.metrics import Metrics, allocate, memory
+
+
+def record(shared, recorded, done):
+    metrics = Metrics(*shared)
+    metrics.observe("database", 0.003)
+    metrics.count("detection", "database", "Success")
+    metrics.gauge("outbox_depth", 7)
+    recorded.release()
+    done.wait()
+
+
+def test_metrics():
+    metrics = Metrics()
+    metrics.observe("validation", 0.0002)
+    metrics.observe("validation", 0.2)
+    metrics.count("detection", "comet", "Queued")
+    metrics.count(None, "validation", "Failure")
+    rendered = metrics.render()
+    assert 'frbvoe_stage_seconds_bucket{stage="validation",le="0.0005"} 1' in rendered
+    assert 'frbvoe_stage_seconds_bucket{stage="validation",le="+Inf"} 2' in rendered
+    assert 'frbvoe_stage_seconds_count{stage="validation"} 2' in rendered
+    assert 'frbvoe_stage_seconds_sum{stage="validation"} 0.2002' in rendered
+    assert (
+        'frbvoe_voevents_total{kind="detection",stage="comet",status="Queued"} 1'
+        in rendered
+    )
+    assert (
+        'frbvoe_voevents_total{kind="unknown",stage="validation",status="Failure"} 1'
+        in rendered
+    )
+
+
+def test_metrics_time():
+    metrics = Metrics()
+
+    async def fail():
+        raise RuntimeError
+
+    assert asyncio.run(metrics.time("comet", asyncio.sleep(0, "sent"))) == "sent"
+    try:
+        asyncio.run(metrics.time("comet", fail()))
+    except RuntimeError:
+        pass
+    assert 'frbvoe_stage_seconds_count{stage="comet"} 2' in metrics.render()
+
+
+def test_memory():
+    resident, peak = memory()
+    assert 0 < resident <= peak
+
+
+def test_metrics_across_workers():
+    shared = allocate(slots=4)
+    context = multiprocessing.get_context("fork")
+    recorded, done = context.Semaphore(0), context.Event()
+    workers = [
+        context.Process(target=record, args=(shared, recorded, done)) for _ in range(2)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        recorded.acquire()
+    metrics = Metrics(*shared)
+    rendered = metrics.render()
+    done.set()
+    for worker in workers:
+        worker.join()
+    assert metrics.slot == 2
+    assert 'frbvoe_stage_seconds_count{stage="database"} 2' in rendered
+    assert (
+        'frbvoe_voevents_total{kind="detection",stage="database",status="Success"} 2'
+        in rendered
+    )
+    # Gauges are per worker.
+    assert rendered.count("frbvoe_outbox_depth{") == 3
+    assert 'frbvoe_outbox_depth{worker="2"} 0' in rendered
+    # The counters of exited workers stay.
+    assert 'frbvoe_stage_seconds_count{stage="database"} 2' in metrics.render()
+
+
+def test_metrics_sample_pools():
+    metrics = Metrics()
+    http = SimpleNamespace(
+        metrics={"requests": 3, "opened": 1, "reused": 2, "waiting": 4}
+    )
+    smtp = SimpleNamespace(metrics={"opened": 1, "reused": 0, "messages": 1})
+    metrics.sample({"http": http, "smtp": smtp, "tns_names": None})
+    http.metrics.update(requests=5, reused=4, waiting=0)
+    metrics.sample({"http": http, "smtp": smtp, "tns_names": None})
+    rendered = metrics.render()
+    assert "frbvoe_http_requests_total 5" in rendered
+    assert "frbvoe_http_connections_reused_total 4" in rendered
+    assert "frbvoe_smtp_messages_total 1" in rendered
+    assert "frbvoe_tns_names_cached_total 0" in rendered
+    assert 'frbvoe_http_waiting_requests{worker="0"} 0' in rendered
+    # A new worker in the slot keeps counting from there.
+    restarted = Metrics(metrics.values, metrics.pids, multiprocessing.Lock())
+    restarted.sample({"http": SimpleNamespace(metrics={"requests": 1, "waiting": 0})})
+    assert "frbvoe_http_requests_total 6" in restarted.render()
@@ -0,0 +1,158 @@
+"""Tests for the durable outbound queue."""
+
+import asyncio
+
+from frbvoe.utilities.outbox import (
+    FileOutbox,
+    PartialBroadcast,
+    deliver,
+    idempotency_key,
+)
+
+payload = {
+    "kind": "detection",
+    "observatory_name": "CHIME",
+    "date": "2025-01-13 16:55:08.844845",
+    "email": "john.smith@email.com",
+}
+
+
+def test_idempotency_key():
+    assert idempotency_key(payload, "comet") == idempotency_key(dict(payload), "comet")
+    assert idempotency_key(payload, "comet") != idempotency_key(payload, "email")
+    traced = {**payload, "trace": {"trace_id": "0" * 32}}
+    assert idempotency_key(traced, "comet") == idempotency_key(payload, "comet")
+
+
+def test_put_is_idempotent(tmp_path):
+    async def run():
+        outbox = FileOutbox(tmp_path / "outbox.jsonl")
+        await outbox.setup()
+        await outbox.put(payload, ["comet", "email"])
+        await outbox.put(payload, ["comet"])
+        return await outbox.depth()
+
+    assert asyncio.run(run()) == 2
+
+
+def test_failed_broadcasts_are_retried_and_survive_restarts(tmp_path):
+    sent = []
+
+    async def flaky(item):
+        raise ConnectionError("comet is down")
+
+    async def working(item):
+        sent.append(item)
+
+    async def run():
+        outbox = FileOutbox(tmp_path / "outbox.jsonl", base_backoff=60.0)
+        await outbox.setup()
+        await outbox.put(payload, ["comet"])
+        assert await deliver(outbox, {"comet": flaky}, batch_size=10) == 1
+        # Backing off, so nothing is due yet.
+        assert await deliver(outbox, {"comet": working}, batch_size=10) == 0
+        # A restarted worker replays the journal and retries straight away.
+        restarted = FileOutbox(tmp_path / "outbox.jsonl")
+        await restarted.setup()
+        assert (await restarted.claim(10))[0]["attempts"] == 1
+        restarted = FileOutbox(tmp_path / "outbox.jsonl")
+        await restarted.setup()
+        await deliver(restarted, {"comet": working}, batch_size=10)
+        return await restarted.depth()
+
+    assert asyncio.run(run()) == 0
+    assert sent == [payload]
+
+
+def test_slow_broadcasts_keep_their_lease(tmp_path):
+    sent = []
+
+    async def slow(item):
+        await asyncio.sleep(0.2)
+        sent.append(item)
+
+    async def run():
+        outbox = FileOutbox(tmp_path / "outbox.jsonl", lease=0.1)
+        await outbox.setup()
+        await outbox.put(payload, ["comet"])
+        sending = asyncio.create_task(deliver(outbox, {"comet": slow}, 10))
+        await asyncio.sleep(0.15)
+        # Past the first lease, but it was extended while the send ran.
+        assert await outbox.claim(10) == []
+        await sending
+        return await outbox.depth()
+
+    assert asyncio.run(run()) == 0
+    assert sent == [payload]
+
+
+def test_partial_broadcasts_retry_the_rest(tmp_path):
+    sent = []
+
+    async def partial(item):
+        raise PartialBroadcast("bob is busy", {**item, "recipients": ["bob"]})
+
+    async def working(item):
+        sent.append(item)
+
+    async def run():
+        outbox = FileOutbox(tmp_path / "outbox.jsonl", base_backoff=60.0)
+        await outbox.setup()
+        await outbox.put(payload, ["email"])
+        await deliver(outbox, {"email": partial}, batch_size=10)
+        restarted = FileOutbox(tmp_path / "outbox.jsonl")
+        await restarted.setup()
+        await deliver(restarted, {"email": working}, batch_size=10)
+
+    asyncio.run(run())
+    assert sent == [{**payload, "recipients": ["bob"]}]
+
+
+def test_broadcasts_die_after_max_attempts(tmp_path):
+    async def flaky(item):
+        raise ConnectionError("comet is down")
+
+    async def run():
+        outbox = FileOutbox(tmp_path / "outbox.jsonl", base_backoff=0.0, max_attempts=2)
+        await outbox.setup()
+        await outbox.put(payload, ["comet"])
+        await deliver(outbox, {"comet": flaky}, batch_size=10)
+        await deliver(outbox, {"comet": flaky}, batch_size=10)
+        assert await deliver(outbox, {"comet": flaky}, batch_size=10) == 0
+        restarted = FileOutbox(tmp_path / "outbox.jsonl")
+        await restarted.setup()
+        return await restarted.depth(), list(restarted.items.values())
+
+    depth, items = asyncio.run(run())
+    assert depth == 0
+    assert [(item["status"], item["attempts"]) for item in items] == [("dead", 2)]
+
+
+def test_sent_keys_survive_restarts_within_the_retention(tmp_path):
+    sent = []
+
+    async def working(item):
+        sent.append(item)
+
+    async def run(retention):
+        outbox = FileOutbox(tmp_path / "outbox.jsonl", retention=retention)
+        await outbox.setup()
+        await outbox.put(payload, ["comet"])
+        await deliver(outbox, {"comet": working}, batch_size=10)
+        restarted = FileOutbox(tmp_path / "outbox.jsonl", retention=retention)
+        await restarted.setup()
+        await restarted.put(payload, ["comet"])
+        return await restarted.depth()
+
+    # Enqueueing a sent broadcast again is a no-op after a restart.
+    assert asyncio.run(run(60.0)) == 0
+    # Until it is older than the retention.
+    (tmp_path / "outbox.jsonl").unlink()
+    assert asyncio.run(run(-1.0)) == 1
+    assert sent == [payload, payload]
+
+
+def test_backoff_is_capped():
+    outbox = FileOutbox("unused.jsonl", base_backoff=1.0, max_backoff=10.0)
+    assert 0.5 <= outbox.backoff(1) <= 1.0
+    assert 5.0 <= outbox.backoff(20) <= 10.0
@@ -0,0 +1,79 @@
+"""Tests for the token buckets shared across workers."""
+
+import asyncio
+import multiprocessing
+
+from frbvoe.utilities.ratelimit import RateLimiter, allocate, rates
+
+
+def reserve(shared, delays):
+    limiter = RateLimiter({"tns": (10.0, 2.0)}, *shared)
+    for _ in range(3):
+        delays.put(limiter.reserve("tns"))
+
+
+def test_rate_limiter():
+    limiter = RateLimiter({"tns": (100.0, 2.0), "comet": (0.0, 1.0)})
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        # The burst goes at once, then one request per 10ms, in turn.
+        await asyncio.gather(*(limiter.acquire("tns") for _ in range(6)))
+        elapsed = loop.time() - start
+        # Unlimited buckets do not wait.
+        await asyncio.wait_for(limiter.acquire("comet"), timeout=0.001)
+        await limiter.acquire("smtp")
+        return elapsed
+
+    assert 0.035 < asyncio.run(run()) < 0.5
+    assert 0.09 < limiter.waited["tns"] < 0.2
+    assert "comet" not in limiter.waited
+
+
+def test_rate_limiter_cancelled():
+    limiter = RateLimiter({"tns": (1.0, 1.0)})
+
+    async def run():
+        await limiter.acquire("tns")
+        waiting = asyncio.ensure_future(limiter.acquire("tns"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+    asyncio.run(run())
+    # The token of the cancelled call was given back.
+    assert limiter.reserve("tns") < 1.0
+
+
+def test_rate_limiter_refunds_are_capped():
+    limiter = RateLimiter({"tns": (1.0, 2.0)})
+    limiter.reserve("tns", -1.0)
+    # A refund into a full bucket leaves it at its burst.
+    assert limiter.values[limiter.index["tns"]] == 2.0
+    assert limiter.reserve("tns") == 0.0
+    assert limiter.reserve("tns") == 0.0
+    assert limiter.reserve("tns") > 0.9
+
+
+def test_rate_limiter_across_workers():
+    shared = allocate()
+    context = multiprocessing.get_context("fork")
+    delays = context.Queue()
+    workers = [context.Process(target=reserve, args=(shared, delays)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # Six requests share a burst of two, then go one per 100ms.
+    waits = sorted(delays.get() for _ in range(6))
+    assert waits[:2] == [0.0, 0.0]
+    assert 0.3 < waits[-1] <= 0.4
+
+
+def test_rates():
+    config = {"COMET_RATE": "5", "COMET_BURST": "10"}
+    limits = rates(config)
+    assert limits["comet"] == (5.0, 10.0)
+    assert limits["tns"] == (0.5, 5.0)
+    assert limits["smtp"][0] == 0.0
@@ -0,0 +1,170 @@
+"""Tests for the repeater association."""
+
+import asyncio
+
+from bson import ObjectId
+
+from frbvoe.utilities.repeaters import RepeaterIndex
+
+
+class Cursor:
+    # Stands in for a Motor cursor, sorted by _id.
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction):
+        self.documents = sorted(self.documents, key=lambda document: document[key])
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class Collection:
+    # Stands in for a Motor collection, with the queries of RepeaterIndex.
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection):
+        since = query.get("_id", {}).get("$gte")
+        return Cursor(
+            [
+                document
+                for document in self.documents
+                if "location" in document
+                and (since is None or document["_id"] >= since)
+            ]
+        )
+
+    def watch(self, pipeline, **kwargs):
+        return ChangeStream(self)
+
+
+class ChangeStream:
+    # Stands in for a Motor change stream, yielding the inserts made after it
+    # was opened.
+    def __init__(self, collection):
+        self.collection = collection
+        self.seen = len(collection.documents)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def try_next(self):
+        await asyncio.sleep(0)
+        if self.seen == len(self.collection.documents):
+            return None
+        self.seen += 1
+        return {"fullDocument": self.collection.documents[self.seen - 1]}
+
+
+def event(right_ascension, declination, dm, tns_name=None, **fields):
+    return {
+        "_id": ObjectId(),
+        "right_ascension": right_ascension,
+        "declination": declination,
+        "pos_error_deg_95": 0.1,
+        "dm": dm,
+        "dm_error": 0.5,
+        "tns_name": tns_name,
+        "location": {},
+        **fields,
+    }
+
+
+def test_associate():
+    index = RepeaterIndex(dm_tolerance=2.0)
+    index.add(
+        [
+            event(55.29, 14.20, 349.0),
+            event(55.30, 14.21, 350.0, "FRB20200113A"),
+            event(55.29, 14.20, 560.0, "FRB20190101B"),
+            event(120.0, -30.0, 350.0, "FRB20180101C"),
+        ]
+    )
+    association = index.associate(
+        {"right_ascension": 55.295, "declination": 14.2, "dm": 350.5}
+    )
+    assert association["tns_name"] == "FRB20200113A"
+    assert association["dm"] == 350.0
+    assert association["separation"] < 0.1
+    # The DM rules out every source within error.
+    assert (
+        index.associate({"right_ascension": 55.29, "declination": 14.2, "dm": 450.0})
+        is None
+    )
+    assert index.associate({"right_ascension": 10.0, "declination": 10.0}) is None
+    assert index.associate({"right_ascension": None, "declination": None}) is None
+
+
+def test_refresh_skips_local_events():
+    archived = [event(55.29, 14.20, 349.0), event(120.0, -30.0, 350.0)]
+    collection = Collection(archived)
+    index = RepeaterIndex()
+    assert asyncio.run(index.refresh(collection)) == 2
+
+    # Saved by this worker, then by another one.
+    local = event(200.0, 45.0, 800.0, "FRB20250101A", trace={"spans": []})
+    index.saved(local)
+    archived.extend([local, event(10.0, 10.0, 100.0)])
+    assert asyncio.run(index.refresh(collection)) == 1
+    assert len(index) == 4
+    assert index.last_id == archived[-1]["_id"]
+    # Only the fields an association reports are kept, in columns.
+    assert index.past(2) == {
+        "_id": local["_id"],
+        "dm": 800.0,
+        "dm_error": 0.5,
+        "tns_name": "FRB20250101A",
+        "internal_id": None,
+    }
+    assert not index.catalog.ids
+    # Events without a position are not remembered.
+    index.saved({**event(None, None, 10.0), "location": None})
+    assert len(index.known) == 4
+    association = index.associate(
+        {"right_ascension": 200.01, "declination": 45.0, "dm": 801.0}
+    )
+    assert association["tns_name"] == "FRB20250101A"
+
+
+def test_refresh_reads_late_commits_again():
+    early, late = event(55.29, 14.20, 349.0), event(120.0, -30.0, 350.0)
+    # The event with the earlier _id commits after the later one was read.
+    archived = [late]
+    collection = Collection(archived)
+    index = RepeaterIndex()
+    assert asyncio.run(index.refresh(collection)) == 1
+    archived.append(early)
+    assert asyncio.run(index.refresh(collection)) == 1
+    assert asyncio.run(index.refresh(collection)) == 0
+    assert len(index) == 2
+    # The _ids outside the window are forgotten.
+    index.overlap = -1.0
+    index.compact()
+    assert index.known == set()
+
+
+def test_watch():
+    archived = [event(55.29, 14.20, 349.0)]
+    collection = Collection(archived)
+    index = RepeaterIndex()
+
+    async def run():
+        stop = asyncio.Event()
+        watching = asyncio.ensure_future(index.watch(collection, stop, 1.0))
+        await asyncio.sleep(0.01)
+        archived.append(event(120.0, -30.0, 350.0))
+        await asyncio.sleep(0.01)
+        stop.set()
+        await watching
+
+    asyncio.run(run())
+    assert len(index) == 2
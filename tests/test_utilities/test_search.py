@@ -0,0 +1,65 @@
+"""Tests for the VOEvent archive search."""
+
+from math import radians
+
+import pytest
+from bson import ObjectId
+
+from frbvoe.utilities.search import build_query, encode_cursor, location
+
+
+def test_location():
+    assert location(55.2938, 14.2049)["coordinates"] == [55.2938, 14.2049]
+    assert location(270.0, -30.0)["coordinates"] == [-90.0, -30.0]
+    assert location(None, 14.2049) is None
+
+
+def test_build_query():
+    query, limit = build_query(
+        {
+            "ra": "350",
+            "dec": "10",
+            "radius": "2",
+            "start": "2025-01-01",
+            "dm_min": "100",
+            "limit": "10",
+        }
+    )
+    assert query == {
+        "location": {"$geoWithin": {"$centerSphere": [[-10.0, 10.0], radians(2)]}},
+        "date": {"$gte": "2025-01-01"},
+        "dm": {"$gte": 100.0},
+    }
+    assert limit == 10
+
+
+def test_build_query_cursor():
+    _id = ObjectId()
+    cursor = encode_cursor({"date": "2025-01-13 16:55:08.844845", "_id": _id})
+    query, _ = build_query({"kind": "detection", "cursor": cursor})
+    assert query == {
+        "$and": [
+            {"kind": "detection"},
+            {
+                "$or": [
+                    {"date": {"$lt": "2025-01-13 16:55:08.844845"}},
+                    {"date": "2025-01-13 16:55:08.844845", "_id": {"$lt": _id}},
+                ]
+            },
+        ]
+    }
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        {"ra": "10", "dec": "10"},
+        {"ra": "10", "dec": "10", "radius": "0"},
+        {"dm_min": "high"},
+        {"limit": "5000"},
+        {"cursor": "not-a-cursor"},
+    ],
+)
+def test_build_query_invalid(args):
+    with pytest.raises(ValueError):
+        build_query(args)
@@ -0,0 +1,105 @@
+"""Tests for the pooled SMTP client."""
+
+import asyncio
+
+from frbvoe.utilities.smtp import SMTPPool
+
+
+def smtp_server(messages):
+    async def serve(reader, writer):
+        # Minimal SMTP server recording the envelope recipients of every message.
+        writer.write(b"220 localhost ready\r\n")
+        recipients = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            command = line.strip().upper()
+            if command.startswith((b"EHLO", b"HELO")):
+                writer.write(b"250 localhost\r\n")
+            elif command.startswith(b"RCPT"):
+                recipients.append(line.strip()[9:].strip(b"<>").decode())
+                if recipients[-1].startswith("refused"):
+                    writer.write(b"550 no\r\n")
+                elif recipients[-1].startswith("busy"):
+                    writer.write(b"450 later\r\n")
+                else:
+                    writer.write(b"250 ok\r\n")
+            elif command == b"DATA":
+                writer.write(b"354 go ahead\r\n")
+                await writer.drain()
+                await reader.readuntil(b"\r\n.\r\n")
+                messages.append(
+                    [r for r in recipients if not r.startswith(("refused", "busy"))]
+                )
+                recipients = []
+                writer.write(b"250 queued\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                writer.close()
+                return
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+
+    return serve
+
+
+def test_deliver_in_bcc_batches():
+    async def run():
+        messages = []
+        server = await asyncio.start_server(smtp_server(messages), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = SMTPPool(
+            "127.0.0.1", port=port, start_tls=False, size=2, bcc_size=3, timeout=5
+        )
+        recipients = [f"user{n}@example.com" for n in range(7)]
+        report = await pool.deliver(
+            "frb@example.com", recipients + ["refused@example.com"], b"Subject: FRB"
+        )
+        second = await pool.deliver("frb@example.com", recipients[:1], b"Subject: FRB")
+        await pool.close()
+        server.close()
+        return messages, report, second, pool.metrics
+
+    messages, report, second, metrics = asyncio.run(run())
+    assert sorted(sum(messages, [])) == sorted(
+        [f"user{n}@example.com" for n in range(7)] + ["user0@example.com"]
+    )
+    assert report["recipients"] == 8
+    assert report["messages"] == 3
+    assert report["failed"] == 0
+    assert list(report["refused"]) == ["refused@example.com"]
+    assert report["undelivered"] == []
+    assert set(report["timings"]) == {"acquire", "connect", "send", "total"}
+    assert second["messages"] == 1
+    # Two connections at most, kept open between alerts.
+    assert metrics["opened"] == 2
+    assert metrics["messages"] == 4
+
+
+def test_deliver_reports_undelivered():
+    async def run():
+        messages = []
+        server = await asyncio.start_server(smtp_server(messages), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = SMTPPool("127.0.0.1", port=port, start_tls=False, bcc_size=2, timeout=5)
+        report = await pool.deliver(
+            "frb@example.com",
+            ["user@example.com", "refused@example.com", "busy@example.com"],
+            b"Subject: FRB",
+        )
+        await pool.close()
+        server.close()
+        # A batch that fails outright is left to another attempt as a whole.
+        closed = SMTPPool("127.0.0.1", port=port, start_tls=False, timeout=1)
+        failed = await closed.deliver("frb@example.com", ["a@example.com"], b"")
+        return report, failed
+
+    report, failed = asyncio.run(run())
+    # Only the temporary refusal is worth another attempt.
+    assert set(report["refused"]) == {"refused@example.com", "busy@example.com"}
+    assert report["undelivered"] == ["busy@example.com"]
+    assert failed["failed"] == 1
+    assert failed["undelivered"] == ["a@example.com"]
@@ -0,0 +1,101 @@
+"""Tests for the columnar archive snapshots."""
+
+import asyncio
+
+import numpy as np
+from bson import ObjectId
+
+from frbvoe.utilities.snapshot import load, snapshot, snapshot_async
+
+DOCUMENTS = [
+    {
+        "_id": ObjectId(),
+        "kind": "detection",
+        "observatory_name": "CHIME",
+        "date": "2020-01-13 16:55:08.844845",
+        "dm": 298.53,
+        "snr": 13.8,
+        "npol": 2,
+        "tns_name": "FRB20200113A",
+    },
+    {
+        "_id": ObjectId(),
+        "kind": "retraction",
+        "observatory_name": "CHIME",
+        "date": "not a date",
+    },
+    {
+        "_id": ObjectId(),
+        "kind": "detection",
+        "observatory_name": "DSA-110",
+        "date": "2021-02-01 00:00:00",
+        "dm": 512.0,
+    },
+]
+
+
+class Cursor:
+    # Stands in for pymongo and Motor cursors.
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class Collection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find_one(self, query, projection, sort):
+        return max(self.documents, key=lambda document: document["_id"])
+
+    def count_documents(self, query):
+        return len(self.documents)
+
+    def find(self, query, projection, batch_size):
+        return Cursor(self.documents)
+
+
+class AsyncCollection(Collection):
+    async def find_one(self, *args, **kwargs):
+        return super().find_one(*args, **kwargs)
+
+    async def count_documents(self, query):
+        return super().count_documents(query)
+
+
+def test_snapshot(tmp_path):
+    directory = snapshot(Collection(DOCUMENTS), tmp_path, batch_size=2)
+    loaded = load(tmp_path)
+    assert loaded.path == directory
+    assert loaded.rows == 3
+    assert isinstance(loaded["dm"], np.memmap)
+    np.testing.assert_array_equal(loaded["dm"], [298.53, np.nan, 512.0])
+    np.testing.assert_array_equal(loaded["npol"], [2.0, np.nan, np.nan])
+    assert loaded["date"][0] == np.datetime64("2020-01-13T16:55:08.844845")
+    assert np.isnat(loaded["date"][1])
+    assert loaded["_id"][2] == DOCUMENTS[2]["_id"].binary
+    assert (loaded["kind"] == loaded.code("kind", "detection")).sum() == 2
+    assert loaded.code("kind", "update") == -1
+    assert list(loaded.strings("tns_name")) == ["FRB20200113A", None, None]
+    assert list(loaded.strings("observatory_name")) == ["CHIME", "CHIME", "DSA-110"]
+
+
+def test_snapshot_rotation(tmp_path):
+    collection = AsyncCollection(DOCUMENTS[:2])
+    first = asyncio.run(snapshot_async(collection, tmp_path, keep=1))
+    collection.documents = DOCUMENTS
+    second = asyncio.run(snapshot_async(collection, tmp_path, keep=1))
+    third = snapshot(Collection(DOCUMENTS), tmp_path, keep=1)
+    assert not first.exists()
+    assert second.exists()
+    assert load(tmp_path).path == third
+    assert load(second).rows == 3
@@ -0,0 +1,46 @@
+import asyncio
+
+from frbvoe.utilities.subscribers import SubscriberRegistry
+
+
+def subscriber(_id, email, service):
+    return {
+        "_id": _id,
+        "contact_email": f"contact{_id}@example.com",
+        "subscriber_email": email,
+        "requested_service": service,
+    }
+
+
+def test_registry_apply():
+    registry = SubscriberRegistry(collection=None)
+    registry.apply(
+        {"operationType": "insert", "fullDocument": subscriber(1, "a@b.com", "emails")}
+    )
+    registry.apply(
+        {"operationType": "insert", "fullDocument": subscriber(2, None, "both")}
+    )
+    registry.apply(
+        {"operationType": "insert", "fullDocument": subscriber(3, "c@d.com", "xmls")}
+    )
+    assert registry.emails == ("a@b.com", "contact2@example.com")
+    assert [s["_id"] for s in registry.recipients("xmls")] == [3, 2]
+
+    registry.apply(
+        {"operationType": "update", "fullDocument": subscriber(1, "a@b.com", "xmls")}
+    )
+    registry.apply({"operationType": "delete", "documentKey": {"_id": 2}})
+    assert registry.emails == ()
+    assert [s["_id"] for s in registry.recipients("xmls")] == [1, 3]
+
+    registry.apply({"operationType": "drop"})
+    assert registry.subscribers == {}
+
+
+def test_registry_sleep_stops_early():
+    async def main():
+        stop = asyncio.Event()
+        stop.set()
+        await asyncio.wait_for(SubscriberRegistry._sleep(stop, 60), timeout=1)
+
+    asyncio.run(main())
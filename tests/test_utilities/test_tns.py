@@ -0,0 +1,214 @@
+"""Tests for the batched TNS client."""
+
+import asyncio
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import httpx
+
+from frbvoe.utilities.tns import NameCache, TNSClient, TNSError, tns_name
+
+ACCOUNT = (True, "key", "bot")
+
+
+class TNS:
+    # Stands in for the TNS API: rate limited once, and processes a bulk report
+    # after it was polled twice.
+    def __init__(self):
+        self.requests = []
+        self.data = []
+        self.limited = False
+
+    async def post(self, url, headers, data):
+        endpoint = url.rsplit("/", 1)[-1]
+        payload = json.loads(data["data"])
+        self.requests.append((endpoint, payload))
+        self.data.append(data)
+        if not self.limited:
+            self.limited = True
+            return httpx.Response(429, json={}, headers={"x-rate-limit-reset": "0.01"})
+        if endpoint == "bulk-report":
+            return httpx.Response(200, json={"data": {"report_id": 42}})
+        polls = sum(sent == "bulk-report-reply" for sent, _ in self.requests)
+        if polls < 3:
+            return httpx.Response(404, json={"id_message": "No reply yet"})
+        feedback = [
+            {"100": {"objname": f"20240101{name}", "name_prefix": "FRB"}}
+            for name in ("A", "B")
+        ] + [{"102": {"message": "Invalid report"}}]
+        return httpx.Response(
+            200, json={"data": {"feedback": {"frb_report": feedback}}}
+        )
+
+
+class Collection:
+    # Stands in for the tns_report collection.
+    def __init__(self):
+        self.documents = {}
+
+    async def insert_one(self, document):
+        self.documents[document["_id"]] = document
+
+    async def update_one(self, query, update):
+        document = self.documents[query["_id"]]
+        matched = document.get("owner") == query.get("owner", document.get("owner"))
+        if matched:
+            document.update(update["$set"])
+        return SimpleNamespace(matched_count=int(matched))
+
+    async def find_one_and_update(self, query, update, return_document):
+        now = query["$or"][0]["lease"]["$lt"]
+        for document in self.documents.values():
+            if document["status"] == "submitted" and document.get("lease", 0) < now:
+                document.update(update["$set"])
+                return dict(document)
+        return None
+
+
+def test_tns_name():
+    assert tns_name({"100": {"objname": "20240101A"}}) == "FRB20240101A"
+    assert tns_name({"101": {"objname": "FRB20240101A"}}) == "FRB20240101A"
+    assert tns_name({"102": {"message": "Invalid report"}}) is None
+
+
+def test_tns_client():
+    api, collection, saved = TNS(), Collection(), []
+
+    async def named(references, names):
+        saved.extend(zip(references, names))
+
+    async def run():
+        client = TNSClient(api, collection=collection, named=named, base_backoff=0.001)
+        futures = [client.submit(ACCOUNT, {"internal_id": n}, n) for n in "abc"]
+        assert await client.flush() == [42]
+        names = await asyncio.gather(*futures, return_exceptions=True)
+        return names
+
+    names = asyncio.run(run())
+    # One bulk report for the three, retried once after the rate limit.
+    sent = [endpoint for endpoint, _ in api.requests]
+    assert sent[:2] == ["bulk-report", "bulk-report"]
+    assert len(api.requests[1][1]["frb_report"]) == 3
+    assert names[:2] == ["FRB20240101A", "FRB20240101B"]
+    assert isinstance(names[2], TNSError)
+    assert saved == [("a", "FRB20240101A"), ("b", "FRB20240101B"), ("c", None)]
+    assert collection.documents[42]["status"] == "named"
+    # The API key is not stored.
+    assert collection.documents[42]["account"] == {"sandbox": True, "bot_name": "bot"}
+
+
+def test_tns_client_resumes():
+    api, collection = TNS(), Collection()
+    api.limited = True
+    collection.documents[42] = {
+        "_id": 42,
+        "account": {"sandbox": True, "bot_name": "bot"},
+        "reports": [{}, {}, {}],
+        "references": [None] * 3,
+        "status": "submitted",
+        "attempts": 1,
+        "submitted": 0.0,
+    }
+
+    async def run():
+        # Without the API key of the bot, the report cannot be polled; it is
+        # left to another worker once the lease lapses.
+        client = TNSClient(api, collection=collection, base_backoff=0.001, lease=0)
+        assert await client.resume() == 0
+        client = TNSClient(
+            api, collection=collection, base_backoff=0.001, api_keys={"bot": "key"}
+        )
+        client.expiry = float("inf")
+        assert await client.resume() == 1
+        # Another worker does not claim the report while it is polled.
+        other = TNSClient(api, collection=collection, api_keys={"bot": "key"})
+        assert await other.resume() == 0
+        await asyncio.gather(*client.polls)
+
+    asyncio.run(run())
+    assert collection.documents[42]["names"] == ["FRB20240101A", "FRB20240101B", None]
+    assert all(data["api_key"] == "key" for data in api.data)
+
+
+class Names:
+    # Stands in for the tns_cache collection.
+    def __init__(self):
+        self.documents = {}
+
+    async def find_one(self, query):
+        document = self.documents.get(query["_id"])
+        if document and document["expires"] > query["expires"]["$gt"]:
+            return document
+        return None
+
+    async def update_one(self, query, update, upsert):
+        self.documents.setdefault(query["_id"], {}).update(update["$set"])
+
+
+def test_name_cache():
+    lookups = []
+
+    async def lookup(account, internal_name):
+        lookups.append(internal_name)
+        await asyncio.sleep(0.01)
+        return {"20240101A": "FRB20240101A"}.get(internal_name)
+
+    async def run(cache):
+        # Concurrent lookups of a name make one request to the TNS.
+        names = await asyncio.gather(
+            *(cache.get(ACCOUNT, "20240101A") for _ in range(5))
+        )
+        assert names == ["FRB20240101A"] * 5
+        # Unknown names are cached too.
+        assert await cache.get(ACCOUNT, "unknown") is None
+        assert await cache.get(ACCOUNT, "unknown") is None
+        # The sandbox is cached separately.
+        assert await cache.get((False, "key", "bot"), "20240101A") == "FRB20240101A"
+
+    collection = Names()
+    cache = NameCache(lookup, collection=collection)
+    asyncio.run(run(cache))
+    assert lookups == ["20240101A", "unknown", "20240101A"]
+    assert cache.metrics["coalesced"] == 4
+    assert cache.metrics["hits"] == 1
+    assert collection.documents["sandbox:unknown"]["tns_name"] is None
+    # A date, for the TTL index of the collection.
+    assert isinstance(collection.documents["sandbox:unknown"]["expires"], datetime)
+
+    # Another worker finds the names in MongoDB, until they expire.
+    other = NameCache(lookup, collection=collection, negative_ttl=0.0)
+    assert asyncio.run(other.get(ACCOUNT, "20240101A")) == "FRB20240101A"
+    assert other.metrics["stored"] == 1
+    asyncio.run(other.put(ACCOUNT, "unknown", None))
+    assert asyncio.run(other.get(ACCOUNT, "unknown")) is None
+    assert lookups[-1] == "unknown"
+
+
+def test_tns_search():
+    class Search(TNS):
+        async def post(self, url, headers, data):
+            assert url.endswith("get/search")
+            reply = [{"objname": "20240101A", "prefix": "FRB"}]
+            return httpx.Response(200, json={"data": {"reply": reply}})
+
+    client = TNSClient(Search())
+    assert asyncio.run(client.search(ACCOUNT, "1234")) == "FRB20240101A"
+
+
+def test_tns_client_loses_its_lease():
+    api, collection = TNS(), Collection()
+    api.limited = True
+
+    async def run():
+        client = TNSClient(api, collection=collection, base_backoff=0.001)
+        future = client.submit(ACCOUNT, {"internal_id": "a"})
+        await client.flush()
+        # Claimed by another worker, e.g. after a long pause of this one.
+        collection.documents[42]["owner"] = "other"
+        await asyncio.gather(*client.polls)
+        return future
+
+    future = asyncio.run(run())
+    assert not future.done()
+    assert [endpoint for endpoint, _ in api.requests] == ["bulk-report"]
@@ -0,0 +1,153 @@
+"""Tests for the tracing of the VOEvents."""
+
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+import pytest
+
+from frbvoe.utilities.tracing import (
+    Trace,
+    Tracer,
+    detection_time,
+    latency_report,
+    otlp,
+    span,
+)
+
+
+class Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+
+class Collection:
+    # Stands in for the Motor collection of the archived VOEvents.
+    def __init__(self, trace_ids):
+        self.spans = {trace_id: [] for trace_id in trace_ids}
+
+    async def bulk_write(self, requests, ordered):
+        matched = 0
+        for request in requests:
+            trace_id = request._filter["trace.trace_id"]
+            if trace_id in self.spans:
+                self.spans[trace_id] += request._doc["$push"]["trace.spans"]["$each"]
+                matched += 1
+        return SimpleNamespace(matched_count=matched)
+
+    def find(self, query, projection):
+        return Cursor(
+            [
+                {"trace": {"trace_id": trace_id}}
+                for trace_id in query["trace.trace_id"]["$in"]
+                if trace_id in self.spans
+            ]
+        )
+
+
+def test_detection_time():
+    assert detection_time("1970-01-01 00:00:01.5") == 1_500_000_000
+    assert detection_time("1970-01-01T01:00:01+01:00") == 1_000_000_000
+    assert detection_time("not a date") is None
+    assert detection_time(None) is None
+
+
+def test_trace():
+    trace = Trace("2020-01-13 16:55:08", received=1)
+    with trace.span("validate"):
+        pass
+    try:
+        with trace.span("associate"):
+            raise ValueError
+    except ValueError:
+        pass
+    document = trace.document()
+    assert document["received"] == 1
+    assert document["detected"] == detection_time("2020-01-13 16:55:08")
+    assert [span["name"] for span in document["spans"]] == ["validate", "associate"]
+    assert [span["status"] for span in document["spans"]] == ["ok", "error"]
+    assert len(document["trace_id"]) == 32 and len(document["root"]) == 16
+
+
+def test_otlp():
+    trace = Trace("2020-01-13 16:55:08")
+    root = span("create_voe", trace.received, span_id=trace.root)
+    child = span("comet", trace.received, ok=False)
+    exported = otlp(trace.context(), [root, child])
+    spans = exported["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert "parentSpanId" not in spans[0]
+    assert spans[1]["parentSpanId"] == trace.root
+    assert spans[1]["traceId"] == trace.trace_id
+    assert spans[1]["status"] == {"code": 2}
+    assert spans[1]["attributes"][0]["value"]["intValue"] == str(trace.detected)
+
+
+def test_tracer(tmp_path):
+    archived, unarchived = Trace(), Trace()
+    collection = Collection([archived.trace_id])
+    tracer = Tracer(collection, path=tmp_path / "traces.jsonl")
+    tracer.record(archived.context(), [span("persist", 1)], store=False)
+    asyncio.run(tracer.timed(archived, "comet", asyncio.sleep(0)))
+    tracer.record(unarchived.context(), [span("email", 1)])
+    asyncio.run(tracer.flush())
+    assert [span["name"] for span in collection.spans[archived.trace_id]] == ["comet"]
+    # The spans of VOEvents not archived yet wait for a later flush.
+    assert list(tracer.pending) == [unarchived.trace_id]
+    lines = (tmp_path / "traces.jsonl").read_bytes().splitlines()
+    assert len(lines) == 3
+    assert "resourceSpans" in orjson.loads(lines[0])
+    collection.spans[unarchived.trace_id] = []
+    asyncio.run(tracer.flush())
+    assert len(collection.spans[unarchived.trace_id]) == 1
+    assert not tracer.pending and not tracer.attempts
+
+
+class Collector:
+    # Stands in for the HTTP client, posting to a collector that may be down.
+    def __init__(self):
+        self.up = False
+        self.posted = []
+
+    async def post(self, url, json):
+        if not self.up:
+            raise ConnectionError("collector is down")
+        self.posted += json["resourceSpans"]
+        return SimpleNamespace(raise_for_status=lambda: None)
+
+
+def test_tracer_requeues_unsent_exports():
+    collector = Collector()
+    tracer = Tracer(endpoint="http://localhost:4318", client=collector, max_unsent=2)
+    for name in ["comet", "email", "persist"]:
+        tracer.record(Trace().context(), [span(name, 1)], store=False)
+        with pytest.raises(ConnectionError):
+            asyncio.run(tracer.flush())
+    # The oldest request is dropped beyond the cap, and counted.
+    assert len(tracer.unsent) == 2
+    assert tracer.metrics["dropped"] == 1
+    collector.up = True
+    asyncio.run(tracer.flush())
+    names = [
+        resource["scopeSpans"][0]["spans"][0]["name"] for resource in collector.posted
+    ]
+    assert names == ["email", "persist"]
+    assert not tracer.unsent
+
+
+def test_latency_report():
+    rows = [{"comet": float(n), "email": None} for n in range(1, 101)]
+    rows.append({"comet": None, "email": 0.5})
+    rows.append({"comet": None, "email": None})
+    report = latency_report(rows)
+    assert report["comet"]["count"] == 100
+    assert report["comet"]["p50"] == 50.5
+    assert round(report["comet"]["p99"], 2) == 99.01
+    assert report["email"] == {"count": 1, "p50": 0.5, "p95": 0.5, "p99": 0.5}
+    assert report["any"]["count"] == 101
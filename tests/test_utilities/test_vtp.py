@@ -0,0 +1,124 @@
+"""Tests for the built-in VOEvent Transport Protocol broker."""
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+
+from frbvoe.utilities.vtp import (
+    Broker,
+    frame,
+    parse,
+    publish,
+    read_message,
+    run_broker,
+    transport,
+)
+
+VOEVENT = (
+    b"<voe:VOEvent xmlns:voe='http://www.ivoa.net/xml/VOEvent/v2.0'"
+    b" ivorn='ivo://frbvoe/test#1'/>"
+)
+
+
+async def subscribe(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    # Wait for the broker to register the subscriber.
+    await asyncio.sleep(0.05)
+    return reader, writer
+
+
+def test_transport():
+    assert b'version="1.1"' in transport("iamalive", "ivo://frbvoe/test")
+    role, origin = parse(transport("ack", "ivo://frbvoe/test#1", "ivo://sub"))
+    assert (role, origin) == ("ack", "ivo://frbvoe/test#1")
+    assert parse(VOEVENT) == (None, None)
+    assert frame(b"abc") == b"\x00\x00\x00\x03abc"
+
+
+def test_broadcast():
+    async def run():
+        broker = Broker("ivo://frbvoe/test", interval=0.1)
+        stop = asyncio.Event()
+        server = await asyncio.start_server(broker.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        alive = asyncio.ensure_future(broker.alive(stop))
+        reader, writer = await subscribe(port)
+        assert await broker.broadcast(VOEVENT) == 1
+        assert await read_message(reader) == VOEVENT
+        writer.write(frame(transport("ack", "ivo://frbvoe/test#1", "ivo://sub")))
+        # The broker says it is alive, and the subscriber answers.
+        role, origin = parse(await read_message(reader))
+        assert (role, origin) == ("iamalive", "ivo://frbvoe/test")
+        writer.write(frame(transport("iamalive", origin, "ivo://sub")))
+        await asyncio.sleep(0.05)
+        assert len(broker.subscribers) == 1
+        writer.close()
+        await asyncio.sleep(0.05)
+        assert not broker.subscribers
+        stop.set()
+        await alive
+        server.close()
+
+    asyncio.run(run())
+
+
+def test_silent_subscriber():
+    async def run():
+        broker = Broker("ivo://frbvoe/test", interval=0.02, silence=2)
+        stop = asyncio.Event()
+        server = await asyncio.start_server(broker.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        alive = asyncio.ensure_future(broker.alive(stop))
+        reader, _ = await subscribe(port)
+        await asyncio.sleep(0.1)
+        assert not broker.subscribers
+        stop.set()
+        await alive
+        server.close()
+
+    asyncio.run(run())
+
+
+def test_publish():
+    voevents = queue.Queue(maxsize=1)
+    assert publish(voevents, VOEVENT.decode())
+    assert voevents.get() == VOEVENT
+    voevents.put(b"")
+    assert not publish(voevents, VOEVENT.decode())
+
+
+def test_run_broker():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    voevents = multiprocessing.Queue()
+    broker = multiprocessing.Process(
+        target=run_broker,
+        args=(voevents, "127.0.0.1", port),
+        kwargs={"local_ivo": "ivo://frbvoe/test"},
+    )
+    broker.start()
+
+    async def run():
+        for _ in range(100):
+            try:
+                reader, writer = await subscribe(port)
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        voevents.put(VOEVENT)
+        message = await asyncio.wait_for(read_message(reader), timeout=5)
+        writer.close()
+        return message
+
+    try:
+        assert asyncio.run(run()) == VOEVENT
+        # The queue reader stops with the broker.
+        os.kill(broker.pid, signal.SIGTERM)
+        broker.join(timeout=5)
+        assert broker.exitcode == 0
+    finally:
+        broker.kill()